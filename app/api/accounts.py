@@ -38,6 +38,7 @@ from app.models.accounts import (
 )
 from app.models.authentication import TokenData
 from app.models.common import BasicObjectInfo, PyObjectId
+from app.utils.serialization import trusted_response
 
 DB_COLLECTION_ORGANIZATIONS = "organizations"
 DB_COLLECTION_USERS = "users"
@@ -125,7 +126,7 @@ async def register_organization(
 async def get_all_organizations(current_user: TokenData = Depends(get_current_user)):
     organizations = await data_service.find_all(DB_COLLECTION_ORGANIZATIONS)
 
-    return GetMultipleOrganizations_Out(organizations=organizations)
+    return trusted_response(GetMultipleOrganizations_Out(organizations=organizations), exclude_unset=True)
 
 
 @router.get(
@@ -347,7 +348,7 @@ async def get_users(
         for user in users
     ]
 
-    return GetMultipleUsers_Out(users=users_out)
+    return trusted_response(GetMultipleUsers_Out(users=users_out), exclude_unset=True)
 
 
 @router.patch(
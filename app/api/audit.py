@@ -14,7 +14,6 @@
 
 from typing import Optional, Union
 
-import aiohttp
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from pydantic import StrictStr
 
@@ -33,12 +32,20 @@ from app.utils.secrets import get_secret
 
 router = APIRouter()
 
-audit_server_ip = get_secret("audit_service_ip")
-
-audit_server_endpoint = f"http://{audit_server_ip}:3100/loki/api/v1/query_range"
+# Set by the lifespan of the server, so that importing the application doesn't read the initialization vector
+audit_server_endpoint: Optional[str] = None
 loki_query_pattern = "| json "
 
 
+def configure_audit_server():
+    """
+    Read the address of the audit log server from the initialization vector
+    """
+    global audit_server_endpoint
+    audit_server_ip = get_secret("audit_service_ip")
+    audit_server_endpoint = f"http://{audit_server_ip}:3100/loki/api/v1/query_range"
+
+
 @router.get(
     path="/audit-logs",
     description="query by logQL",
@@ -139,6 +146,8 @@ async def audit_incidents_query(
     query = {"query": query_str}
 
     # Execute the query asynchronously
+    import aiohttp
+
     async with aiohttp.ClientSession() as session:
         print("audit_server_endpoint", audit_server_endpoint)
         print("audit_server_endpoint", query)
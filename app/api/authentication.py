@@ -14,19 +14,21 @@
 
 from datetime import datetime
 from time import time
-from typing import List
+from typing import List, Optional
 
 from fastapi import APIRouter, Body, Depends, HTTPException, Path, Response, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from pydantic import ValidationError
 
 from app.data import operations as data_service
 from app.models.accounts import Organization_db, User_Db, UserAccountState, UserInfo_Out, UserRole
 from app.models.authentication import LoginSuccess_Out, RefreshToken_In, TokenData
 from app.models.common import BasicObjectInfo, PyObjectId
 from app.utils.secrets import get_secret
+from app.utils.timing import STAGE_AUTH, current_timings, timed
 
 DB_COLLECTION_USERS = "users"
 DB_COLLECTION_ORGANIZATIONS = "organizations"
@@ -46,6 +48,7 @@ def get_password_hash(salt, password):
     return pwd_context.hash(f"{salt}{password}{password_pepper}")
 
 
+@timed(STAGE_AUTH)
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -60,9 +63,34 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
     except JWTError as exception:
         raise credentials_exception
+
+    # Only the admins can see the detailed timings of their requests
+    timings = current_timings()
+    if timings:
+        timings.debug_allowed = UserRole.SAIL_ADMIN in token_data.roles
+
     return token_data
 
 
+def is_sail_admin_token(authorization: Optional[str]) -> bool:
+    """
+    Check the bearer token of a request before the routing, for the middlewares that are reserved to the admins
+
+    :param authorization: value of the Authorization header
+    :type authorization: Optional[str]
+    :return: True if the token is valid and has the SAIL_ADMIN role
+    :rtype: bool
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        token_data = TokenData(**jwt.decode(token, get_secret("jwt_secret"), algorithms=[ALGORITHM]))
+    except (JWTError, ValidationError):
+        return False
+    return UserRole.SAIL_ADMIN in token_data.roles
+
+
 class RoleChecker:
     def __init__(self, allowed_roles: List[UserRole]):
         self.allowed_roles = allowed_roles
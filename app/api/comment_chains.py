@@ -26,6 +26,8 @@ from app.models.authentication import TokenData
 from app.models.comment_chain import AddComment_In, Comment_Db, CommentChain_Db, GetComment_Out, GetCommentChain_Out
 from app.models.common import PyObjectId
 from app.utils import cache
+from app.utils.etag import DocumentETag
+from app.utils.serialization import trusted_construct
 
 router = APIRouter()
 
@@ -84,7 +86,7 @@ class CommentChain:
 
         if response:
             for comment_chain in response:
-                comment_chain_list.append(CommentChain_Db(**comment_chain))
+                comment_chain_list.append(trusted_construct(CommentChain_Db, comment_chain))
         elif throw_on_not_found:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -177,7 +179,10 @@ async def get_all_comment_chains(
     response_model=GetCommentChain_Out,
     status_code=status.HTTP_200_OK,
     response_model_by_alias=False,
-    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.DATA_MODEL_EDITOR]))],
+    dependencies=[
+        Depends(RoleChecker(allowed_roles=[UserRole.DATA_MODEL_EDITOR])),
+        Depends(DocumentETag(CommentChain.DB_COLLECTION_COMMENTS_CHAIN, "comment_chain_id")),
+    ],
     operation_id="get_comment_chain",
 )
 async def get_comment_chains(
@@ -13,15 +13,14 @@
 #     prior written permission of Secure Ai Labs, Inc.
 # -------------------------------------------------------------------------------
 
+import asyncio
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, Request, Response, status
 from fastapi.encoders import jsonable_encoder
-from pydantic import EmailStr
 
-import app.utils.azure as azure
-from app.api.accounts import get_all_admins, get_organization, get_user
+from app.api.accounts import get_all_admins, get_user
 from app.api.authentication import RoleChecker, get_current_user
 from app.api.datasets import Datasets, get_datset_encryption_key
 from app.api.emails import send_email
@@ -50,7 +49,11 @@ from app.models.data_federations import (
 from app.models.datasets import DatasetEncryptionKey_Out
 from app.models.emails import EmailRequest
 from app.utils import cache
-from app.utils.background_couroutines import add_async_task
+from app.utils.cloud import cloud_provider
+from app.utils.etag import DocumentETag
+from app.utils.jobs import enqueue_job, job_handler
+from app.utils.rsa_key_pool import claim_rsa_key
+from app.utils.serialization import trusted_construct, trusted_response
 
 DB_COLLECTION_DATA_FEDERATIONS = "data-federations"
 DB_COLLECTION_INVITES = "data-federation-invites"
@@ -151,7 +154,7 @@ async def get_all_data_federations(
 
     # Add the organization information to the data federation
     for data_federation in data_federations:
-        data_federation = DataFederation_Db(**data_federation)
+        data_federation = trusted_construct(DataFederation_Db, data_federation)
 
         # Add the organization information to the data federation
         organization_info = await cache.get_basic_orgnization(data_federation.organization_id)
@@ -193,6 +196,7 @@ async def get_all_data_federations(
     response_model_by_alias=False,
     response_model_exclude_unset=True,
     status_code=status.HTTP_200_OK,
+    dependencies=[Depends(DocumentETag(DB_COLLECTION_DATA_FEDERATIONS, "data_federation_id"))],
     operation_id="get_data_federation",
 )
 async def get_data_federation(
@@ -325,24 +329,12 @@ async def invite_researcher(
     add_invite_response = await register_invite(invite_req=invite_req)
     data_federation_db.research_organizations_invites_id.append(add_invite_response.id)
 
-    # Get the current/inviter organization information
-    inviter_organization = await get_organization(current_user.organization_id, current_user)
-
-    # Get list of all the admins of the invited organization
-    admin_users = await get_all_admins(researcher_organization_id)
-    admin_user_emails: List[EmailStr] = []
-    for admin in admin_users.users:
-        admin_user_emails.append(admin.email)
-
-    # Create a background process to send the invitation email
-    add_async_task(
-        send_invite_email(
-            "SAIL: Invitation to join Data Federation as Researcher",
-            getEmailInviteContent(
-                data_federation=data_federation_db.name, inviter_organization=inviter_organization.name
-            ),
-            admin_user_emails,
-        )
+    # Create a background job to send the invitation email
+    await enqueue_job(
+        send_invite_email,
+        {"invite_id": add_invite_response.id},
+        idempotency_key=str(add_invite_response.id),
+        user_id=current_user.id,
     )
 
     await data_service.update_one(
@@ -402,9 +394,8 @@ async def register_data_submitter(
     if not organization:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data Submitter organization not found")
 
-    # Generate RSA key vault keys and update with their handles
-    key_name = f"{str(data_federation_id)}-{str(organization.id)}"
-    data_submitter_key = await generate_rsa_key(key_name)
+    # Take an RSA key vault key from the pool and update with its handle
+    data_submitter_key = await get_data_submitter_key(data_federation_id, organization.id)
 
     # Add the data submitter to the federation list
     data_submitter_key_pair = DataSubmitterIdKeyPair(
@@ -536,24 +527,12 @@ async def invite_data_submitter(
     add_invite_response = await register_invite(invite_req=invite_req)
     data_federation_db.data_submitter_organizations_invites_id.append(add_invite_response.id)
 
-    # Get the current/inviter organization information
-    inviter_organization = await get_organization(current_user.organization_id, current_user)
-
-    # Get list of all the admins of the invited organization
-    admin_users = await get_all_admins(data_submitter_organization_id)
-    admin_user_emails: List[EmailStr] = []
-    for admin in admin_users.users:
-        admin_user_emails.append(admin.email)
-
-    # Create a background process to send the invitation email
-    add_async_task(
-        send_invite_email(
-            "SAIL: Invitation to join Data Federation as Data Submitter",
-            getEmailInviteContent(
-                data_federation=data_federation_db.name, inviter_organization=inviter_organization.name
-            ),
-            admin_user_emails,
-        )
+    # Create a background job to send the invitation email
+    await enqueue_job(
+        send_invite_email,
+        {"invite_id": add_invite_response.id},
+        idempotency_key=str(add_invite_response.id),
+        user_id=current_user.id,
     )
 
     await data_service.update_one(
@@ -703,7 +682,7 @@ async def get_all_invites(
     # Add the inviter information to the invite
     invites_out: List[GetInvite_Out] = []
     for invite in invites:
-        invite = Invite_Db(**invite)
+        invite = trusted_construct(Invite_Db, invite)
         inviter_user: GetUsers_Out = await get_user(
             invite.inviter_organization_id, invite.inviter_user_id, current_user
         )
@@ -717,7 +696,7 @@ async def get_all_invites(
             )
         )
 
-    return GetMultipleInvite_Out(invites=invites_out)
+    return trusted_response(GetMultipleInvite_Out(invites=invites_out), exclude_unset=True)
 
 
 @router.get(
@@ -843,9 +822,8 @@ async def accept_or_reject_invite(
             data_federation.research_organizations_id.append(invite.invitee_organization_id)
             data_federation.research_organizations_invites_id.remove(invite.id)
         if invite.type is InviteType.DF_SUBMITTER:
-            # Generate RSA key vault keys and update with their handles
-            key_name = f"{str(invite.data_federation_id)}-{str(current_user.organization_id)}"
-            data_submitter_key = await generate_rsa_key(key_name)
+            # Take an RSA key vault key from the pool and update with its handle
+            data_submitter_key = await get_data_submitter_key(invite.data_federation_id, current_user.organization_id)
 
             # Add the data submitter to the federation list
             data_submitter_key_pair = DataSubmitterIdKeyPair(
@@ -864,19 +842,38 @@ async def accept_or_reject_invite(
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
-async def send_invite_email(subject: str, email_body: str, emails: List[EmailStr]):
+@job_handler(concurrency=4, max_attempts=3)
+async def send_invite_email(invite_id: PyObjectId):
     """
-    Background task to send emails using the email plugin
-
-    :param subject: Email subject
-    :type subject: str
-    :param email_body: body of email
-    :type email_body: str
-    :param emails: list of email id to send email to
-    :type emails: List[EmailStr]
+    Background job to send the invitation email to the admins of the invited organization using the email plugin,
+    the email is sent twice if the worker stops right after sending it
+
+    :param invite_id: id of the invite
+    :type invite_id: PyObjectId
     """
-    email_req = EmailRequest(to=emails, subject=subject, body=email_body)
-    send_email(email_req)
+    invite = await data_service.find_one(DB_COLLECTION_INVITES, {"_id": str(invite_id)})
+    if not invite:
+        return
+    invite_db = Invite_Db(**invite)
+
+    data_federation = await cache.get_basic_data_federation(invite_db.data_federation_id)
+    inviter_organization = await cache.get_basic_orgnization(invite_db.inviter_organization_id)
+    admin_users = await get_all_admins(invite_db.invitee_organization_id)
+
+    if invite_db.type == InviteType.DF_RESEARCHER:
+        subject = "SAIL: Invitation to join Data Federation as Researcher"
+    else:
+        subject = "SAIL: Invitation to join Data Federation as Data Submitter"
+    email_req = EmailRequest(
+        to=[admin.email for admin in admin_users.users],
+        subject=subject,
+        body=getEmailInviteContent(
+            data_federation=data_federation.name, inviter_organization=inviter_organization.name
+        ),
+    )
+
+    # The email is sent with smtplib which blocks
+    await asyncio.get_running_loop().run_in_executor(None, send_email, email_req)
 
 
 async def add_dataset(
@@ -980,32 +977,21 @@ async def remove_dataset(
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
-@router.post(
-    path="/data-federations/{data_federation_id}/dataset_key/{dataset_id}",
-    description="Return a dataset encryption key by either retrieving and unwrapping, or creating",
-    response_model=DatasetEncryptionKey_Out,
-    response_model_by_alias=False,
-    response_model_exclude_unset=True,
-    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.DATA_SUBMITTER]))],
-    status_code=status.HTTP_201_CREATED,
-    operation_id="get_dataset_key",
-)
-async def get_dataset_key(
-    data_federation_id: PyObjectId = Path(description="UUID of the Data federation to which the dataset belongs"),
-    dataset_id: PyObjectId = Path(description="UUID of the dataset for which the key is being requested"),
-    create_if_not_found: bool = True,
-    current_user: TokenData = Depends(get_current_user),
-):
+async def get_dataset_key_submitter(
+    data_federation_id: PyObjectId, dataset_id: PyObjectId, current_user: TokenData
+) -> Tuple[DataSubmitterIdKeyPair, bool]:
     """
-    Generate and return a dataset encryption key
+    Check that the user can get the encryption key of a dataset of the data federation, without reading the key
 
     :param data_federation_id: data federation for which the request for a key is being made
     :type data_federation_id: PyObjectId
-    :param current_user: the information about the current user accessed from JWT, defaults to Depends(get_current_user)
-    :type current_user: TokenData, optional
-    :raises HTTPException: HTTP_404_NOT_FOUND, "DataFederation not found"
-    :raises HTTPException: HTTP_401_UNAUTHORIZED, "Unauthorised"
-    :raises exception: should be 500, internal server error
+    :param dataset_id: the dataset of the key
+    :type dataset_id: PyObjectId
+    :param current_user: the information about the current user accessed from JWT
+    :type current_user: TokenData
+    :raises HTTPException: HTTP_404_NOT_FOUND, "Unauthorised"
+    :return: the data submitter whose key wraps the dataset key, and whether the user can generate the key
+    :rtype: Tuple[DataSubmitterIdKeyPair, bool]
     """
     # Only data federation submitters can generate keys for this federation
     # And data federation researchers cannot generate new keys
@@ -1033,7 +1019,6 @@ async def get_dataset_key(
         if data_researcher == current_user.organization_id
     ]
     if data_researchers_info:
-        create_if_not_found = False
         # Get the data submitter information from the dataset
         dataset_db = await Datasets.read(dataset_id=dataset_id)
         data_submitter_id = dataset_db[0].organization_id
@@ -1048,11 +1033,62 @@ async def get_dataset_key(
     if not data_submitters_info:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User is neither researcher nor submitter")
 
+    return data_submitters_info[0], not data_researchers_info
+
+
+async def check_dataset_key_access(data_federation_id: PyObjectId, dataset_id: PyObjectId, current_user: TokenData):
+    """
+    Check that the user can get the existing encryption key of a dataset, without unwrapping it
+
+    :param data_federation_id: data federation to which the dataset belongs
+    :type data_federation_id: PyObjectId
+    :param dataset_id: the dataset of the key
+    :type dataset_id: PyObjectId
+    :param current_user: the information about the current user accessed from JWT
+    :type current_user: TokenData
+    :raises HTTPException: HTTP_404_NOT_FOUND, if the user can't get the key or the dataset has no key
+    """
+    await get_dataset_key_submitter(data_federation_id, dataset_id, current_user)
+
+    dataset_db = await Datasets.read(dataset_id=dataset_id)
+    if dataset_db[0].encryption_key is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dataset encryption key not found")
+
+
+@router.post(
+    path="/data-federations/{data_federation_id}/dataset_key/{dataset_id}",
+    description="Return a dataset encryption key by either retrieving and unwrapping, or creating",
+    response_model=DatasetEncryptionKey_Out,
+    response_model_by_alias=False,
+    response_model_exclude_unset=True,
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.DATA_SUBMITTER]))],
+    status_code=status.HTTP_201_CREATED,
+    operation_id="get_dataset_key",
+)
+async def get_dataset_key(
+    data_federation_id: PyObjectId = Path(description="UUID of the Data federation to which the dataset belongs"),
+    dataset_id: PyObjectId = Path(description="UUID of the dataset for which the key is being requested"),
+    create_if_not_found: bool = True,
+    current_user: TokenData = Depends(get_current_user),
+):
+    """
+    Generate and return a dataset encryption key
+
+    :param data_federation_id: data federation for which the request for a key is being made
+    :type data_federation_id: PyObjectId
+    :param current_user: the information about the current user accessed from JWT, defaults to Depends(get_current_user)
+    :type current_user: TokenData, optional
+    :raises HTTPException: HTTP_404_NOT_FOUND, "DataFederation not found"
+    :raises HTTPException: HTTP_401_UNAUTHORIZED, "Unauthorised"
+    :raises exception: should be 500, internal server error
+    """
+    data_submitter, can_create_key = await get_dataset_key_submitter(data_federation_id, dataset_id, current_user)
+
     # Get the dataset encryption key
     key_info = await get_datset_encryption_key(
         dataset_id=dataset_id,
-        wrapping_key=data_submitters_info[0].key,
-        create_if_doesnt_exit=create_if_not_found,
+        wrapping_key=data_submitter.key,
+        create_if_doesnt_exit=create_if_not_found and can_create_key,
         current_user=current_user,
     )
 
@@ -1102,10 +1138,28 @@ async def generate_rsa_key(key_name: str) -> KeyVaultObject:
     :return: the generated key pair id
     :rtype: str
     """
-    account_credentials = await azure.authenticate()
-    key_client_version = await azure.create_rsa_key(account_credentials, key_name, 4096)
+    account_credentials = await cloud_provider().authenticate()
+    key_client_version = await cloud_provider().create_rsa_key(account_credentials, key_name, 4096)
 
     if key_client_version is None:
         raise Exception("Failed to create rsa key")
 
     return key_client_version
+
+
+async def get_data_submitter_key(data_federation_id: PyObjectId, organization_id: PyObjectId) -> KeyVaultObject:
+    """
+    Get the RSA key of a data submitter of a data federation, from the pool of keys created ahead or generated
+    now if the pool is empty
+
+    :param data_federation_id: the data federation
+    :type data_federation_id: PyObjectId
+    :param organization_id: the data submitter organization
+    :type organization_id: PyObjectId
+    :return: the key
+    :rtype: KeyVaultObject
+    """
+    data_submitter_key = await claim_rsa_key(data_federation_id, organization_id)
+    if data_submitter_key is None:
+        data_submitter_key = await generate_rsa_key(f"{str(data_federation_id)}-{str(organization_id)}")
+    return data_submitter_key
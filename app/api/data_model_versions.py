@@ -37,6 +37,8 @@ from app.models.data_model_versions import (
     SaveDataModelVersion_In,
 )
 from app.models.data_models import DataModelState
+from app.utils.etag import DocumentETag
+from app.utils.serialization import trusted_construct, trusted_response
 
 router = APIRouter()
 
@@ -111,7 +113,7 @@ class DataModelVersion:
 
         if response:
             for data_model in response:
-                data_model_list.append(DataModelVersion_Db(**data_model))
+                data_model_list.append(trusted_construct(DataModelVersion_Db, data_model))
         elif throw_on_not_found:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -311,6 +313,7 @@ async def register_data_model_version(
     response_model=GetDataModelVersion_Out,
     status_code=status.HTTP_200_OK,
     response_model_by_alias=False,
+    dependencies=[Depends(DocumentETag(DataModelVersion.DB_COLLECTION_DATA_MODEL_VERSION, "data_model_version_id"))],
     operation_id="get_data_model_version",
 )
 async def get_data_model_version(
@@ -346,7 +349,7 @@ async def get_all_data_model_versions(
     )
     datamodels = [GetDataModelVersion_Out(**(datamodel_db.dict())) for datamodel_db in datamodel_db_list]
 
-    return GetMultipleDataModelVersion_Out(data_model_versions=datamodels)
+    return trusted_response(GetMultipleDataModelVersion_Out(data_model_versions=datamodels))
 
 
 @router.patch(
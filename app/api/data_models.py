@@ -35,6 +35,8 @@ from app.models.data_models import (
     UpdateDataModel_In,
 )
 from app.utils import cache
+from app.utils.etag import DocumentETag
+from app.utils.serialization import trusted_construct, trusted_response
 
 router = APIRouter()
 
@@ -99,7 +101,7 @@ class DataModel:
 
         if response:
             for data_model in response:
-                data_model_list.append(DataModel_Db(**data_model))
+                data_model_list.append(trusted_construct(DataModel_Db, data_model))
         elif throw_on_not_found:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -237,6 +239,7 @@ async def register_data_model(
     response_model=GetDataModel_Out,
     status_code=status.HTTP_200_OK,
     response_model_by_alias=False,
+    dependencies=[Depends(DocumentETag(DataModel.DB_COLLECTION_DATA_MODEL, "data_model_id"))],
     operation_id="get_data_model_info",
 )
 async def get_data_model_info(
@@ -314,7 +317,7 @@ async def get_all_data_model_info(
             )
         )
 
-    return GetMultipleDataModel_Out(data_models=response_list)
+    return trusted_response(GetMultipleDataModel_Out(data_models=response_list))
 
 
 @router.get(
@@ -43,11 +43,18 @@ from app.models.secure_computation_nodes import (
     SecureComputationNodeState,
 )
 from app.utils import cache
-from app.utils.background_couroutines import add_async_task
+from app.utils.cloud import cloud_provider
+from app.utils.jobs import enqueue_job, job_handler
+from app.utils.locks import LockNotAcquiredError, distributed_lock, update_fenced
 from app.utils.secrets import get_secret
+from app.utils.serialization import trusted_construct, trusted_response
 
 router = APIRouter()
 
+# Held while the secure computation node of the data federation is replaced
+UPDATE_SCN_LOCK = "update-secure-computation-node"
+UPDATE_SCN_LOCK_WAIT = 30.0
+
 
 class DatasetVersion:
     """
@@ -111,7 +118,7 @@ class DatasetVersion:
 
         if response:
             for data_model in response:
-                dataset_version_list.append(DatasetVersion_Db(**data_model))
+                dataset_version_list.append(trusted_construct(DatasetVersion_Db, data_model))
         elif throw_on_not_found:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -205,7 +212,12 @@ async def register_dataset_version(
     await DatasetVersion.create(dataset_version_db)
 
     # Create a directory in the azure file share for the dataset version
-    add_async_task(create_directory_in_file_share(dataset_version_db.dataset_id, dataset_version_db.id))
+    await enqueue_job(
+        create_directory_in_file_share,
+        {"dataset_id": dataset_version_db.dataset_id, "dataset_version_id": dataset_version_db.id},
+        idempotency_key=str(dataset_version_db.id),
+        user_id=current_user.id,
+    )
 
     return RegisterDatasetVersion_Out(**dataset_version_db.dict())
 
@@ -245,7 +257,9 @@ async def get_all_dataset_versions(
         response_dataset_version = GetDatasetVersion_Out(**dataset_version.dict(), organization=organization_info)
         response_list_of_dataset_version.append(response_dataset_version)
 
-    return GetMultipleDatasetVersion_Out(dataset_versions=response_list_of_dataset_version)
+    return trusted_response(
+        GetMultipleDatasetVersion_Out(dataset_versions=response_list_of_dataset_version), exclude_unset=True
+    )
 
 
 @router.get(
@@ -316,12 +330,12 @@ async def get_dataset_version_connection_string(
         )
 
     # Authenticate azure
-    account_credentials = await azure.authenticate()
+    account_credentials = await cloud_provider().authenticate()
     dataset_version_file_name = f"dataset_{dataset_version.id}.zip"
 
     # Get the connection string for the dataset version which is valid for 30 minutes
-    # This could be a long running operation
-    connection_string = await azure.authentication_shared_access_signature(
+    # It is signed locally with the cached key of the storage account
+    connection_string = await cloud_provider().authentication_shared_access_signature(
         account_credentials=account_credentials,
         account_name=get_secret("azure_storage_account_name"),
         resource_group_name=get_secret("azure_storage_resource_group"),
@@ -376,7 +390,7 @@ async def update_dataset_version(
 
     # if the dataset state was updated to ACTIVE create a new SCN with the new dataset versions
     if updated_dataset_version_info.state == DatasetVersionState.ACTIVE:
-        add_async_task(udpate_scn(current_user))
+        await enqueue_job(udpate_scn, {"current_user": current_user}, user_id=current_user.id)
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -402,6 +416,15 @@ async def soft_delete_dataset_version(
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+async def directory_failed(exception: Exception, dataset_id: PyObjectId, dataset_version_id: PyObjectId):
+    await DatasetVersion.update(
+        dataset_version_id=dataset_version_id,
+        state=DatasetVersionState.ERROR,
+        note=str(exception),
+    )
+
+
+@job_handler(concurrency=4, on_failure=directory_failed)
 async def create_directory_in_file_share(dataset_id: PyObjectId, dataset_version_id: PyObjectId):
     """
     Create a directory in the Azure file share
@@ -411,44 +434,49 @@ async def create_directory_in_file_share(dataset_id: PyObjectId, dataset_version
     :param dataset_version_id: Dataset version id
     :type dataset_version_id: PyObjectId
     """
-    try:
-        account_credentials = await azure.authenticate()
+    # Nothing left to do if an earlier attempt of the job got through
+    dataset_version_db = (await DatasetVersion.read(dataset_version_id=dataset_version_id))[0]
+    if dataset_version_db.state != DatasetVersionState.CREATING_DIRECTORY:
+        return
+
+    account_credentials = await cloud_provider().authenticate()
 
+    # The account key is cached, it is fetched again once if it was rotated in the meantime
+    for refresh_key in (False, True):
         # Get the connection string for the storage account
-        connection_string_response = await azure.get_storage_account_connection_string(
+        connection_string_response = await cloud_provider().get_storage_account_connection_string(
             account_credentials=account_credentials,
             resource_group_name=get_secret("azure_storage_resource_group"),
             account_name=get_secret("azure_storage_account_name"),
+            refresh_key=refresh_key,
         )
         if connection_string_response.status != "Success":
             raise Exception(connection_string_response.note)
 
         # Create the directory in the file share
-        create_response = await azure.file_share_create_directory(
+        create_response = await cloud_provider().file_share_create_directory(
             connection_string=connection_string_response.response,
             file_share_name=str(dataset_id),
             directory_name=str(dataset_version_id),
         )
-        if create_response.status != "Success":
-            raise Exception(create_response.note)
+        if create_response.status != azure.AUTHENTICATION_FAILED:
+            break
+    if create_response.status != "Success":
+        raise Exception(create_response.note)
 
-        await DatasetVersion.update(
-            dataset_version_id=dataset_version_id,
-            state=DatasetVersionState.NOT_UPLOADED,
-        )
-
-    except Exception as exception:
-        await DatasetVersion.update(
-            dataset_version_id=dataset_version_id,
-            state=DatasetVersionState.ERROR,
-            note=str(exception),
-        )
+    await DatasetVersion.update(
+        dataset_version_id=dataset_version_id,
+        state=DatasetVersionState.NOT_UPLOADED,
+    )
 
 
+# Another attempt doesn't deprovision the node again, it is no longer ready after the first attempt. The replicas
+# take turns with a lock, otherwise they could all deprovision the same ready node and each request a new one.
+@job_handler(concurrency=1, max_attempts=3)
 async def udpate_scn(current_user: TokenData):
     from app.api.secure_computation_nodes import (
         SecureComputationNode,
-        deprovision_secure_computation_node,
+        delete_resource_group,
         register_secure_computation_node,
     )
 
@@ -465,33 +493,46 @@ async def udpate_scn(current_user: TokenData):
         exp=current_user.exp,
     )
 
-    # Get the latest scn that's running
-    current_scn = await SecureComputationNode.read(
-        query_state=SecureComputationNodeState.READY, throw_on_not_found=False
-    )
+    async with distributed_lock(UPDATE_SCN_LOCK, wait=UPDATE_SCN_LOCK_WAIT) as lease:
+        # Get the latest scn that's running
+        current_scn = await SecureComputationNode.read(
+            query_state=SecureComputationNodeState.READY, throw_on_not_found=False
+        )
 
-    # If it is none then create a new one
-    # If it is not none then delete it and create a new one
-    if current_scn:
-        response = await deprovision_secure_computation_node(
-            secure_computation_node_id=current_scn[0].id, current_user=admin_user
+        # If it is none then create a new one
+        # If it is not none then delete it and create a new one
+        if current_scn:
+            # Fenced so that a worker whose lease expired while it was paused can't deprovision the node again
+            deprovisioned = await update_fenced(
+                SecureComputationNode.DB_COLLECTION_SECURE_COMPUTATION_NODE,
+                {"_id": str(current_scn[0].id), "state": SecureComputationNodeState.READY.value},
+                {"$set": {"state": SecureComputationNodeState.DELETING.value}},
+                lease,
+            )
+            if deprovisioned:
+                await enqueue_job(
+                    delete_resource_group,
+                    {"secure_computation_node_id": current_scn[0].id, "current_user": admin_user},
+                    idempotency_key=str(current_scn[0].id),
+                    user_id=admin_user.id,
+                )
+
+        # Get the data federation id
+        data_federation = await get_all_data_federations(
+            data_submitter_id=current_user.organization_id, current_user=current_user
         )
-        if response.status_code != status.HTTP_204_NO_CONTENT:
-            raise HTTPException(status_code=response.status_code, detail=response.body)
+        if not data_federation:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data federation not found")
 
-    # Get the data federation id
-    data_federation = await get_all_data_federations(
-        data_submitter_id=current_user.organization_id, current_user=current_user
-    )
-    if not data_federation:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data federation not found")
+        if not lease.valid:
+            raise LockNotAcquiredError(f"The lock {UPDATE_SCN_LOCK} expired before the new node was requested")
 
-    # Create a new scn
-    scn_req: RegisterSecureComputationNode_In = RegisterSecureComputationNode_In(
-        data_federation_id=data_federation.data_federations[0].id,
-        size=SecureComputationNodeSize.Standard_D4s_v4,
-    )
-    response = await register_secure_computation_node(
-        secure_computation_node_req=scn_req,
-        current_user=admin_user,
-    )
+        # Create a new scn
+        scn_req: RegisterSecureComputationNode_In = RegisterSecureComputationNode_In(
+            data_federation_id=data_federation.data_federations[0].id,
+            size=SecureComputationNodeSize.Standard_D4s_v4,
+        )
+        await register_secure_computation_node(
+            secure_computation_node_req=scn_req,
+            current_user=admin_user,
+        )
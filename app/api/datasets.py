@@ -19,7 +19,6 @@ from typing import List, Optional
 from fastapi import APIRouter, Body, Depends, HTTPException, Path, Response, status
 from fastapi.encoders import jsonable_encoder
 
-import app.utils.azure as azure
 from app.api.authentication import RoleChecker, get_current_user
 from app.data import operations as data_service
 from app.models.accounts import UserRole
@@ -36,8 +35,10 @@ from app.models.datasets import (
     UpdateDataset_In,
 )
 from app.utils import cache
-from app.utils.background_couroutines import add_async_task
+from app.utils.cloud import cloud_provider
+from app.utils.jobs import enqueue_job, job_handler
 from app.utils.secrets import get_secret
+from app.utils.serialization import trusted_construct, trusted_response
 
 router = APIRouter()
 
@@ -101,7 +102,7 @@ class Datasets:
 
         if response:
             for data_model in response:
-                dataset_version_list.append(Dataset_Db(**data_model))
+                dataset_version_list.append(trusted_construct(Dataset_Db, data_model))
         elif throw_on_not_found:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -205,7 +206,12 @@ async def register_dataset(
     await Datasets.create(dataset_db)
 
     # Create a file share for the dataset
-    add_async_task(create_azure_file_share(dataset_db.id))
+    await enqueue_job(
+        create_azure_file_share,
+        {"dataset_id": dataset_db.id},
+        idempotency_key=str(dataset_db.id),
+        user_id=current_user.id,
+    )
 
     return RegisterDataset_Out(_id=dataset_db.id)
 
@@ -243,7 +249,7 @@ async def get_all_datasets(current_user: TokenData = Depends(get_current_user)):
         response_dataset = GetDataset_Out(**dataset.dict(), organization=organization)
         response_list_of_datasets.append(response_dataset)
 
-    return GetMultipleDataset_Out(datasets=response_list_of_datasets)
+    return trusted_response(GetMultipleDataset_Out(datasets=response_list_of_datasets), exclude_unset=True)
 
 
 @router.get(
@@ -377,7 +383,7 @@ async def get_datset_encryption_key(
         # Generate a new key. TODO: could be done in keyvault
         aes_key = os.urandom(32)
 
-        wrapped_key_secret = await azure.wrap_aes_key(
+        wrapped_key_secret = await cloud_provider().wrap_aes_key(
             aes_key=aes_key,
             wrapping_key=wrapping_key,
         )
@@ -387,11 +393,18 @@ async def get_datset_encryption_key(
         await Datasets.update(dataset_id=dataset_id, encryption_key=wrapped_key_secret)
     else:
         wrapped_key_secret = dataset_db.encryption_key
-        aes_key = await azure.unwrap_aes_with_rsa_key(wrapped_aes_key=wrapped_key_secret, wrapping_key=wrapping_key)
+        aes_key = await cloud_provider().unwrap_aes_with_rsa_key(
+            wrapped_aes_key=wrapped_key_secret, wrapping_key=wrapping_key
+        )
 
     return DatasetEncryptionKey_Out(dataset_key=b64encode(aes_key).decode("ascii"))
 
 
+async def file_share_failed(exception: Exception, dataset_id: PyObjectId):
+    await Datasets.update(dataset_id=dataset_id, state=DatasetState.ERROR, note=str(exception))
+
+
+@job_handler(concurrency=4, on_failure=file_share_failed)
 async def create_azure_file_share(dataset_id: PyObjectId):
     """
     Create a file share in Azure
@@ -400,20 +413,21 @@ async def create_azure_file_share(dataset_id: PyObjectId):
     :type dataset_id: PyObjectId
     :raises Exception: failed to create file share
     """
-    try:
-        account_credentials = await azure.authenticate()
-
-        create_response = await azure.create_file_share(
-            account_credentials,
-            get_secret("azure_storage_resource_group"),
-            get_secret("azure_storage_account_name"),
-            str(dataset_id),
-        )
-        if create_response.status != "Success":
-            raise Exception(create_response.note)
-
-        # Mark the dataset as active
-        await Datasets.update(dataset_id=dataset_id, state=DatasetState.ACTIVE)
+    # Nothing left to do if an earlier attempt of the job got through
+    dataset_db = (await Datasets.read(dataset_id=dataset_id))[0]
+    if dataset_db.state != DatasetState.CREATING_STORAGE:
+        return
+
+    account_credentials = await cloud_provider().authenticate()
+
+    create_response = await cloud_provider().create_file_share(
+        account_credentials,
+        get_secret("azure_storage_resource_group"),
+        get_secret("azure_storage_account_name"),
+        str(dataset_id),
+    )
+    if create_response.status != "Success":
+        raise Exception(create_response.note)
 
-    except Exception as exception:
-        await Datasets.update(dataset_id=dataset_id, state=DatasetState.ERROR, note=str(exception))
+    # Mark the dataset as active
+    await Datasets.update(dataset_id=dataset_id, state=DatasetState.ACTIVE)
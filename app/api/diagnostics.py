@@ -0,0 +1,373 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# diagnostics.py
+# -------------------------------------------------------------------------------
+"""APIs to observe the running API Services"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import os
+import time
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, Response, status
+from fastapi.responses import ORJSONResponse
+
+from app.api.authentication import RoleChecker
+from app.data import operations as data_service
+from app.models.accounts import UserRole
+from app.models.diagnostics import (
+    AllocationDiff_Out,
+    Dependency_Out,
+    DependencyOperation_Out,
+    EventLoopBlock_Out,
+    GetDependencyTelemetry_Out,
+    GetEventLoopBlocks_Out,
+    GetMemorySnapshotDiff_Out,
+    GetMemoryUsage_Out,
+    GetMultipleRequestProfiles_Out,
+    MemoryGroupBy,
+    MemorySnapshot_Out,
+    RateLimit_Out,
+    RequestProfile_Out,
+    StructureSize_Out,
+    TakeMemorySnapshot_In,
+)
+from app.utils import memory, watchdog
+from app.utils.dependency_telemetry import dependency_telemetry
+from app.utils.metrics import METRICS_CONTENT_TYPE, metrics_response_content
+from app.utils.profiling import PROFILES_URL, profiler
+from app.utils.resilience import dependencies
+
+router = APIRouter()
+
+READINESS_TIMEOUT = 2.0
+
+# Set by the lifespan of the server, every worker is ready from the end of its startup to the start of its shutdown
+worker_ready = False
+
+
+def set_worker_ready(ready: bool):
+    global worker_ready
+    worker_ready = ready
+
+
+@router.get(
+    path="/metrics",
+    description="Metrics of the service in the prometheus text format",
+    status_code=status.HTTP_200_OK,
+    include_in_schema=False,
+)
+async def get_metrics() -> Response:
+    return Response(content=metrics_response_content(), media_type=METRICS_CONTENT_TYPE)
+
+
+@router.get(
+    path="/readyz",
+    description="Readiness of the worker that answers, it is ready when it started and can reach the database",
+    status_code=status.HTTP_200_OK,
+    include_in_schema=False,
+)
+async def get_readiness() -> Response:
+    if not worker_ready:
+        return ORJSONResponse(
+            {"status": "not ready", "pid": os.getpid()}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+    try:
+        await asyncio.wait_for(data_service.ping(), timeout=READINESS_TIMEOUT)
+    except Exception:
+        return ORJSONResponse(
+            {"status": "database unavailable", "pid": os.getpid()}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+    return ORJSONResponse({"status": "ready", "pid": os.getpid()})
+
+
+@router.get(
+    path="/diagnostics/event-loop-blocks",
+    description="Get the callsites that blocked the event loop of this worker, the longest blocking first",
+    response_description="The blocking callsites",
+    response_model=GetEventLoopBlocks_Out,
+    response_model_by_alias=False,
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_200_OK,
+    operation_id="get_event_loop_blocks",
+)
+async def get_event_loop_blocks() -> GetEventLoopBlocks_Out:
+    if watchdog.watchdog is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Watchdog is not running")
+
+    blocks = [
+        EventLoopBlock_Out(
+            callsite=callsite.callsite,
+            count=callsite.count,
+            total_blocked_seconds=callsite.total_blocked,
+            max_blocked_seconds=callsite.max_blocked,
+            last_seen=callsite.last_seen,
+            stack=callsite.stack,
+        )
+        for callsite in watchdog.watchdog.report()
+    ]
+    return GetEventLoopBlocks_Out(threshold_seconds=watchdog.watchdog.threshold, blocks=blocks)
+
+
+@router.delete(
+    path="/diagnostics/event-loop-blocks",
+    description="Forget the callsites that blocked the event loop of this worker",
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_204_NO_CONTENT,
+    operation_id="reset_event_loop_blocks",
+)
+async def reset_event_loop_blocks():
+    if watchdog.watchdog is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Watchdog is not running")
+
+    watchdog.watchdog.reset()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get(
+    path=PROFILES_URL,
+    description="Get the profiled requests kept by this worker, the newest first",
+    response_description="The profiled requests",
+    response_model=GetMultipleRequestProfiles_Out,
+    response_model_by_alias=False,
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_200_OK,
+    operation_id="get_all_request_profiles",
+)
+async def get_all_request_profiles() -> GetMultipleRequestProfiles_Out:
+    profiles = [
+        RequestProfile_Out(
+            request_id=profile.request_id,
+            method=profile.method,
+            path=profile.path,
+            trace_id=profile.trace_id,
+            started=profile.started,
+            duration_seconds=profile.duration,
+            samples=len(profile.samples),
+        )
+        for profile in profiler.list_profiles()
+    ]
+    return GetMultipleRequestProfiles_Out(profiles=profiles)
+
+
+@router.get(
+    path=PROFILES_URL + "/{request_id}",
+    description="Download the profile of a request in the speedscope format",
+    response_description="The speedscope profile",
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_200_OK,
+    operation_id="get_request_profile",
+)
+async def get_request_profile(request_id: str = Path(description="Request id returned with the profiled request")):
+    profile = profiler.get_profile(request_id)
+    if not profile:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+
+    return ORJSONResponse(
+        content=profile.speedscope(),
+        headers={"Content-Disposition": f'attachment; filename="{request_id}.speedscope.json"'},
+    )
+
+
+@router.get(
+    path="/diagnostics/memory",
+    description="Get the memory of this worker and the size of its in-process structures",
+    response_description="The memory usage",
+    response_model=GetMemoryUsage_Out,
+    response_model_by_alias=False,
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_200_OK,
+    operation_id="get_memory_usage",
+)
+async def get_memory_usage() -> GetMemoryUsage_Out:
+    traced_memory = memory.traced_memory()
+    return GetMemoryUsage_Out(
+        resident_set_bytes=memory.resident_set_size(),
+        allocation_tracing=traced_memory is not None,
+        traced_current_bytes=traced_memory[0] if traced_memory else None,
+        traced_peak_bytes=traced_memory[1] if traced_memory else None,
+        mongo_pool_open_connections=data_service.pool_listener.open_connections,
+        mongo_pool_checked_out_connections=data_service.pool_listener.checked_out_connections,
+        structures=[
+            StructureSize_Out(name=size.name, entries=size.entries, approximate_bytes=size.approximate_bytes)
+            for size in memory.structure_sizes()
+        ],
+        snapshots=[
+            MemorySnapshot_Out(name=snapshot.name, taken=snapshot.taken, traced_bytes=snapshot.traced_bytes)
+            for snapshot in memory.list_snapshots()
+        ],
+    )
+
+
+@router.put(
+    path="/diagnostics/memory/tracing",
+    description="Start tracing the allocations of this worker with tracemalloc",
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_204_NO_CONTENT,
+    operation_id="start_allocation_tracing",
+)
+async def start_allocation_tracing(
+    frames: int = Query(default=1, ge=1, le=memory.MAX_TRACEBACK_FRAMES, description="Frames kept per allocation"),
+):
+    memory.start_allocation_tracing(frames)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.delete(
+    path="/diagnostics/memory/tracing",
+    description="Stop tracing the allocations of this worker and drop the snapshots",
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_204_NO_CONTENT,
+    operation_id="stop_allocation_tracing",
+)
+async def stop_allocation_tracing():
+    memory.stop_allocation_tracing()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.post(
+    path="/diagnostics/memory/snapshots",
+    description="Take a named snapshot of the traced allocations, a snapshot with the same name is replaced",
+    response_description="The snapshot",
+    response_model=MemorySnapshot_Out,
+    response_model_by_alias=False,
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_201_CREATED,
+    operation_id="take_memory_snapshot",
+)
+async def take_memory_snapshot(
+    snapshot_request: TakeMemorySnapshot_In = Body(description="Name of the snapshot"),
+) -> MemorySnapshot_Out:
+    # Walking all the traced allocations takes a while, it is done off the event loop
+    try:
+        snapshot = await asyncio.get_running_loop().run_in_executor(None, memory.take_snapshot, snapshot_request.name)
+    except memory.TracingNotStartedError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Allocation tracing is not started")
+
+    return MemorySnapshot_Out(name=snapshot.name, taken=snapshot.taken, traced_bytes=snapshot.traced_bytes)
+
+
+@router.delete(
+    path="/diagnostics/memory/snapshots/{name}",
+    description="Delete a snapshot of the traced allocations",
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_204_NO_CONTENT,
+    operation_id="delete_memory_snapshot",
+)
+async def delete_memory_snapshot(name: str = Path(description="Name of the snapshot")):
+    try:
+        memory.delete_snapshot(name)
+    except memory.SnapshotNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get(
+    path="/diagnostics/memory/snapshots-diff",
+    description="Get the growth of the allocations between two snapshots, grouped by file or by line",
+    response_description="The allocations with the largest growth first",
+    response_model=GetMemorySnapshotDiff_Out,
+    response_model_by_alias=False,
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_200_OK,
+    operation_id="get_memory_snapshot_diff",
+)
+async def get_memory_snapshot_diff(
+    old: str = Query(description="Name of the first snapshot"),
+    new: str = Query(description="Name of the second snapshot"),
+    group_by: MemoryGroupBy = Query(default=MemoryGroupBy.LINE, description="Group the allocations by file or line"),
+    limit: int = Query(default=50, ge=1, le=500, description="Number of groups"),
+) -> GetMemorySnapshotDiff_Out:
+    try:
+        allocations = await asyncio.get_running_loop().run_in_executor(
+            None, memory.compare_snapshots, old, new, group_by.value, limit
+        )
+    except memory.SnapshotNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+
+    return GetMemorySnapshotDiff_Out(
+        old=old,
+        new=new,
+        group_by=group_by,
+        allocations=[
+            AllocationDiff_Out(
+                file=allocation.file,
+                line=allocation.line,
+                size_diff_bytes=allocation.size_diff,
+                size_bytes=allocation.size,
+                count_diff=allocation.count_diff,
+                count=allocation.count,
+            )
+            for allocation in allocations
+        ],
+    )
+
+
+@router.get(
+    path="/diagnostics/dependencies",
+    description="Get the latency, status and throttling of the calls of this worker to azure and the dns server",
+    response_description="The calls by dependency and operation",
+    response_model=GetDependencyTelemetry_Out,
+    response_model_by_alias=False,
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_200_OK,
+    operation_id="get_dependency_telemetry",
+)
+async def get_dependency_telemetry() -> GetDependencyTelemetry_Out:
+    now = time.monotonic()
+    return GetDependencyTelemetry_Out(
+        since=dependency_telemetry.since,
+        dependencies=[
+            Dependency_Out(
+                name=dependency.name,
+                circuit_state=dependency.breaker.state,
+                in_flight=dependency.in_flight,
+                throttled_seconds=max(dependency.throttled_until - now, 0.0),
+                rate_limits=[
+                    RateLimit_Out(name=rate_limit.name, remaining=rate_limit.remaining, updated=rate_limit.updated)
+                    for rate_limit in dependency_telemetry.rate_limits.values()
+                    if rate_limit.dependency == dependency.name
+                ],
+            )
+            for dependency in dependencies.values()
+        ],
+        operations=[
+            DependencyOperation_Out(
+                dependency=operation.dependency,
+                operation=operation.operation,
+                calls=operation.calls,
+                failures=operation.failures,
+                retries=operation.retries,
+                throttled=operation.throttled,
+                total_seconds=operation.total_duration,
+                p50_seconds=operation.percentile(0.5),
+                p95_seconds=operation.percentile(0.95),
+                p99_seconds=operation.percentile(0.99),
+                max_seconds=operation.max_duration,
+                statuses=dict(operation.statuses),
+            )
+            for operation in dependency_telemetry.report()
+        ],
+    )
+
+
+@router.delete(
+    path="/diagnostics/dependencies",
+    description="Forget the calls of this worker to azure and the dns server",
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_204_NO_CONTENT,
+    operation_id="reset_dependency_telemetry",
+)
+async def reset_dependency_telemetry():
+    dependency_telemetry.reset()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,111 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# jobs.py
+# -------------------------------------------------------------------------------
+"""APIs to follow the background jobs"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Response, status
+from pydantic import StrictStr
+
+from app.api.authentication import RoleChecker, get_current_user
+from app.models.accounts import UserRole
+from app.models.authentication import TokenData
+from app.models.common import PyObjectId
+from app.models.jobs import GetJob_Out, GetMultipleJobs_Out, JobState
+from app.utils import jobs
+
+router = APIRouter()
+
+
+@router.get(
+    path="/jobs",
+    description="Get the background jobs, the newest first",
+    response_description="List of jobs",
+    response_model=GetMultipleJobs_Out,
+    response_model_by_alias=False,
+    response_model_exclude_unset=True,
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_200_OK,
+    operation_id="get_all_jobs",
+)
+async def get_all_jobs(
+    state: Optional[JobState] = Query(default=None, description="State of the jobs"),
+    type: Optional[StrictStr] = Query(default=None, description="Type of the jobs, the name of their function"),
+) -> GetMultipleJobs_Out:
+    """
+    Get the background jobs
+
+    :param state: state of the jobs
+    :type state: Optional[JobState]
+    :param type: type of the jobs
+    :type type: Optional[StrictStr]
+    :return: the jobs
+    :rtype: GetMultipleJobs_Out
+    """
+    jobs_db = sorted(await jobs.find_jobs(state=state, job_type=type), key=lambda job: job.created_time, reverse=True)
+    return GetMultipleJobs_Out(jobs=[GetJob_Out(**job_db.dict()) for job_db in jobs_db])
+
+
+@router.get(
+    path="/jobs/{job_id}",
+    description="Get the state of a background job",
+    response_description="The job",
+    response_model=GetJob_Out,
+    response_model_by_alias=False,
+    response_model_exclude_unset=True,
+    status_code=status.HTTP_200_OK,
+    operation_id="get_job",
+)
+async def get_job(
+    job_id: PyObjectId = Path(description="UUID of the job"),
+    current_user: TokenData = Depends(get_current_user),
+) -> GetJob_Out:
+    """
+    Get a background job, the user who started it or a SAIL admin can get it
+
+    :param job_id: id of the job
+    :type job_id: PyObjectId
+    :param current_user: the information about the current user accessed from JWT, defaults to Depends(get_current_user)
+    :type current_user: TokenData, optional
+    :raises HTTPException: HTTP_404_NOT_FOUND, "Job not found"
+    :return: the job
+    :rtype: GetJob_Out
+    """
+    job_db = await jobs.get_job(job_id)
+    if not job_db or (UserRole.SAIL_ADMIN not in current_user.roles and job_db.user_id != current_user.id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+
+    return GetJob_Out(**job_db.dict())
+
+
+@router.put(
+    path="/jobs/{job_id}/retry",
+    description="Queue a failed background job again",
+    dependencies=[Depends(RoleChecker(allowed_roles=[UserRole.SAIL_ADMIN]))],
+    status_code=status.HTTP_204_NO_CONTENT,
+    operation_id="retry_job",
+)
+async def retry_job(job_id: PyObjectId = Path(description="UUID of the job")):
+    """
+    Queue a failed background job again with all its attempts
+
+    :param job_id: id of the job
+    :type job_id: PyObjectId
+    :raises HTTPException: HTTP_409_CONFLICT, "Job is not failed"
+    :return: Response with no content
+    :rtype: Response
+    """
+    if not await jobs.retry_job(job_id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Job is not failed")
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
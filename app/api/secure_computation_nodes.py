@@ -12,19 +12,16 @@
 #     prior written permission of Secure Ai Labs, Inc.
 # -------------------------------------------------------------------------------
 
+import asyncio
 import json
 from typing import List, Optional
 
-import yaml
 from fastapi import APIRouter, Body, Depends, HTTPException, Path, Response, status
 from fastapi.encoders import jsonable_encoder
-from sail_dns_management_client import Client as DNSClient
-from sail_dns_management_client.api.default import add_domain_dns_post
-from sail_dns_management_client.models import DomainData
 
 import app.utils.azure as azure
 from app.api.authentication import RoleChecker, get_current_user
-from app.api.data_federations import get_data_federation, get_existing_dataset_key
+from app.api.data_federations import check_dataset_key_access, get_data_federation, get_existing_dataset_key
 from app.api.dataset_versions import DatasetVersion
 from app.data import operations as data_service
 from app.models.accounts import UserRole
@@ -45,11 +42,18 @@ from app.models.secure_computation_nodes import (
     UpdateSecureComputationNode_In,
 )
 from app.utils import cache
-from app.utils.background_couroutines import add_async_task
+from app.utils.cloud import cloud_provider
+from app.utils.dns_registration import register_domain
+from app.utils.jobs import enqueue_job, job_handler
 from app.utils.secrets import get_secret
+from app.utils.serialization import trusted_construct, trusted_response
+from app.utils.tracing import SPAN_KIND_CLIENT, start_span
 
 router = APIRouter()
 
+# Dataset keys unwrapped at once for one secure computation node
+KEY_UNWRAP_CONCURRENCY = 8
+
 
 class SecureComputationNode:
     """
@@ -105,7 +109,7 @@ class SecureComputationNode:
 
         if response:
             for data_model in response:
-                secure_computation_node_list.append(SecureComputationNode_Db(**data_model))
+                secure_computation_node_list.append(trusted_construct(SecureComputationNode_Db, data_model))
         elif throw_on_not_found:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -232,32 +236,25 @@ async def register_secure_computation_node(
         researcher_id=current_user.organization_id,
     )
 
-    dataset_with_keys: List[DatasetInformationWithKey] = []
-    for dataset in dataset_info:
-        # Check if dataset version exist
-        await DatasetVersion.read(dataset_version_id=dataset.version_id)
-
-        # Get the encryption key of the dataset
-        dataset_key = await get_existing_dataset_key(
-            data_federation_id=secure_computation_node_db.data_federation_id,
-            dataset_id=dataset.id,
-            current_user=current_user,
-        )
-
-        dataset_with_keys.append(
-            DatasetInformationWithKey(
-                id=dataset.id,
-                version_id=dataset.version_id,
-                data_owner_id=dataset.data_owner_id,
-                key=dataset_key.dataset_key,
-            )
-        )
-
-    # Start the provisioning of the secure computation node in a background thread which will update the IP address
-    add_async_task(provision_secure_computation_node(secure_computation_node_db, dataset_with_keys))
+    # A researcher who can't get the dataset keys is refused now, without unwrapping them: the keys are never
+    # stored with the job, so only the provisioning job unwraps them
+    await asyncio.gather(
+        *[
+            check_dataset_key_access(secure_computation_node_req.data_federation_id, dataset_id, current_user)
+            for dataset_id in {dataset.id for dataset in dataset_info}
+        ]
+    )
 
     await SecureComputationNode.create(secure_computation_node_db)
 
+    # Start the provisioning of the secure computation node in a background job which will update the IP address
+    await enqueue_job(
+        provision_secure_computation_node,
+        {"secure_computation_node_id": secure_computation_node_db.id, "current_user": current_user},
+        idempotency_key=str(secure_computation_node_db.id),
+        user_id=current_user.id,
+    )
+
     return RegisterSecureComputationNode_Out(**secure_computation_node_db.dict())
 
 
@@ -335,7 +332,10 @@ async def get_all_secure_computation_nodes(
 
             response_secure_computation_nodes.append(response_secure_computation_node)
 
-    return GetMultipleSecureComputationNode_Out(secure_computation_nodes=response_secure_computation_nodes)
+    return trusted_response(
+        GetMultipleSecureComputationNode_Out(secure_computation_nodes=response_secure_computation_nodes),
+        exclude_unset=True,
+    )
 
 
 @router.get(
@@ -456,24 +456,91 @@ async def deprovision_secure_computation_node(
         secure_computation_node_id=secure_computation_node_id, state=SecureComputationNodeState.DELETING, url=""
     )
 
-    # Start a background task to deprovision the secure computation node which will update the status
-    add_async_task(delete_resource_group(secure_computation_node_id, current_user))
+    # Start a background job to deprovision the secure computation node which will update the status
+    await enqueue_job(
+        delete_resource_group,
+        {"secure_computation_node_id": secure_computation_node_id, "current_user": current_user},
+        idempotency_key=str(secure_computation_node_id),
+        user_id=current_user.id,
+    )
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
-async def provision_secure_computation_node(
-    secure_computation_node_db: SecureComputationNode_Db, datasets: List[DatasetInformationWithKey]
-):
+async def get_datasets_with_keys(
+    secure_computation_node_db: SecureComputationNode_Db, current_user: TokenData
+) -> List[DatasetInformationWithKey]:
     """
-    Provision a secure computation node
+    Get the encryption keys of the datasets of a secure computation node
 
     :param secure_computation_node_db: secure computation node information
     :type secure_computation_node_db: SecureComputationNode_Db
-    :param dataset_key: dataset key
-    :type dataset_key: str
+    :param current_user: the researcher requesting the secure computation node
+    :type current_user: TokenData
+    :return: the datasets with their keys
+    :rtype: List[DatasetInformationWithKey]
+    """
+    # The keys are unwrapped concurrently, a few at a time to stay under the key vault throttling limits
+    semaphore = asyncio.Semaphore(KEY_UNWRAP_CONCURRENCY)
+
+    async def get_dataset_with_key(dataset: DatasetInformation) -> DatasetInformationWithKey:
+        async with semaphore:
+            # Check if dataset version exist
+            await DatasetVersion.read(dataset_version_id=dataset.version_id)
+
+            # Get the encryption key of the dataset
+            dataset_key = await get_existing_dataset_key(
+                data_federation_id=secure_computation_node_db.data_federation_id,
+                dataset_id=dataset.id,
+                current_user=current_user,
+            )
+
+        return DatasetInformationWithKey(
+            id=dataset.id,
+            version_id=dataset.version_id,
+            data_owner_id=dataset.data_owner_id,
+            key=dataset_key.dataset_key,
+        )
+
+    return list(
+        await asyncio.gather(*[get_dataset_with_key(dataset) for dataset in secure_computation_node_db.datasets])
+    )
+
+
+async def provisioning_failed(exception: Exception, secure_computation_node_id: PyObjectId, current_user: TokenData):
+    # Update the database to mark the VM as FAILED
+    await SecureComputationNode.update(
+        secure_computation_node_id=secure_computation_node_id,
+        state=SecureComputationNodeState.FAILED,
+        detail=str(exception),
+    )
+
+
+@job_handler(concurrency=2, max_attempts=3, on_failure=provisioning_failed)
+async def provision_secure_computation_node(secure_computation_node_id: PyObjectId, current_user: TokenData):
     """
-    try:
+    Provision a secure computation node
+
+    :param secure_computation_node_id: secure computation node id
+    :type secure_computation_node_id: PyObjectId
+    :param current_user: the researcher requesting the secure computation node
+    :type current_user: TokenData
+    """
+    secure_computation_node_db = (
+        await SecureComputationNode.read(query_secure_computation_node_id=secure_computation_node_id)
+    )[0]
+
+    # An earlier attempt of the job may have got through part or all of the provisioning
+    if secure_computation_node_db.state not in [
+        SecureComputationNodeState.REQUESTED,
+        SecureComputationNodeState.CREATING,
+        SecureComputationNodeState.WAITING_FOR_DATA,
+    ]:
+        return
+
+    if secure_computation_node_db.state != SecureComputationNodeState.WAITING_FOR_DATA:
+        datasets = await get_datasets_with_keys(secure_computation_node_db, current_user)
+
         # Create a SCN initialization vector json
         securecomputationnode_json = SecureComputationNodeInitializationVector(
             secure_computation_node_id=secure_computation_node_db.id,
@@ -494,19 +561,10 @@ async def provision_secure_computation_node(
             secure_computation_node_db, "securecomputationnode", jsonable_encoder(securecomputationnode_json)
         )
 
-        # TODO: Wait for the the data to be uploaded on the VM before marking it as ready
-        await SecureComputationNode.update(
-            secure_computation_node_id=secure_computation_node_db.id, state=SecureComputationNodeState.READY
-        )
-
-    except Exception as exception:
-        print(exception)
-        # Update the database to mark the VM as FAILED
-        await SecureComputationNode.update(
-            secure_computation_node_id=secure_computation_node_db.id,
-            state=SecureComputationNodeState.FAILED,
-            detail=str(exception),
-        )
+    # TODO: Wait for the the data to be uploaded on the VM before marking it as ready
+    await SecureComputationNode.update(
+        secure_computation_node_id=secure_computation_node_db.id, state=SecureComputationNodeState.READY
+    )
 
 
 def create_cloud_init_file(initialization_json: dict, image_name: str):
@@ -520,6 +578,8 @@ def create_cloud_init_file(initialization_json: dict, image_name: str):
     :return: cloud init file contents
     :rtype: str
     """
+    import yaml
+
     cloud_init_file = "#cloud-config\n"
 
     cloud_init_yaml = {}
@@ -578,8 +638,8 @@ async def provision_virtual_machine(
     resource_group_name = f"{owner}-{str(virtual_machine_info_db.id)}-scn"
 
     # Deploy the smart broker
-    account_credentials = await azure.authenticate()
-    deploy_response: azure.DeploymentResponse = await azure.deploy_module(
+    account_credentials = await cloud_provider().authenticate()
+    deploy_response: azure.DeploymentResponse = await cloud_provider().deploy_module(
         account_credentials,
         resource_group_name,
         str(virtual_machine_info_db.id),
@@ -590,18 +650,9 @@ async def provision_virtual_machine(
         raise Exception(deploy_response.note)
 
     # Update the DNS entry for the scn
-    dns_ip = get_secret("dns_ip")
-    dns_client = DNSClient(
-        base_url=f"https://{dns_ip}:8000",
-        verify_ssl=False,
-        raise_on_unexpected_status=True,
-        timeout=30,
-        follow_redirects=True,
-    )
-
     dns_entry = f"{str(virtual_machine_info_db.id)}-scn.{get_secret('base_domain')}"
-    request = DomainData(ip=deploy_response.ip_address, domain=f"{dns_entry}.")
-    add_domain_dns_post.sync(client=dns_client, json_body=request)
+    with start_span("dns add_domain", kind=SPAN_KIND_CLIENT, attributes={"dns.domain": f"{dns_entry}."}):
+        await register_domain(f"{dns_entry}.", deploy_response.ip_address)
 
     # Update the database to mark the VM as WAITING FOR DATA
     await SecureComputationNode.update(
@@ -611,6 +662,18 @@ async def provision_virtual_machine(
     )
 
 
+async def deletion_failed(exception: Exception, secure_computation_node_id: PyObjectId, current_user: TokenData):
+    # Update the database to mark the deletion as FAILED
+    await SecureComputationNode.update(
+        secure_computation_node_id=secure_computation_node_id,
+        researcher_organization_id=current_user.organization_id,
+        researcher_user_id=current_user.id,
+        state=SecureComputationNodeState.DELETE_FAILED,
+        detail=str(exception),
+    )
+
+
+@job_handler(concurrency=2, on_failure=deletion_failed)
 async def delete_resource_group(secure_computation_node_id: PyObjectId, current_user: TokenData):
     """
     Delete a resource group
@@ -620,31 +683,19 @@ async def delete_resource_group(secure_computation_node_id: PyObjectId, current_
     :param current_user: current user information
     :type current_user: TokenData
     """
-    try:
-        # Delete the scn resource group
-        owner = get_secret("owner")
-        deployment_name = f"{owner}-{str(secure_computation_node_id)}-scn"
-
-        account_credentials = await azure.authenticate()
-        delete_response = await azure.delete_resouce_group(account_credentials, deployment_name)
-        if delete_response.status != "Success":
-            raise Exception(delete_response.note)
-
-        # Update the secure computation node
-        await SecureComputationNode.update(
-            secure_computation_node_id=secure_computation_node_id,
-            researcher_organization_id=current_user.organization_id,
-            researcher_user_id=current_user.id,
-            state=SecureComputationNodeState.DELETED,
-        )
+    # Delete the scn resource group, a resource group deleted by an earlier attempt is not an error
+    owner = get_secret("owner")
+    deployment_name = f"{owner}-{str(secure_computation_node_id)}-scn"
 
-    except Exception as exception:
-        print(exception)
-        # Update the database to mark the VM as FAILED
-        await SecureComputationNode.update(
-            secure_computation_node_id=secure_computation_node_id,
-            researcher_organization_id=current_user.organization_id,
-            researcher_user_id=current_user.id,
-            state=SecureComputationNodeState.DELETE_FAILED,
-            detail=str(exception),
-        )
+    account_credentials = await cloud_provider().authenticate()
+    delete_response = await cloud_provider().delete_resouce_group(account_credentials, deployment_name)
+    if delete_response.status != "Success":
+        raise Exception(delete_response.note)
+
+    # Update the secure computation node
+    await SecureComputationNode.update(
+        secure_computation_node_id=secure_computation_node_id,
+        researcher_organization_id=current_user.organization_id,
+        researcher_user_id=current_user.id,
+        state=SecureComputationNodeState.DELETED,
+    )
@@ -12,42 +12,117 @@
 #     prior written permission of Secure Ai Labs, Inc.
 # -------------------------------------------------------------------------------
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import motor.motor_asyncio
 import pymongo.results as results
+from pymongo import ReturnDocument
 
-client = motor.motor_asyncio.AsyncIOMotorClient("mongodb://127.0.0.1:27017/")
-sail_db = client.sailDatabase
+from app.utils.metrics import MongoPoolListener
+from app.utils.timing import STAGE_DB, timed
 
+MONGODB_URL = "mongodb://127.0.0.1:27017/"
 
-async def find_one(collection, query) -> Optional[dict]:
-    return await sail_db[collection].find_one(query)
+pool_listener = MongoPoolListener()
 
+# The client is opened by the lifespan of the server, on the event loop that serves the requests
+client: Optional[motor.motor_asyncio.AsyncIOMotorClient] = None
+sail_db: Optional[motor.motor_asyncio.AsyncIOMotorDatabase] = None
 
+
+def connect():
+    """
+    Open the connection pool of the database
+    """
+    global client, sail_db
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL, event_listeners=[pool_listener])
+    sail_db = client.sailDatabase
+
+
+async def ping():
+    """
+    Check that the database answers
+    """
+    await client.admin.command("ping")
+
+
+def close():
+    """
+    Close the connection pool of the database, once the background tasks are done with it
+    """
+    global client, sail_db
+    if client is not None:
+        client.close()
+    client = None
+    sail_db = None
+
+
+# Every update increments the revision of the document so that its ETag can be computed without loading it
+REVISION_FIELD = "_rev"
+
+
+def _with_revision(data: dict) -> dict:
+    return {**data, "$inc": {**data.get("$inc", {}), REVISION_FIELD: 1}}
+
+
+@timed(STAGE_DB)
+async def find_one(collection, query, projection: Optional[dict] = None) -> Optional[dict]:
+    return await sail_db[collection].find_one(query, projection)
+
+
+@timed(STAGE_DB)
 async def find_all(collection: str) -> list:
     return await sail_db[collection].find().to_list(None)
 
 
+@timed(STAGE_DB)
 async def find_by_query(collection: str, query) -> List[Dict[str, Any]]:
     return await sail_db[collection].find(query).to_list(None)
 
 
+@timed(STAGE_DB)
 async def insert_one(collection: str, data) -> results.InsertOneResult:
     return await sail_db[collection].insert_one(data)
 
 
+@timed(STAGE_DB)
 async def update_one(collection: str, query: dict, data) -> results.UpdateResult:
-    return await sail_db[collection].update_one(query, data)
+    return await sail_db[collection].update_one(query, _with_revision(data))
 
 
+@timed(STAGE_DB)
 async def update_many(collection: str, query: dict, data) -> results.UpdateResult:
-    return await sail_db[collection].update_many(query, data)
+    return await sail_db[collection].update_many(query, _with_revision(data))
+
+
+@timed(STAGE_DB)
+async def count(collection: str, query: dict) -> int:
+    return await sail_db[collection].count_documents(query)
+
 
+@timed(STAGE_DB)
+async def find_one_and_update(
+    collection: str, query: dict, data, sort: Optional[List[Tuple[str, int]]] = None, upsert: bool = False
+) -> Optional[Dict[str, Any]]:
+    return await sail_db[collection].find_one_and_update(
+        query, _with_revision(data), sort=sort, upsert=upsert, return_document=ReturnDocument.AFTER
+    )
 
+
+@timed(STAGE_DB)
 async def delete(collection: str, query: dict) -> results.DeleteResult:
     return await sail_db[collection].delete_one(query)
 
 
+@timed(STAGE_DB)
+async def delete_many(collection: str, query: dict) -> results.DeleteResult:
+    return await sail_db[collection].delete_many(query)
+
+
+@timed(STAGE_DB)
 async def drop():
     return await client.drop_database(sail_db)
+
+
+async def create_index(collection: str, keys: List[Tuple[str, int]], **kwargs) -> str:
+    return await sail_db[collection].create_index(keys, **kwargs)
@@ -12,14 +12,16 @@
 #     prior written permission of Secure Ai Labs, Inc.
 # -------------------------------------------------------------------------------
 
+import asyncio
 import base64
 import json
 import logging
+import os
 import traceback
-from typing import Any, Callable, Dict, List, Union
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Union
 from urllib.parse import parse_qs, urlencode
 
-import aiohttp
 import fastapi.openapi.utils as utils
 from fastapi import FastAPI, Response, status
 from fastapi.encoders import jsonable_encoder
@@ -27,8 +29,7 @@ from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi_responses import custom_openapi
 from pydantic import BaseModel, Field, StrictStr
 
@@ -42,22 +43,98 @@ from app.api import (
     data_models,
     dataset_versions,
     datasets,
+    diagnostics,
     internal_utils,
+    jobs,
     secure_computation_nodes,
 )
 from app.data import operations as data_service
 from app.models.common import PyObjectId
+from app.utils.background_couroutines import DEFAULT_DRAIN_TIMEOUT, drain_background_tasks
+from app.utils.cloud import close_cloud_provider, start_cloud_provider
+from app.utils.compression import CompressionMiddleware
+from app.utils.dns_registration import close_dns_registrar
+from app.utils.etag import ConditionalGetMiddleware
+from app.utils.jobs import job_worker
+from app.utils.locks import start_singleton_loops, stop_singleton_loops
 from app.utils.logging import LogLevel, Resource, add_log_message
-from app.utils.secrets import get_secret
+from app.utils.memory import track_structure
+from app.utils.metrics import MetricsMiddleware, monitor_event_loop_lag
+from app.utils.profiling import (
+    PROFILE_HEADER,
+    PROFILE_URL_HEADER,
+    REQUEST_ID_HEADER,
+    ProfilingMiddleware,
+    enable_request_profiling,
+)
+from app.utils.secrets import get_optional_secret, get_secret
+from app.utils.static_assets import (
+    CACHE_CONTROL_REVALIDATE,
+    PrecompressedStaticFiles,
+    StaticAsset,
+    asset_response,
+    build_static_asset,
+)
+from app.utils.timing import TIMING_DEBUG_HEADER, ServerTimingMiddleware
+from app.utils.tracing import TRACE_ID_HEADER, TracingMiddleware, configure_tracing, shutdown_tracing
+from app.utils.watchdog import DEFAULT_THRESHOLD, start_watchdog, stop_watchdog
+
+OPENAPI_URL = "/openapi.json"
+STATIC_URL = "/static"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Open the shared clients and start the monitors before serving any request. On shutdown, once the server
+    stopped accepting requests, the background tasks are drained before the clients are closed.
 
+    :param app: the server
+    :type app: FastAPI
+    """
+    start_tracing()
+    audit.configure_audit_server()
+    data_service.connect()
+    await start_cloud_provider()
+    event_loop_lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    start_event_loop_watchdog()
+    start_request_profiler()
+    await prepare_static_assets()
+    await job_worker.start()
+    start_singleton_loops()
+    diagnostics.set_worker_ready(True)
+
+    yield
+
+    diagnostics.set_worker_ready(False)
+    drain_timeout = float(get_optional_secret("shutdown_drain_timeout_seconds", DEFAULT_DRAIN_TIMEOUT))
+    await asyncio.gather(job_worker.stop(drain_timeout), drain_background_tasks(drain_timeout), stop_singleton_loops())
+    data_service.close()
+    await close_cloud_provider()
+    await close_dns_registrar()
+    event_loop_lag_monitor.cancel()
+    await stop_watchdog()
+    shutdown_tracing()
+
+
+# The openapi document is served by a custom route below with the precompressed schema
 server = FastAPI(
     title="SAIL",
     description="All the private and public APIs for the Secure AI Labs",
     version="0.1.0",
     docs_url=None,
+    openapi_url=None,
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 server.openapi = custom_openapi(server)
 
+# Static files are read and compressed once at startup and served from memory
+static_files = PrecompressedStaticFiles(directory=os.path.join(os.path.dirname(__file__), "static"))
+track_structure("static_assets", lambda: static_files.assets)
+server.mount(STATIC_URL, static_files, name="static")
+openapi_asset: Optional[StaticAsset] = None
+
 
 origins = [
     "*",
@@ -75,6 +152,8 @@ server.include_router(internal_utils.router)
 server.include_router(data_models.router)
 server.include_router(data_model_versions.router)
 server.include_router(comment_chains.router)
+server.include_router(diagnostics.router)
+server.include_router(jobs.router)
 
 server.add_middleware(
     CORSMiddleware,
@@ -82,6 +161,22 @@ server.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[TIMING_DEBUG_HEADER, TRACE_ID_HEADER, PROFILE_HEADER, PROFILE_URL_HEADER, REQUEST_ID_HEADER],
+)
+
+# Answer conditional GET requests of the routes that can't tell the revision of their response by hashing the body
+server.add_middleware(ConditionalGetMiddleware)
+
+# Compress the json responses of the api. This is added before the audit middleware so that it sees the
+# response of the route as it is, the static files and the openapi document are already precompressed.
+server.add_middleware(
+    CompressionMiddleware,
+    minimum_size=1024,
+    compression_levels={
+        "zstd": {"application/json": 3, "text/html": 3, "text/plain": 3},
+        "gzip": {"application/json": 6, "text/html": 6, "text/plain": 6},
+    },
+    excluded_paths=[STATIC_URL, OPENAPI_URL],
 )
 
 
@@ -116,6 +211,8 @@ async def server_error_exception_handler(request: Request, exc: Exception):
 
     # if the slack webhook is set, send the error to slack via aiohttp
     if get_secret("slack_webhook"):
+        import aiohttp
+
         headers = {"Content-type": "application/json"}
         async with aiohttp.ClientSession() as session:
             async with session.post(
@@ -150,18 +247,68 @@ async def server_error_exception_handler(request: Request, exc: Exception):
 utils.validation_error_response_definition = ValidationError.schema()
 
 
+def build_openapi_asset() -> StaticAsset:
+    """
+    Generate the openapi schema once and keep it serialized and compressed in memory
+
+    :return: the openapi document as a static asset
+    :rtype: StaticAsset
+    """
+    global openapi_asset
+    if openapi_asset is None:
+        openapi_asset = build_static_asset(json.dumps(server.openapi()).encode("utf-8"), "application/json")
+    return openapi_asset
+
+
+async def prepare_static_assets():
+    """
+    Compress the static files and the openapi document before serving any request
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, static_files.load)
+    await loop.run_in_executor(None, build_openapi_asset)
+
+
+def start_tracing():
+    """
+    Export the spans with the exporter selected in the initialization vector, if any
+    """
+    configure_tracing(
+        exporter_name=get_optional_secret("tracing_exporter"),
+        file_path=get_optional_secret("tracing_file_path", "traces.jsonl"),
+        otlp_endpoint=get_optional_secret("tracing_otlp_endpoint", "http://localhost:4318"),
+    )
+
+
+def start_event_loop_watchdog():
+    """
+    Report the code that blocks the event loop longer than the threshold of the initialization vector
+    """
+    threshold_ms = get_optional_secret("event_loop_block_threshold_ms", DEFAULT_THRESHOLD * 1000)
+    start_watchdog(threshold=float(threshold_ms) / 1000)
+
+
+def start_request_profiler():
+    """
+    Let the admins profile their requests unless it is disabled in the initialization vector
+    """
+    if get_optional_secret("request_profiling_enabled", True):
+        enable_request_profiling()
+
+
+@server.get(OPENAPI_URL, include_in_schema=False)
+async def openapi_document(request: Request):
+    return asset_response(request, build_openapi_asset(), CACHE_CONTROL_REVALIDATE)
+
+
 @server.get("/docs", include_in_schema=False)
 async def custom_swagger_ui_html():
-    if server.openapi_url is None:
-        raise RequestValidationError("openapi_url must be provided to serve Swagger UI")
-
-    server.mount("/static", StaticFiles(directory="./app/static"), name="static")
     return get_swagger_ui_html(
-        openapi_url=server.openapi_url,
+        openapi_url=OPENAPI_URL,
         title=server.title + " - Swagger UI",
         oauth2_redirect_url=server.swagger_ui_oauth2_redirect_url,
-        swagger_js_url="/static/swagger-ui-bundle.js",
-        swagger_css_url="/static/swagger-ui.css",
+        swagger_js_url=static_files.url_for(STATIC_URL, "swagger-ui-bundle.js"),
+        swagger_css_url=static_files.url_for(STATIC_URL, "swagger-ui.css"),
     )
 
 
@@ -243,3 +390,10 @@ async def add_audit_log(request: Request, call_next: Callable):
     add_log_message(LogLevel.INFO, Resource.USER_ACTIVITY, message)
 
     return response
+
+
+# Added last so that they are the outermost middlewares and cover the whole request
+server.add_middleware(ServerTimingMiddleware, timing_allow_origin=", ".join(origins))
+server.add_middleware(ProfilingMiddleware, is_allowed=authentication.is_sail_admin_token)
+server.add_middleware(TracingMiddleware)
+server.add_middleware(MetricsMiddleware)
@@ -33,7 +33,9 @@ class PyObjectId(UUID):
 
     @classmethod
     def validate(cls, v):
-        uuid_obj = UUID(str(v), version=4)
+        # Ids which are already version 4 uuids don't need to be parsed again
+        if isinstance(v, UUID) and v.version == 4:
+            return v
         return UUID(str(v), version=4)
 
     @classmethod
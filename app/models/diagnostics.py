@@ -0,0 +1,131 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# diagnostics.py
+# -------------------------------------------------------------------------------
+"""Models used by the diagnostics of the service"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+from datetime import datetime
+from enum import Enum
+from typing import Dict, List, Optional
+
+from pydantic import Field, StrictBool, StrictFloat, StrictInt, StrictStr
+
+from app.models.common import SailBaseModel
+
+
+class EventLoopBlock_Out(SailBaseModel):
+    callsite: StrictStr = Field()
+    count: StrictInt = Field()
+    total_blocked_seconds: StrictFloat = Field()
+    max_blocked_seconds: StrictFloat = Field()
+    last_seen: datetime = Field()
+    stack: List[StrictStr] = Field()
+
+
+class GetEventLoopBlocks_Out(SailBaseModel):
+    threshold_seconds: StrictFloat = Field()
+    blocks: List[EventLoopBlock_Out] = Field()
+
+
+class RequestProfile_Out(SailBaseModel):
+    request_id: StrictStr = Field()
+    method: StrictStr = Field()
+    path: StrictStr = Field()
+    trace_id: Optional[StrictStr] = Field(default=None)
+    started: datetime = Field()
+    duration_seconds: StrictFloat = Field()
+    samples: StrictInt = Field()
+
+
+class GetMultipleRequestProfiles_Out(SailBaseModel):
+    profiles: List[RequestProfile_Out] = Field()
+
+
+class MemoryGroupBy(Enum):
+    FILE = "filename"
+    LINE = "lineno"
+
+
+class StructureSize_Out(SailBaseModel):
+    name: StrictStr = Field()
+    entries: StrictInt = Field()
+    approximate_bytes: StrictInt = Field()
+
+
+class MemorySnapshot_Out(SailBaseModel):
+    name: StrictStr = Field()
+    taken: datetime = Field()
+    traced_bytes: StrictInt = Field()
+
+
+class GetMemoryUsage_Out(SailBaseModel):
+    resident_set_bytes: StrictInt = Field()
+    allocation_tracing: StrictBool = Field()
+    traced_current_bytes: Optional[StrictInt] = Field(default=None)
+    traced_peak_bytes: Optional[StrictInt] = Field(default=None)
+    mongo_pool_open_connections: StrictInt = Field()
+    mongo_pool_checked_out_connections: StrictInt = Field()
+    structures: List[StructureSize_Out] = Field()
+    snapshots: List[MemorySnapshot_Out] = Field()
+
+
+class TakeMemorySnapshot_In(SailBaseModel):
+    name: StrictStr = Field(regex=r"^[A-Za-z0-9_\-]{1,64}$")
+
+
+class AllocationDiff_Out(SailBaseModel):
+    file: StrictStr = Field()
+    line: StrictInt = Field()
+    size_diff_bytes: StrictInt = Field()
+    size_bytes: StrictInt = Field()
+    count_diff: StrictInt = Field()
+    count: StrictInt = Field()
+
+
+class GetMemorySnapshotDiff_Out(SailBaseModel):
+    old: StrictStr = Field()
+    new: StrictStr = Field()
+    group_by: MemoryGroupBy = Field()
+    allocations: List[AllocationDiff_Out] = Field()
+
+
+class DependencyOperation_Out(SailBaseModel):
+    dependency: StrictStr = Field()
+    operation: StrictStr = Field()
+    calls: StrictInt = Field()
+    failures: StrictInt = Field()
+    retries: StrictInt = Field()
+    throttled: StrictInt = Field()
+    total_seconds: StrictFloat = Field()
+    p50_seconds: StrictFloat = Field()
+    p95_seconds: StrictFloat = Field()
+    p99_seconds: StrictFloat = Field()
+    max_seconds: StrictFloat = Field()
+    statuses: Dict[StrictStr, StrictInt] = Field()
+
+
+class RateLimit_Out(SailBaseModel):
+    name: StrictStr = Field()
+    remaining: StrictInt = Field()
+    updated: datetime = Field()
+
+
+class Dependency_Out(SailBaseModel):
+    name: StrictStr = Field()
+    circuit_state: StrictStr = Field()
+    in_flight: StrictInt = Field()
+    throttled_seconds: StrictFloat = Field()
+    rate_limits: List[RateLimit_Out] = Field()
+
+
+class GetDependencyTelemetry_Out(SailBaseModel):
+    since: datetime = Field()
+    dependencies: List[Dependency_Out] = Field()
+    operations: List[DependencyOperation_Out] = Field()
@@ -0,0 +1,62 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# jobs.py
+# -------------------------------------------------------------------------------
+"""Models used by the background jobs"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from pydantic import Field, StrictStr
+
+from app.models.common import PyObjectId, SailBaseModel
+
+
+class JobState(Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
+
+class Job_Base(SailBaseModel):
+    type: StrictStr = Field(...)
+    arguments: Dict[str, Any] = Field(default_factory=dict)
+    idempotency_key: Optional[StrictStr] = Field(default=None)
+    state: JobState = Field(...)
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(...)
+    created_time: datetime = Field(default_factory=datetime.utcnow)
+    updated_time: datetime = Field(default_factory=datetime.utcnow)
+    run_after: datetime = Field(default_factory=datetime.utcnow)
+    heartbeat_time: Optional[datetime] = Field(default=None)
+    last_error: Optional[StrictStr] = Field(default=None)
+    user_id: Optional[PyObjectId] = Field(default=None)
+
+
+class Job_Db(Job_Base):
+    id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
+    # Set while the job is queued or running, a job with the same key is not added again meanwhile
+    active_key: Optional[StrictStr] = Field(default=None)
+    lease_owner: Optional[StrictStr] = Field(default=None)
+    lease_expiry_time: Optional[datetime] = Field(default=None)
+    trace_id: Optional[StrictStr] = Field(default=None)
+    parent_span_id: Optional[StrictStr] = Field(default=None)
+
+
+class GetJob_Out(Job_Base):
+    id: PyObjectId = Field(alias="_id")
+    lease_owner: Optional[StrictStr] = Field(default=None)
+
+
+class GetMultipleJobs_Out(SailBaseModel):
+    jobs: List[GetJob_Out] = Field(...)
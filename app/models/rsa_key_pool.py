@@ -0,0 +1,36 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# rsa_key_pool.py
+# -------------------------------------------------------------------------------
+"""Models of the pool of RSA keys created ahead of the data submitters"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from pydantic import Field
+
+from app.models.common import KeyVaultObject, PyObjectId, SailBaseModel
+
+
+class PooledRsaKeyState(Enum):
+    AVAILABLE = "AVAILABLE"
+    CLAIMED = "CLAIMED"
+
+
+class PooledRsaKey_Db(SailBaseModel):
+    id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
+    key: KeyVaultObject = Field(...)
+    state: PooledRsaKeyState = Field(default=PooledRsaKeyState.AVAILABLE)
+    created_time: datetime = Field(default_factory=datetime.utcnow)
+    claimed_time: Optional[datetime] = Field(default=None)
+    data_federation_id: Optional[PyObjectId] = Field(default=None)
+    organization_id: Optional[PyObjectId] = Field(default=None)
@@ -11,30 +11,58 @@
 #     be disclosed to others for any purpose without
 #     prior written permission of Secure Ai Labs, Inc.
 # -------------------------------------------------------------------------------
+import asyncio
 import json
 import os
 import random
 from base64 import b64decode, b64encode
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
-
-from azure.core.exceptions import AzureError
-from azure.core.polling import AsyncLROPoller
-from azure.identity.aio import ClientSecretCredential
-from azure.keyvault.keys.aio import KeyClient
-from azure.keyvault.keys.crypto.aio import KeyWrapAlgorithm
-from azure.keyvault.secrets.aio import SecretClient
-from azure.mgmt.network.aio import NetworkManagementClient
-from azure.mgmt.resource.resources.aio import ResourceManagementClient
-from azure.mgmt.resource.resources.models import DeploymentMode, ResourceGroup
-from azure.mgmt.storage.aio import StorageManagementClient
-from azure.storage.fileshare import FileSasPermissions, generate_file_sas
-from azure.storage.fileshare.aio import ShareDirectoryClient
+from typing import TYPE_CHECKING, Dict, Optional, Tuple, Type
+
+from azure.core.exceptions import (
+    AzureError,
+    ClientAuthenticationError,
+    ResourceExistsError,
+    ResourceNotFoundError,
+)
 from pydantic import BaseModel, Field, StrictStr
 
 from app.models.common import KeyVaultObject
+from app.utils.azure_clients import ClientType, azure_clients
+from app.utils.azure_credential import SharedCredential, get_credential
+from app.utils.cache import TTLCache
+from app.utils.dependency_telemetry import record_azure_response
+from app.utils.memory import track_structure
+from app.utils.resilience import AZURE_DEPLOYMENTS, AZURE_KEY_VAULT, AZURE_RESOURCE_MANAGER, AZURE_STORAGE, resilient
 from app.utils.secrets import get_secret
+from app.utils.timing import STAGE_AZURE, timed
+
+# The management, key vault and storage SDKs take most of the import time of the application, they are
+# imported by the functions that use them so that the workers start without loading them
+if TYPE_CHECKING:
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+
+
+# Status of a storage operation refused with the key of the connection string, the key was likely rotated
+AUTHENTICATION_FAILED = "AuthenticationFailed"
+
+# The keys are fetched again after the time to live, or as soon as one fails to authenticate
+STORAGE_ACCOUNT_KEY_TTL = 900.0
+_storage_account_keys = TTLCache(maxsize=16, ttl=STORAGE_ACCOUNT_KEY_TTL)
+_storage_account_key_locks: Dict[Tuple[str, str, str], asyncio.Lock] = {}
+track_structure("storage_account_keys", lambda: _storage_account_keys)
+
+# A version of a secret never changes, so the wrapped dataset keys are kept for a while to unwrap them again
+# without reading the key vault. They are useless without the wrapping key that never leaves the key vault.
+WRAPPED_KEY_CACHE_TTL = 600.0
+_wrapped_keys = TTLCache(maxsize=1024, ttl=WRAPPED_KEY_CACHE_TTL)
+track_structure("wrapped_keys", lambda: _wrapped_keys)
+
+# The public halves of the wrapping keys, a version of a key never changes either
+RSA_PUBLIC_KEY_CACHE_TTL = 86400.0
+_rsa_public_keys = TTLCache(maxsize=1024, ttl=RSA_PUBLIC_KEY_CACHE_TTL)
+track_structure("rsa_public_keys", lambda: _rsa_public_keys)
 
 
 class DeploymentResponse(BaseModel):
@@ -57,11 +85,46 @@ class DeleteResponse(BaseModel):
 class AzureCredentials:
     """Azure credentials."""
 
-    credentials: ClientSecretCredential
+    credentials: SharedCredential
     subscription_id: str
     location: str
 
 
+def _management_client(client_class: Type[ClientType], account_credentials: AzureCredentials) -> ClientType:
+    """
+    The shared management client of the subscription
+
+    :param client_class: class of the management client
+    :type client_class: Type[ClientType]
+    :param account_credentials: The account credentials.
+    :type account_credentials: AzureCredentials
+    :return: the client
+    :rtype: ClientType
+    """
+    return azure_clients.get(
+        client_class,
+        account_credentials.subscription_id,
+        credential=account_credentials.credentials,
+        subscription_id=account_credentials.subscription_id,
+    )
+
+
+def _key_vault_client(client_class: Type[ClientType], account_credentials: AzureCredentials) -> ClientType:
+    """
+    The shared key or secret client of the key vault
+
+    :param client_class: class of the key vault client
+    :type client_class: Type[ClientType]
+    :param account_credentials: The account credentials.
+    :type account_credentials: AzureCredentials
+    :return: the client
+    :rtype: ClientType
+    """
+    vault_url = get_secret("azure_keyvault_url")
+    return azure_clients.get(client_class, vault_url, vault_url=vault_url, credential=account_credentials.credentials)
+
+
+@timed(STAGE_AZURE)
 async def authentication_shared_access_signature(
     account_credentials: AzureCredentials,
     account_name: str,
@@ -72,7 +135,7 @@ async def authentication_shared_access_signature(
     expiry: datetime,
 ):
     """
-    Get the connection string for the storage account and file share.
+    Get a shared access signature of a file, signed with the cached key of the storage account.
 
     :param account_credentials: The account credentials.
     :type account_credentials: AzureCredentials
@@ -91,21 +154,18 @@ async def authentication_shared_access_signature(
     :return: The response with status and sas_token.
     :rtype: DeploymentResponse
     """
-    try:
-        # Create a client to the storage account.
-        storage_client = StorageManagementClient(
-            credential=account_credentials.credentials, subscription_id=account_credentials.subscription_id  # type: ignore
-        )
+    from azure.storage.fileshare import FileSasPermissions, generate_file_sas
 
-        # Get the storage account key.
-        keys = await storage_client.storage_accounts.list_keys(resource_group_name, account_name)
+    try:
+        # Get the storage account key, from the cache unless it expired
+        account_key = await get_storage_account_key(account_credentials, resource_group_name, account_name)
 
-        # Create a connection string to the file share.
+        # The token is signed locally with the key
         sas_token = generate_file_sas(
             account_name=account_name,
             share_name=share_name,
             file_path=[file_path],
-            account_key=keys.keys[0].value,  # type: ignore
+            account_key=account_key,
             permission=FileSasPermissions.from_string(permission),
             expiry=expiry,
         )
@@ -117,6 +177,7 @@ async def authentication_shared_access_signature(
         return DeploymentResponse(status="Fail", note=str(exception))
 
 
+@timed(STAGE_AZURE)
 async def file_share_create_directory(
     connection_string: str, file_share_name: str, directory_name: str
 ) -> DeploymentResponse:
@@ -129,25 +190,79 @@ async def file_share_create_directory(
     :type file_share_name: str
     :param directory_name: the directory name in the file share to be created
     :type directory_name: str
-    :return: status of file creation
+    :return: status of file creation, AUTHENTICATION_FAILED if the account key of the connection string was rotated
     :rtype: DeploymentResponse
     """
+    from azure.storage.fileshare.aio import ShareDirectoryClient
 
     try:
         directory_client = ShareDirectoryClient.from_connection_string(
-            conn_str=connection_string, share_name=file_share_name, directory_path=directory_name
+            conn_str=connection_string,
+            share_name=file_share_name,
+            directory_path=directory_name,
+            transport=azure_clients.transport(),
+            retry_total=0,
+            raw_response_hook=record_azure_response,
         )
-        create_response = await directory_client.create_directory()  # type: ignore
+        async with directory_client:
+            create_response = await AZURE_STORAGE.call("create_directory", directory_client.create_directory)
 
         return DeploymentResponse(status="Success", note="Deployment Successful")
+    except ResourceExistsError:
+        # Created by an earlier attempt
+        return DeploymentResponse(status="Success", note="Directory already exists")
+    except ClientAuthenticationError as authentication_error:
+        return DeploymentResponse(status=AUTHENTICATION_FAILED, note=str(authentication_error))
     except AzureError as azure_error:
         return DeploymentResponse(status="Fail", note=str(azure_error))
     except Exception as exception:
         return DeploymentResponse(status="Fail", note=str(exception))
 
 
+# Not timed, the functions calling it are and the stage would count its duration twice
+async def get_storage_account_key(
+    account_credentials: AzureCredentials, resource_group_name: str, account_name: str, refresh: bool = False
+) -> str:
+    """
+    Get the first key of the storage account, it is cached for a while so that the signatures and the
+    connection strings are made without calling azure resource manager
+
+    :param account_credentials: The account credentials.
+    :type account_credentials: AzureCredentials
+    :param resource_group_name: The resource group name.
+    :type resource_group_name: str
+    :param account_name: The account name.
+    :type account_name: str
+    :param refresh: fetch the key again, after it failed to authenticate because it was rotated
+    :type refresh: bool
+    :return: The account key.
+    :rtype: str
+    """
+    from azure.mgmt.storage.aio import StorageManagementClient
+
+    cache_key = (account_credentials.subscription_id, resource_group_name, account_name)
+    if refresh:
+        _storage_account_keys.pop(cache_key)
+    account_key = _storage_account_keys.get(cache_key)
+    if account_key is not None:
+        return account_key
+
+    # The concurrent callers share one request
+    async with _storage_account_key_locks.setdefault(cache_key, asyncio.Lock()):
+        account_key = _storage_account_keys.get(cache_key)
+        if account_key is None:
+            storage_client = _management_client(StorageManagementClient, account_credentials)
+            keys = await AZURE_RESOURCE_MANAGER.call(
+                "list_keys", storage_client.storage_accounts.list_keys, resource_group_name, account_name
+            )
+            account_key = keys.keys[0].value  # type: ignore
+            _storage_account_keys[cache_key] = account_key
+        return account_key  # type: ignore
+
+
+@timed(STAGE_AZURE)
 async def get_storage_account_connection_string(
-    account_credentials: AzureCredentials, resource_group_name: str, account_name: str
+    account_credentials: AzureCredentials, resource_group_name: str, account_name: str, refresh_key: bool = False
 ) -> DeploymentResponse:
     """
     Get the connection string for the storage account and file share.
@@ -158,18 +273,19 @@ async def get_storage_account_connection_string(
     :type resource_group_name: str
     :param account_name: The account name.
     :type account_name: str
+    :param refresh_key: fetch the account key again instead of using the cached one
+    :type refresh_key: bool
     :return: The response with status and connection string.
     :rtype: DeploymentResponse
     """
     try:
-        # Create a client to the storage account.
-        storage_client = StorageManagementClient(account_credentials.credentials, account_credentials.subscription_id)  # type: ignore
-
         # Get the storage account key.
-        keys = await storage_client.storage_accounts.list_keys(resource_group_name, account_name)
+        account_key = await get_storage_account_key(
+            account_credentials, resource_group_name, account_name, refresh=refresh_key
+        )
 
         # Create a connection string to the file share.
-        conn_string = f"DefaultEndpointsProtocol=https;EndpointSuffix=core.windows.net;AccountName={account_name};AccountKey={keys.keys[0].value}"  # type: ignore
+        conn_string = f"DefaultEndpointsProtocol=https;EndpointSuffix=core.windows.net;AccountName={account_name};AccountKey={account_key}"
 
         return DeploymentResponse(status="Success", response=conn_string, note="Deployment Successful")
     except AzureError as azure_error:
@@ -190,6 +306,7 @@ async def get_randomized_name(prefix: str) -> str:
     return f"{prefix}{random.randint(1,100000):05}"
 
 
+@timed(STAGE_AZURE)
 async def create_storage_account(
     account_credentials: AzureCredentials, resource_group_name: str, account_name_prefix: str, location: str
 ) -> DeploymentResponse:
@@ -208,9 +325,11 @@ async def create_storage_account(
     :return: The response with status and account name.
     :rtype: DeploymentResponse
     """
+    from azure.mgmt.storage.aio import StorageManagementClient
+
     try:
         # Provision the storage account, starting with a management object.
-        storage_client = StorageManagementClient(account_credentials.credentials, account_credentials.subscription_id)  # type: ignore
+        storage_client = _management_client(StorageManagementClient, account_credentials)
 
         # Check if the account name is available. Storage account names must be unique across
         # Azure because they're used in URLs.
@@ -219,7 +338,11 @@ async def create_storage_account(
         account_name = await get_randomized_name(account_name_prefix)
         while (name_found is False) and (number_tries < 10):
             number_tries += 1
-            availability_result = await storage_client.storage_accounts.check_name_availability({"name": account_name})  # type: ignore
+            availability_result = await AZURE_RESOURCE_MANAGER.call(
+                "check_name_availability",
+                storage_client.storage_accounts.check_name_availability,
+                {"name": account_name},  # type: ignore
+            )
             if availability_result.name_available:
                 name_found = True
             else:
@@ -229,7 +352,9 @@ async def create_storage_account(
             raise Exception("Unable to find an available storage account name.")
 
         # The name is available, so provision the account
-        await storage_client.storage_accounts.begin_create(
+        await AZURE_RESOURCE_MANAGER.call(
+            "create_storage_account",
+            storage_client.storage_accounts.begin_create,
             resource_group_name,
             account_name,
             {"location": location, "kind": "StorageV2", "sku": {"name": "Standard_LRS"}},  # type: ignore
@@ -242,6 +367,7 @@ async def create_storage_account(
         return DeploymentResponse(status="Fail", note=str(exception))
 
 
+@timed(STAGE_AZURE)
 async def create_file_share(
     account_credentials: AzureCredentials, resource_group_name: str, account_name: str, file_share_name: str
 ) -> DeploymentResponse:
@@ -259,19 +385,33 @@ async def create_file_share(
     :return: The response with status and file share name.
     :rtype: DeploymentResponse
     """
+    from azure.mgmt.storage.aio import StorageManagementClient
+
     try:
-        storage_client = StorageManagementClient(account_credentials.credentials, account_credentials.subscription_id)  # type: ignore
+        storage_client = _management_client(StorageManagementClient, account_credentials)
 
         # Create a file share in the storage account.
-        await storage_client.file_shares.create(resource_group_name, account_name, file_share_name, {})  # type: ignore
+        await AZURE_RESOURCE_MANAGER.call(
+            "create_file_share",
+            storage_client.file_shares.create,
+            resource_group_name,
+            account_name,
+            file_share_name,
+            {},  # type: ignore
+        )
 
         return DeploymentResponse(status="Success", note="Deployment Successful")
+    except ResourceExistsError:
+        # Created by an earlier attempt
+        return DeploymentResponse(status="Success", note="File share already exists")
     except AzureError as azure_error:
         return DeploymentResponse(status="Fail", note=str(azure_error))
     except Exception as exception:
         return DeploymentResponse(status="Fail", note=str(exception))
 
 
+@timed(STAGE_AZURE)
+@resilient(AZURE_RESOURCE_MANAGER)
 async def create_resource_group(account_credentials: AzureCredentials, resource_group_name: str):
     """
     Deploy the template to a resource group.
@@ -285,8 +425,11 @@ async def create_resource_group(account_credentials: AzureCredentials, resource_
     :return: provisioning state of the resource group.
     :rtype: str
     """
+    from azure.mgmt.resource.resources.aio import ResourceManagementClient
+    from azure.mgmt.resource.resources.models import ResourceGroup
+
     module_name = resource_group_name.split("-")[-1]
-    client = ResourceManagementClient(account_credentials.credentials, account_credentials.subscription_id)  # type: ignore
+    client = _management_client(ResourceManagementClient, account_credentials)
     response: ResourceGroup = await client.resource_groups.create_or_update(
         resource_group_name,
         parameters=ResourceGroup(
@@ -305,20 +448,18 @@ async def authenticate() -> AzureCredentials:
     """
     Authenticate using client_id and client_secret.
 
+    The credential is shared by the whole worker and keeps its tokens fresh in the background.
+
     :return: The credentials and subscription id.
-    :rtype: dict
+    :rtype: AzureCredentials
     """
-
-    credentials = ClientSecretCredential(
-        client_id=get_secret("azure_client_id"),
-        client_secret=get_secret("azure_client_secret"),
-        tenant_id=get_secret("azure_tenant_id"),
-    )
     return AzureCredentials(
-        credentials=credentials, subscription_id=get_secret("azure_subscription_id"), location="westus"
+        credentials=get_credential(), subscription_id=get_secret("azure_subscription_id"), location="westus"
     )
 
 
+@timed(STAGE_AZURE)
+@resilient(AZURE_DEPLOYMENTS)
 async def deploy_template(
     account_credentials: AzureCredentials, resource_group_name: str, template: str, parameters: dict
 ):
@@ -335,7 +476,11 @@ async def deploy_template(
     :type parameters: dict
     :return: The deployment response.
     """
-    client = ResourceManagementClient(account_credentials.credentials, account_credentials.subscription_id)  # type: ignore
+    from azure.core.polling import AsyncLROPoller
+    from azure.mgmt.resource.resources.aio import ResourceManagementClient
+    from azure.mgmt.resource.resources.models import DeploymentMode
+
+    client = _management_client(ResourceManagementClient, account_credentials)
 
     parameters = {k: {"value": v} for k, v in parameters.items()}
     deployment_properties = {
@@ -356,6 +501,7 @@ async def deploy_template(
     await deployment_state.wait()
 
 
+@timed(STAGE_AZURE)
 async def delete_resouce_group(account_credentials: AzureCredentials, resource_group_name: str) -> DeleteResponse:
     """
     Delete the resource group.
@@ -367,17 +513,26 @@ async def delete_resouce_group(account_credentials: AzureCredentials, resource_g
     :return: The delete response.
     :rtype: DeleteResponse
     """
+    from azure.mgmt.resource.resources.aio import ResourceManagementClient
+
     try:
-        client = ResourceManagementClient(account_credentials.credentials, account_credentials.subscription_id)  # type: ignore
-        delete_async_operation = await client.resource_groups.begin_delete(resource_group_name)
+        client = _management_client(ResourceManagementClient, account_credentials)
+        delete_async_operation = await AZURE_RESOURCE_MANAGER.call(
+            "delete_resource_group", client.resource_groups.begin_delete, resource_group_name
+        )
 
         return DeleteResponse(status="Success", note="")
+    except ResourceNotFoundError:
+        # Deleted by an earlier attempt
+        return DeleteResponse(status="Success", note="Resource group not found")
     except AzureError as azure_error:
         return DeleteResponse(status="Fail", note=str(azure_error))
     except Exception as exception:
         return DeleteResponse(status="Fail", note=str(exception))
 
 
+@timed(STAGE_AZURE)
+@resilient(AZURE_RESOURCE_MANAGER)
 async def get_ip(account_credentials: AzureCredentials, resource_group_name: str, ip_resource_name: str) -> str:
     """
     Get the IP address of the resource.
@@ -391,13 +546,17 @@ async def get_ip(account_credentials: AzureCredentials, resource_group_name: str
     :return: The ip address.
     :rtype: str
     """
-    client = NetworkManagementClient(account_credentials.credentials, account_credentials.subscription_id)  # type: ignore
+    from azure.mgmt.network.aio import NetworkManagementClient
+
+    client = _management_client(NetworkManagementClient, account_credentials)
     public_ip_address = await client.public_ip_addresses.get(resource_group_name, ip_resource_name)
     if public_ip_address.ip_address is None:
         raise Exception("Unable to get IP address")
     return public_ip_address.ip_address
 
 
+@timed(STAGE_AZURE)
+@resilient(AZURE_RESOURCE_MANAGER)
 async def get_private_ip(
     account_credentials: AzureCredentials, resource_group_name: str, network_interface_name: str
 ) -> str:
@@ -413,7 +572,9 @@ async def get_private_ip(
     :return: The private ip address.
     :rtype: str
     """
-    client = NetworkManagementClient(account_credentials.credentials, account_credentials.subscription_id)  # type: ignore
+    from azure.mgmt.network.aio import NetworkManagementClient
+
+    client = _management_client(NetworkManagementClient, account_credentials)
     network_interfaces = await client.network_interfaces.get(resource_group_name, network_interface_name)
 
     if network_interfaces.ip_configurations is None:
@@ -485,6 +646,8 @@ async def deploy_module(
         return DeploymentResponse(status="Fail", ip_address="", note=str(exception))
 
 
+@timed(STAGE_AZURE)
+@resilient(AZURE_KEY_VAULT)
 async def create_rsa_key(
     account_credentials: AzureCredentials, key_name: str, key_size: int
 ) -> Optional[KeyVaultObject]:
@@ -494,7 +657,9 @@ async def create_rsa_key(
     :param account_credentials: The account credentials.
     :type account_credentials: AzureCredentials
     """
-    key_client = KeyClient(vault_url=get_secret("azure_keyvault_url"), credential=account_credentials.credentials)  # type: ignore
+    from azure.keyvault.keys.aio import KeyClient
+
+    key_client = _key_vault_client(KeyClient, account_credentials)
 
     if key_size < 3072:
         raise ValueError("Key size must be at least 3072 bits.")
@@ -508,9 +673,63 @@ async def create_rsa_key(
     return KeyVaultObject(name=key_name, version=rsa_key.properties.version)
 
 
+@timed(STAGE_AZURE)
+@resilient(AZURE_KEY_VAULT)
+async def tag_rsa_key(account_credentials: AzureCredentials, rsa_key: KeyVaultObject, tags: Dict[str, str]):
+    """
+    Set the tags of a version of an RSA key.
+
+    :param account_credentials: The account credentials.
+    :type account_credentials: AzureCredentials
+    :param rsa_key: The RSA key.
+    :type rsa_key: KeyVaultObject
+    :param tags: The tags of the key.
+    :type tags: Dict[str, str]
+    """
+    from azure.keyvault.keys.aio import KeyClient
+
+    key_client = _key_vault_client(KeyClient, account_credentials)
+    await key_client.update_key_properties(rsa_key.name, version=rsa_key.version, tags=tags)
+
+
+# Not timed, wrap_aes_key is and the stage would count its duration twice
+async def get_rsa_public_key(account_credentials: AzureCredentials, rsa_key: KeyVaultObject) -> "RSAPublicKey":
+    """
+    Get the public half of an RSA key of the keyvault, read once for every version of the key.
+
+    :param account_credentials: The account credentials.
+    :type account_credentials: AzureCredentials
+    :param rsa_key: The RSA key.
+    :type rsa_key: KeyVaultObject
+    :raises ValueError: If the key is not an RSA key.
+    :return: The public key.
+    :rtype: RSAPublicKey
+    """
+    from azure.keyvault.keys.aio import KeyClient
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicNumbers
+
+    cache_key = (rsa_key.name, rsa_key.version)
+    public_key = _rsa_public_keys.get(cache_key)
+    if public_key is not None:
+        return public_key
+
+    key_client = _key_vault_client(KeyClient, account_credentials)
+    key_vault_key = await AZURE_KEY_VAULT.call("get_key", key_client.get_key, rsa_key.name, version=rsa_key.version)
+    json_web_key = key_vault_key.key
+    if json_web_key.n is None or json_web_key.e is None:
+        raise ValueError("Key is not an RSA key.")
+
+    public_key = RSAPublicNumbers(
+        e=int.from_bytes(json_web_key.e, "big"), n=int.from_bytes(json_web_key.n, "big")
+    ).public_key()
+    _rsa_public_keys[cache_key] = public_key
+    return public_key
+
+
+@timed(STAGE_AZURE)
 async def wrap_aes_key(aes_key: bytes, wrapping_key: KeyVaultObject) -> Optional[KeyVaultObject]:
     """
-    Wrap the AES key with the RSA key and then store it in the keyvault.
+    Wrap the AES key with the public RSA key and then store it in the keyvault.
 
     :param account_credentials: The account credentials.
     :type account_credentials: AzureCredentials
@@ -519,31 +738,36 @@ async def wrap_aes_key(aes_key: bytes, wrapping_key: KeyVaultObject) -> Optional
     :param rsa_key_id: The RSA key id.
     :type rsa_key_id: str
     """
+    from azure.keyvault.secrets.aio import SecretClient
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
     # Authenticate to Azure
     account_credentials = await authenticate()
 
-    # Wrap the AES key with the RSA key
-    key_client = KeyClient(vault_url=get_secret("azure_keyvault_url"), credential=account_credentials.credentials)  # type: ignore
-
-    # There is an option to add the key version to the key name, but it is not required.
-    crypto_client = key_client.get_cryptography_client(key_name=wrapping_key.name, key_version=wrapping_key.version)
-
-    # Wrap the AES key with the RSA key
-    wrapped_aes_key = await crypto_client.wrap_key(KeyWrapAlgorithm.rsa_oaep_256, aes_key)
+    # Wrap the AES key locally with the public half of the RSA key, as RSA-OAEP-256 so the key vault unwraps it
+    public_key = await get_rsa_public_key(account_credentials, wrapping_key)
+    wrapped_aes_key = public_key.encrypt(
+        aes_key, padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+    )
 
     # Store the wrapped AES key in the keyvault as a secret
-    secret_client = SecretClient(vault_url=get_secret("azure_keyvault_url"), credential=account_credentials.credentials)  # type: ignore
-    encoded_key = b64encode(wrapped_aes_key.encrypted_key).decode("ascii")
+    secret_client = _key_vault_client(SecretClient, account_credentials)
+    encoded_key = b64encode(wrapped_aes_key).decode("ascii")
 
     # The secret is created with the same name as the wrapping key
-    secret_set_response = await secret_client.set_secret(wrapping_key.name, encoded_key)
+    secret_set_response = await AZURE_KEY_VAULT.call(
+        "set_secret", secret_client.set_secret, wrapping_key.name, encoded_key
+    )
 
     if not secret_set_response.name or not secret_set_response.properties.version:
         raise ValueError("Secret name or version is not set.")
+    _wrapped_keys[(secret_set_response.name, secret_set_response.properties.version)] = encoded_key
 
     return KeyVaultObject(name=secret_set_response.name, version=secret_set_response.properties.version)
 
 
+@timed(STAGE_AZURE)
 async def unwrap_aes_with_rsa_key(wrapped_aes_key: KeyVaultObject, wrapping_key: KeyVaultObject) -> bytes:
     """
     Unwrap the AES key with the RSA key.
@@ -557,22 +781,32 @@ async def unwrap_aes_with_rsa_key(wrapped_aes_key: KeyVaultObject, wrapping_key:
     :return: The unwrapped AES key.
     :rtype: bytes
     """
+    from azure.keyvault.keys.aio import KeyClient
+    from azure.keyvault.keys.crypto.aio import KeyWrapAlgorithm
+    from azure.keyvault.secrets.aio import SecretClient
+
     # Authenticate to Azure
     account_credentials = await authenticate()
 
-    # Get the secret from the keyvault
-    secret_client = SecretClient(vault_url=get_secret("azure_keyvault_url"), credential=account_credentials.credentials)  # type: ignore
-    secret_get_response = await secret_client.get_secret(name=wrapped_aes_key.name, version=wrapped_aes_key.version)
+    # Get the secret from the keyvault, unless this version was read recently
+    cache_key = (wrapped_aes_key.name, wrapped_aes_key.version)
+    encoded_key = _wrapped_keys.get(cache_key)
+    if encoded_key is None:
+        secret_client = _key_vault_client(SecretClient, account_credentials)
+        secret_get_response = await AZURE_KEY_VAULT.call(
+            "get_secret", secret_client.get_secret, name=wrapped_aes_key.name, version=wrapped_aes_key.version
+        )
+        if not secret_get_response.value:
+            raise ValueError("Secret value is not set.")
+        encoded_key = secret_get_response.value
+        _wrapped_keys[cache_key] = encoded_key
 
     # UnWrap the secret with the RSA key
-    key_client = KeyClient(vault_url=get_secret("azure_keyvault_url"), credential=account_credentials.credentials)  # type: ignore
+    key_client = _key_vault_client(KeyClient, account_credentials)
     crypto_client = key_client.get_cryptography_client(key_name=wrapping_key.name, key_version=wrapping_key.version)
 
-    if not secret_get_response.value:
-        raise ValueError("Secret value is not set.")
-
-    unwrapped_aes_key = await crypto_client.unwrap_key(
-        KeyWrapAlgorithm.rsa_oaep_256, b64decode(secret_get_response.value.encode("ascii"))
+    unwrapped_aes_key = await AZURE_KEY_VAULT.call(
+        "unwrap_key", crypto_client.unwrap_key, KeyWrapAlgorithm.rsa_oaep_256, b64decode(encoded_key.encode("ascii"))
     )
 
     return unwrapped_aes_key.key
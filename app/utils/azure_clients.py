@@ -0,0 +1,108 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# azure_clients.py
+# -------------------------------------------------------------------------------
+"""The azure SDK clients shared by the whole worker"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import logging
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Type, TypeVar
+
+from app.utils.dependency_telemetry import record_azure_response
+from app.utils.memory import track_structure
+
+if TYPE_CHECKING:
+    import aiohttp
+    from azure.core.pipeline.transport import AioHttpTransport
+
+# Azure Resource Manager, the key vault and the storage account are the only hosts, so a few connections
+# kept alive per host serve all the calls of the worker
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 32
+KEEPALIVE_TIMEOUT = 60.0
+DNS_CACHE_TTL = 300
+
+ClientType = TypeVar("ClientType")
+
+
+class AzureClients:
+    """
+    Create one client of every type per subscription or vault on first use and keep it until shutdown. All the
+    clients send their requests through one aiohttp session, so they share its pool of warm connections.
+    """
+
+    def __init__(self):
+        self.clients: Dict[Tuple[type, str], Any] = {}
+        self.session: Optional["aiohttp.ClientSession"] = None
+
+    def transport(self) -> "AioHttpTransport":
+        """
+        A transport on the shared session, closing it leaves the session open
+
+        :return: the transport to give to a client
+        :rtype: AioHttpTransport
+        """
+        import aiohttp
+        from azure.core.pipeline.transport import AioHttpTransport
+
+        if self.session is None or self.session.closed:
+            # The same settings as the session the SDK creates for every client
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=CONNECTION_LIMIT,
+                    limit_per_host=CONNECTION_LIMIT_PER_HOST,
+                    keepalive_timeout=KEEPALIVE_TIMEOUT,
+                    ttl_dns_cache=DNS_CACHE_TTL,
+                ),
+                trust_env=True,
+                cookie_jar=aiohttp.DummyCookieJar(),
+                auto_decompress=False,
+            )
+        return AioHttpTransport(session=self.session, session_owner=False)
+
+    def get(self, client_class: Type[ClientType], scope: str, **kwargs: Any) -> ClientType:
+        """
+        The client of the scope, created with the arguments the first time
+
+        :param client_class: class of the azure client
+        :type client_class: Type[ClientType]
+        :param scope: the subscription or the vault url of the client
+        :type scope: str
+        :return: the shared client
+        :rtype: ClientType
+        """
+        key = (client_class, scope)
+        client = self.clients.get(key)
+        if client is None:
+            # The calls are retried by app.utils.resilience, which also breaks the circuit of a failing service
+            client = client_class(  # type: ignore
+                transport=self.transport(), retry_total=0, raw_response_hook=record_azure_response, **kwargs
+            )
+            self.clients[key] = client
+        return client
+
+    async def close(self):
+        clients, self.clients = self.clients, {}
+        for (client_class, scope), client in clients.items():
+            try:
+                await client.close()
+            except Exception as exception:
+                logging.warning(f"Failed to close the {client_class.__name__} of {scope}: {exception}")
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+azure_clients = AzureClients()
+track_structure("azure_clients", lambda: azure_clients.clients)
+
+
+async def close_azure_clients():
+    await azure_clients.close()
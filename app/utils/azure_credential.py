@@ -0,0 +1,174 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# azure_credential.py
+# -------------------------------------------------------------------------------
+"""The azure credential shared by all the clients of the worker"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+from app.utils.memory import track_structure
+from app.utils.metrics import AZURE_TOKEN_FETCHES
+from app.utils.secrets import get_secret
+
+if TYPE_CHECKING:
+    from azure.core.credentials import AccessToken
+    from azure.identity.aio import ClientSecretCredential
+
+# Fetched at startup, before the first request needs them
+MANAGEMENT_SCOPE = "https://management.azure.com/.default"
+KEY_VAULT_SCOPE = "https://vault.azure.net/.default"
+STARTUP_SCOPES = [MANAGEMENT_SCOPE, KEY_VAULT_SCOPE]
+
+# A token is refreshed in the background once it expires in less than the margin, a request fetches it
+# itself only if the background refresh didn't succeed before the token was about to expire
+REFRESH_MARGIN = 300.0
+REFRESH_INTERVAL = 30.0
+EXPIRY_SAFETY_MARGIN = 30.0
+
+TokenKey = Tuple[Optional[str], Tuple[str, ...]]
+
+
+class SharedCredential:
+    """
+    An async token credential that keeps one token per scope for the whole worker and refreshes it before it
+    expires, so that the requests don't wait for Azure Active Directory. Concurrent requests of a missing token
+    share one fetch.
+    """
+
+    def __init__(self, credential: "ClientSecretCredential", tenant_id: Optional[str] = None):
+        self.credential = credential
+        self.tenant_id = tenant_id
+        self.tokens: Dict[TokenKey, "AccessToken"] = {}
+        self.fetch_locks: Dict[TokenKey, asyncio.Lock] = {}
+        self.refresher: Optional[asyncio.Task] = None
+
+    async def get_token(
+        self, *scopes: str, claims: Optional[str] = None, tenant_id: Optional[str] = None, **kwargs: Any
+    ) -> "AccessToken":
+        """
+        Get a token of the scopes, from the cache unless it is about to expire
+
+        :param scopes: the scopes of the token
+        :type scopes: str
+        :param claims: additional claims asked by a challenge of the service, the token isn't cached then
+        :type claims: Optional[str]
+        :param tenant_id: the tenant of the token, the tenant of the credential by default
+        :type tenant_id: Optional[str]
+        :return: the token
+        :rtype: AccessToken
+        """
+        if claims:
+            AZURE_TOKEN_FETCHES.labels("request").inc()
+            return await self.credential.get_token(*scopes, claims=claims, tenant_id=tenant_id, **kwargs)
+
+        key = self._key(tenant_id, scopes)
+        token = self.tokens.get(key)
+        if token is not None and token.expires_on - time.time() > EXPIRY_SAFETY_MARGIN:
+            return token
+        return await self._fetch(key, "request")
+
+    def _key(self, tenant_id: Optional[str], scopes: Tuple[str, ...]) -> TokenKey:
+        # The key vault clients ask for the tenant of their challenge, which is the tenant of the credential,
+        # so they share the tokens fetched at startup
+        if tenant_id == self.tenant_id:
+            tenant_id = None
+        return (tenant_id, tuple(sorted(scopes)))
+
+    async def _fetch(self, key: TokenKey, path: str) -> "AccessToken":
+        key = self._key(*key)
+        lock = self.fetch_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Fetched by another caller while this one waited
+            token = self.tokens.get(key)
+            if token is not None and token.expires_on - time.time() > REFRESH_MARGIN:
+                return token
+
+            tenant_id, scopes = key
+            token = await self.credential.get_token(*scopes, tenant_id=tenant_id)
+            self.tokens[key] = token
+            AZURE_TOKEN_FETCHES.labels(path).inc()
+            return token
+
+    def start(self):
+        """
+        Fetch the tokens of the startup scopes and refresh all the tokens in the background
+        """
+        self.refresher = asyncio.create_task(self._refresh(), name="azure-token-refresh")
+
+    async def _refresh(self):
+        for scope in STARTUP_SCOPES:
+            self.tokens.pop((None, (scope,)), None)
+            try:
+                await self._fetch((None, (scope,)), "background")
+            except Exception as exception:
+                logging.warning(f"Failed to fetch the azure token of {scope}: {exception}")
+
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            for key, token in list(self.tokens.items()):
+                if token.expires_on - time.time() > REFRESH_MARGIN:
+                    continue
+                try:
+                    await self._fetch(key, "background")
+                except Exception as exception:
+                    # Tried again at the next interval, the token is still valid meanwhile
+                    logging.warning(f"Failed to refresh the azure token of {key[1]}: {exception}")
+
+    async def close(self):
+        if self.refresher is not None:
+            self.refresher.cancel()
+            await asyncio.gather(self.refresher, return_exceptions=True)
+            self.refresher = None
+        await self.credential.close()
+
+
+_shared_credential: Optional[SharedCredential] = None
+track_structure("azure_tokens", lambda: _shared_credential.tokens if _shared_credential else {})
+
+
+def get_credential() -> SharedCredential:
+    """
+    The credential of the service principal of the application, created on first use
+
+    :return: the shared credential
+    :rtype: SharedCredential
+    """
+    from azure.identity.aio import ClientSecretCredential
+
+    global _shared_credential
+    if _shared_credential is None:
+        tenant_id = get_secret("azure_tenant_id")
+        _shared_credential = SharedCredential(
+            ClientSecretCredential(
+                client_id=get_secret("azure_client_id"),
+                client_secret=get_secret("azure_client_secret"),
+                tenant_id=tenant_id,
+            ),
+            tenant_id=tenant_id,
+        )
+    return _shared_credential
+
+
+def start_azure_credential():
+    """
+    Create the credential and fetch its tokens in the background, called once the event loop is running
+    """
+    get_credential().start()
+
+
+async def close_azure_credential():
+    global _shared_credential
+    if _shared_credential is not None:
+        await _shared_credential.close()
+        _shared_credential = None
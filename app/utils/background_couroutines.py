@@ -12,18 +12,71 @@
 #     prior written permission of Secure Ai Labs, Inc.
 # -------------------------------------------------------------------------------
 import asyncio
+import logging
+import time
 from typing import Any, Coroutine
 
+from app.utils.memory import track_structure
+from app.utils.metrics import BACKGROUND_TASKS
+from app.utils.tracing import current_span, start_span
+
+# Time the tasks have to finish on shutdown before they are interrupted
+DEFAULT_DRAIN_TIMEOUT = 20.0
+CANCEL_TIMEOUT = 5.0
+
 coroutines = set()
+track_structure("background_tasks", lambda: coroutines)
 
 
-def add_async_task(task_function: Coroutine[Any, Any, None]):
+def add_async_task(task_function: Coroutine[Any, Any, None]) -> asyncio.Task:
     """
-    Add a task to the set of coroutines to be run
+    Add a task to the set of coroutines to be run, it is lost if the server stops before it is done.
+    The work that must survive a restart is run as a job.
 
     :param task_function: the function to be run
     :type task_function: Coroutine[Any, Any, None]
+    :return: the running task
+    :rtype: asyncio.Task
     """
-    task = asyncio.create_task(task_function)
+    task = asyncio.create_task(_run_traced(task_function), name=task_function.__qualname__)
     coroutines.add(task)
-    task.add_done_callback(coroutines.discard)
+    BACKGROUND_TASKS.inc()
+    task.add_done_callback(_task_done)
+    return task
+
+
+async def _run_traced(task_function: Coroutine[Any, Any, None]):
+    # The task outlives the request that started it, it is traced as a child of the span that started
+    # it and linked to it so that the whole flow can be found from the request
+    parent = current_span()
+    links = [(parent.trace_id, parent.span_id)] if parent else None
+    with start_span(f"background {task_function.__qualname__}", links=links):
+        await task_function
+
+
+def _task_done(task: asyncio.Task):
+    coroutines.discard(task)
+    BACKGROUND_TASKS.dec()
+
+
+async def drain_background_tasks(timeout: float = DEFAULT_DRAIN_TIMEOUT):
+    """
+    Wait for the background tasks to finish, then cancel the ones that are still running
+
+    :param timeout: time in seconds the tasks have to finish
+    :type timeout: float
+    """
+    deadline = time.monotonic() + timeout
+    # Tasks started by the last requests are waited for as well
+    while coroutines and time.monotonic() < deadline:
+        await asyncio.wait(set(coroutines), timeout=deadline - time.monotonic())
+
+    interrupted_tasks = list(coroutines)
+    if not interrupted_tasks:
+        return
+
+    for task in interrupted_tasks:
+        logging.warning(f"Interrupted background task {task.get_name()} is lost")
+        task.cancel()
+
+    await asyncio.wait(interrupted_tasks, timeout=CANCEL_TIMEOUT)
@@ -12,12 +12,65 @@
 #     prior written permission of Secure Ai Labs, Inc.
 # -------------------------------------------------------------------------------
 
-from typing import Dict
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterator, Optional, Tuple
 
 from app.data import operations as data_service
 from app.models.common import BasicObjectInfo, PyObjectId
+from app.utils.memory import track_structure
+from app.utils.timing import STAGE_CACHE, timed
 
-GLOBAL_CACHE: Dict[PyObjectId, BasicObjectInfo] = {}
+BASIC_OBJECT_CACHE_SIZE = 10000
+BASIC_OBJECT_CACHE_TTL = 300.0
+
+
+class TTLCache:
+    """
+    Least recently used cache whose entries expire after a time to live
+
+    Every worker process has its own copy of the cache, the time to live bounds how long a worker can
+    return a value that was changed through another worker.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return default
+        self.entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        entry = self.entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self.entries.clear()
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        return ((key, value) for key, (_, value) in self.entries.items())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+GLOBAL_CACHE = TTLCache(maxsize=BASIC_OBJECT_CACHE_SIZE, ttl=BASIC_OBJECT_CACHE_TTL)
+track_structure("global_cache", lambda: GLOBAL_CACHE)
 
 DB_COLLECTION_ORGANIZATIONS = "organizations"
 DB_COLLECTION_USERS = "users"
@@ -31,9 +84,11 @@ DB_COLLECTION_DATASETS = "datasets"
 DB_COLLECTION_SECURE_COMPUTATION_NODE = "secure-computation-node"
 
 
+@timed(STAGE_CACHE)
 async def get_basic_object(id: PyObjectId, collection_name: str) -> BasicObjectInfo:
-    if id in GLOBAL_CACHE:
-        return GLOBAL_CACHE[id]
+    cached_object = GLOBAL_CACHE.get(id)
+    if cached_object is not None:
+        return cached_object
     else:
         # Get the user from the database
         object = await data_service.find_one(collection_name, {"_id": str(id)})
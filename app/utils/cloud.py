@@ -0,0 +1,276 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# cloud.py
+# -------------------------------------------------------------------------------
+"""The cloud provider used by the API, azure or an in-process fake of it"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Optional
+
+import app.utils.azure as azure
+from app.models.common import KeyVaultObject
+from app.utils.azure import AzureCredentials, DeleteResponse, DeploymentResponse
+from app.utils.secrets import get_optional_secret
+
+CLOUD_PROVIDER_AZURE = "azure"
+CLOUD_PROVIDER_FAKE = "fake"
+
+
+class CloudProvider(ABC):
+    """
+    The cloud operations of the API. Every implementation reports the failures the same way as the azure
+    functions: the operations that return a DeploymentResponse or a DeleteResponse set its status, the others
+    raise.
+    """
+
+    async def start(self):
+        """
+        Open the shared clients, once the event loop is running
+        """
+
+    async def close(self):
+        """
+        Close the shared clients on shutdown
+        """
+
+    @abstractmethod
+    async def authenticate(self) -> AzureCredentials:
+        ...
+
+    @abstractmethod
+    async def create_resource_group(self, account_credentials: AzureCredentials, resource_group_name: str) -> str:
+        ...
+
+    @abstractmethod
+    async def deploy_template(
+        self, account_credentials: AzureCredentials, resource_group_name: str, template: str, parameters: dict
+    ):
+        ...
+
+    @abstractmethod
+    async def delete_resouce_group(
+        self, account_credentials: AzureCredentials, resource_group_name: str
+    ) -> DeleteResponse:
+        ...
+
+    @abstractmethod
+    async def get_ip(
+        self, account_credentials: AzureCredentials, resource_group_name: str, ip_resource_name: str
+    ) -> str:
+        ...
+
+    @abstractmethod
+    async def get_private_ip(
+        self, account_credentials: AzureCredentials, resource_group_name: str, network_interface_name: str
+    ) -> str:
+        ...
+
+    @abstractmethod
+    async def deploy_module(
+        self,
+        account_credentials: AzureCredentials,
+        resource_group_name: str,
+        virtual_machine_name: str,
+        vm_size: str,
+        custom_data: str,
+    ) -> DeploymentResponse:
+        ...
+
+    @abstractmethod
+    async def create_file_share(
+        self, account_credentials: AzureCredentials, resource_group_name: str, account_name: str, file_share_name: str
+    ) -> DeploymentResponse:
+        ...
+
+    @abstractmethod
+    async def file_share_create_directory(
+        self, connection_string: str, file_share_name: str, directory_name: str
+    ) -> DeploymentResponse:
+        ...
+
+    @abstractmethod
+    async def get_storage_account_connection_string(
+        self,
+        account_credentials: AzureCredentials,
+        resource_group_name: str,
+        account_name: str,
+        refresh_key: bool = False,
+    ) -> DeploymentResponse:
+        ...
+
+    @abstractmethod
+    async def authentication_shared_access_signature(
+        self,
+        account_credentials: AzureCredentials,
+        account_name: str,
+        resource_group_name: str,
+        file_path: str,
+        share_name: str,
+        permission: str,
+        expiry: datetime,
+    ) -> DeploymentResponse:
+        ...
+
+    @abstractmethod
+    async def create_rsa_key(
+        self, account_credentials: AzureCredentials, key_name: str, key_size: int
+    ) -> Optional[KeyVaultObject]:
+        ...
+
+    @abstractmethod
+    async def tag_rsa_key(self, account_credentials: AzureCredentials, rsa_key: KeyVaultObject, tags: Dict[str, str]):
+        ...
+
+    @abstractmethod
+    async def wrap_aes_key(self, aes_key: bytes, wrapping_key: KeyVaultObject) -> Optional[KeyVaultObject]:
+        ...
+
+    @abstractmethod
+    async def unwrap_aes_with_rsa_key(self, wrapped_aes_key: KeyVaultObject, wrapping_key: KeyVaultObject) -> bytes:
+        ...
+
+
+class AzureProvider(CloudProvider):
+    """
+    The functions of app.utils.azure
+    """
+
+    async def start(self):
+        from app.utils.azure_credential import start_azure_credential
+
+        start_azure_credential()
+
+    async def close(self):
+        from app.utils.azure_clients import close_azure_clients
+        from app.utils.azure_credential import close_azure_credential
+
+        await close_azure_clients()
+        await close_azure_credential()
+
+    async def authenticate(self) -> AzureCredentials:
+        return await azure.authenticate()
+
+    async def create_resource_group(self, account_credentials: AzureCredentials, resource_group_name: str) -> str:
+        return await azure.create_resource_group(account_credentials, resource_group_name)
+
+    async def deploy_template(
+        self, account_credentials: AzureCredentials, resource_group_name: str, template: str, parameters: dict
+    ):
+        return await azure.deploy_template(account_credentials, resource_group_name, template, parameters)
+
+    async def delete_resouce_group(
+        self, account_credentials: AzureCredentials, resource_group_name: str
+    ) -> DeleteResponse:
+        return await azure.delete_resouce_group(account_credentials, resource_group_name)
+
+    async def get_ip(
+        self, account_credentials: AzureCredentials, resource_group_name: str, ip_resource_name: str
+    ) -> str:
+        return await azure.get_ip(account_credentials, resource_group_name, ip_resource_name)
+
+    async def get_private_ip(
+        self, account_credentials: AzureCredentials, resource_group_name: str, network_interface_name: str
+    ) -> str:
+        return await azure.get_private_ip(account_credentials, resource_group_name, network_interface_name)
+
+    async def deploy_module(
+        self,
+        account_credentials: AzureCredentials,
+        resource_group_name: str,
+        virtual_machine_name: str,
+        vm_size: str,
+        custom_data: str,
+    ) -> DeploymentResponse:
+        return await azure.deploy_module(
+            account_credentials, resource_group_name, virtual_machine_name, vm_size, custom_data
+        )
+
+    async def create_file_share(
+        self, account_credentials: AzureCredentials, resource_group_name: str, account_name: str, file_share_name: str
+    ) -> DeploymentResponse:
+        return await azure.create_file_share(account_credentials, resource_group_name, account_name, file_share_name)
+
+    async def file_share_create_directory(
+        self, connection_string: str, file_share_name: str, directory_name: str
+    ) -> DeploymentResponse:
+        return await azure.file_share_create_directory(connection_string, file_share_name, directory_name)
+
+    async def get_storage_account_connection_string(
+        self,
+        account_credentials: AzureCredentials,
+        resource_group_name: str,
+        account_name: str,
+        refresh_key: bool = False,
+    ) -> DeploymentResponse:
+        return await azure.get_storage_account_connection_string(
+            account_credentials, resource_group_name, account_name, refresh_key=refresh_key
+        )
+
+    async def authentication_shared_access_signature(
+        self,
+        account_credentials: AzureCredentials,
+        account_name: str,
+        resource_group_name: str,
+        file_path: str,
+        share_name: str,
+        permission: str,
+        expiry: datetime,
+    ) -> DeploymentResponse:
+        return await azure.authentication_shared_access_signature(
+            account_credentials, account_name, resource_group_name, file_path, share_name, permission, expiry
+        )
+
+    async def create_rsa_key(
+        self, account_credentials: AzureCredentials, key_name: str, key_size: int
+    ) -> Optional[KeyVaultObject]:
+        return await azure.create_rsa_key(account_credentials, key_name, key_size)
+
+    async def tag_rsa_key(self, account_credentials: AzureCredentials, rsa_key: KeyVaultObject, tags: Dict[str, str]):
+        await azure.tag_rsa_key(account_credentials, rsa_key, tags)
+
+    async def wrap_aes_key(self, aes_key: bytes, wrapping_key: KeyVaultObject) -> Optional[KeyVaultObject]:
+        return await azure.wrap_aes_key(aes_key, wrapping_key)
+
+    async def unwrap_aes_with_rsa_key(self, wrapped_aes_key: KeyVaultObject, wrapping_key: KeyVaultObject) -> bytes:
+        return await azure.unwrap_aes_with_rsa_key(wrapped_aes_key, wrapping_key)
+
+
+_cloud_provider: Optional[CloudProvider] = None
+
+
+def cloud_provider() -> CloudProvider:
+    """
+    The provider selected by `cloud_provider` of the InitializationVector.json file, azure by default
+
+    :return: the provider
+    :rtype: CloudProvider
+    """
+    global _cloud_provider
+    if _cloud_provider is None:
+        name = get_optional_secret("cloud_provider", CLOUD_PROVIDER_AZURE)
+        if name == CLOUD_PROVIDER_AZURE:
+            _cloud_provider = AzureProvider()
+        elif name == CLOUD_PROVIDER_FAKE:
+            from app.utils.fake_azure import FakeAzureProvider
+
+            _cloud_provider = FakeAzureProvider(get_optional_secret("fake_azure", {}))  # type: ignore
+        else:
+            raise Exception(f"Unknown cloud provider {name}")
+    return _cloud_provider
+
+
+async def start_cloud_provider():
+    await cloud_provider().start()
+
+
+async def close_cloud_provider():
+    await cloud_provider().close()
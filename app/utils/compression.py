@@ -0,0 +1,210 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# compression.py
+# -------------------------------------------------------------------------------
+"""Compression of http responses"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import gzip
+from typing import Dict, Iterable, Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstd is optional, gzip is always available
+    zstandard = None
+
+# Preferred order of the encodings when the client accepts them equally
+ENCODING_PREFERENCE = ["zstd", "br", "gzip", "identity"]
+
+# Responses smaller than this are not worth the cpu time to compress
+DEFAULT_MINIMUM_SIZE = 1024
+
+# Compression level per encoding and content type. Content types which are not listed are
+# either already compressed (images, archives) or binary and are sent as they are.
+DEFAULT_COMPRESSION_LEVELS: Dict[str, Dict[str, int]] = {
+    "zstd": {
+        "application/json": 3,
+        "text/html": 3,
+        "text/plain": 3,
+        "text/css": 3,
+        "application/javascript": 3,
+    },
+    "gzip": {
+        "application/json": 6,
+        "text/html": 6,
+        "text/plain": 6,
+        "text/css": 6,
+        "application/javascript": 6,
+    },
+}
+
+
+def negotiate_encoding(
+    accept_encoding: Optional[str], available: Iterable[str], preference: Sequence[str] = ENCODING_PREFERENCE
+) -> str:
+    """
+    Pick the best encoding out of the available ones for the Accept-Encoding header
+
+    :param accept_encoding: value of the Accept-Encoding request header
+    :type accept_encoding: Optional[str]
+    :param available: encodings that the response can be sent with
+    :type available: Iterable[str]
+    :param preference: order in which encodings with the same quality are picked
+    :type preference: Sequence[str]
+    :return: the selected encoding, "identity" if nothing else is acceptable
+    :rtype: str
+    """
+    if not accept_encoding:
+        return "identity"
+
+    quality: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for parameter in parts[1:]:
+            name, _, value = parameter.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        quality[coding] = weight
+
+    available = set(available)
+    best_encoding = "identity"
+    best_quality = 0.0
+    for encoding in preference:
+        if encoding not in available or encoding == "identity":
+            continue
+        encoding_quality = quality.get(encoding, quality.get("*", 0.0))
+        if encoding_quality > best_quality:
+            best_encoding = encoding
+            best_quality = encoding_quality
+
+    return best_encoding
+
+
+def compress(body: bytes, encoding: str, level: int) -> bytes:
+    """
+    Compress the body with the given encoding
+
+    :param body: the uncompressed body
+    :type body: bytes
+    :param encoding: "gzip" or "zstd"
+    :type encoding: str
+    :param level: the compression level for the encoding
+    :type level: int
+    :return: the compressed body
+    :rtype: bytes
+    """
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    elif encoding == "gzip":
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    else:
+        raise ValueError(f"Unsupported encoding {encoding}")
+
+
+class CompressionMiddleware:
+    """
+    Compress complete responses with zstd or gzip depending on what the client accepts
+
+    Streaming responses, responses that already have a Content-Encoding, responses smaller than
+    the minimum size and content types without a configured level are sent unmodified. Routes
+    can opt out completely by adding their path prefix to excluded_paths.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = DEFAULT_MINIMUM_SIZE,
+        compression_levels: Dict[str, Dict[str, int]] = DEFAULT_COMPRESSION_LEVELS,
+        excluded_paths: Sequence[str] = (),
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compression_levels = {
+            encoding: levels
+            for encoding, levels in compression_levels.items()
+            if encoding == "gzip" or (encoding == "zstd" and zstandard is not None)
+        }
+        self.excluded_paths = list(excluded_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or any(scope["path"].startswith(path) for path in self.excluded_paths):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"), self.compression_levels.keys())
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(send, encoding, self.compression_levels[encoding], self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    """
+    Holds back the start of the response until the body is known to be complete
+    """
+
+    def __init__(self, send: Send, encoding: str, levels: Dict[str, int], minimum_size: int):
+        self.downstream_send = send
+        self.encoding = encoding
+        self.levels = levels
+        self.minimum_size = minimum_size
+        self.start_message: Optional[Message] = None
+        self.passthrough = False
+
+    def compression_level(self, headers: MutableHeaders) -> Optional[int]:
+        if "content-encoding" in headers:
+            return None
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        return self.levels.get(content_type)
+
+    async def send(self, message: Message):
+        if self.passthrough:
+            await self.downstream_send(message)
+            return
+
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self.start_message is None:
+            await self.downstream_send(message)
+            return
+
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        body: bytes = message.get("body", b"")
+        level = self.compression_level(headers)
+
+        # Streaming responses are sent as they come, only complete bodies are compressed
+        if message.get("more_body", False) or level is None or len(body) < self.minimum_size:
+            self.passthrough = True
+            await self.downstream_send(self.start_message)
+            await self.downstream_send(message)
+            return
+
+        compressed_body = compress(body, self.encoding, level)
+        headers["Content-Encoding"] = self.encoding
+        headers["Content-Length"] = str(len(compressed_body))
+        headers.add_vary_header("Accept-Encoding")
+
+        self.passthrough = True
+        await self.downstream_send(self.start_message)
+        await self.downstream_send({"type": "http.response.body", "body": compressed_body, "more_body": False})
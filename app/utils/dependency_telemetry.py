@@ -0,0 +1,201 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# dependency_telemetry.py
+# -------------------------------------------------------------------------------
+"""Latency, status and throttling of the calls to azure and the dns server"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+from collections import Counter, deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Mapping, Optional, Tuple
+
+from app.utils.memory import track_structure
+from app.utils.metrics import DEPENDENCY_CALL_DURATION, DEPENDENCY_CALLS, DEPENDENCY_RATE_LIMIT_REMAINING
+
+if TYPE_CHECKING:
+    from azure.core.pipeline import PipelineResponse
+
+# Azure resource manager reports the requests left in the current window of the subscription and of the
+# resource provider with these headers
+RATE_LIMIT_HEADER_PREFIX = "x-ms-ratelimit-remaining-"
+
+# The percentiles are computed over the latest calls of every operation
+LATENCY_SAMPLES = 512
+
+
+@dataclass
+class CallAttempt:
+    """
+    One attempt of a call, the http responses received while it runs are reported to it
+    """
+
+    dependency: str
+    operation: str
+    status_code: Optional[int] = None
+
+
+@dataclass
+class OperationTelemetry:
+    dependency: str
+    operation: str
+    calls: int = 0
+    failures: int = 0
+    retries: int = 0
+    throttled: int = 0
+    total_duration: float = 0.0
+    max_duration: float = 0.0
+    statuses: Counter = field(default_factory=Counter)
+    durations: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_SAMPLES))
+
+    def percentile(self, fraction: float) -> float:
+        if not self.durations:
+            return 0.0
+        durations = sorted(self.durations)
+        return durations[min(int(fraction * len(durations)), len(durations) - 1)]
+
+
+@dataclass
+class RateLimit:
+    dependency: str
+    name: str
+    remaining: int
+    updated: datetime
+
+
+_current_attempt: ContextVar[Optional[CallAttempt]] = ContextVar("dependency_call_attempt", default=None)
+
+
+class DependencyTelemetry:
+    """
+    Aggregate the calls of this worker by dependency and operation. Every attempt is counted by status, every
+    call with its latency including the retries, and the rate limit headers keep the latest value per dependency.
+    """
+
+    def __init__(self):
+        self.since = datetime.utcnow()
+        self.operations: Dict[Tuple[str, str], OperationTelemetry] = {}
+        self.rate_limits: Dict[Tuple[str, str], RateLimit] = {}
+
+    def _operation(self, dependency: str, operation: str) -> OperationTelemetry:
+        key = (dependency, operation)
+        telemetry = self.operations.get(key)
+        if telemetry is None:
+            telemetry = OperationTelemetry(dependency=dependency, operation=operation)
+            self.operations[key] = telemetry
+        return telemetry
+
+    def start_attempt(self, dependency: str, operation: str) -> CallAttempt:
+        """
+        Report the http responses of the running task to the attempt until it ends
+
+        :return: the attempt, to give to end_attempt
+        :rtype: CallAttempt
+        """
+        attempt = CallAttempt(dependency=dependency, operation=operation)
+        _current_attempt.set(attempt)
+        return attempt
+
+    def end_attempt(self, attempt: CallAttempt, status: str):
+        """
+        Count the attempt by its http status, or the error raised before a response was received
+
+        :param attempt: the attempt
+        :type attempt: CallAttempt
+        :param status: the outcome when no http response was reported
+        :type status: str
+        """
+        _current_attempt.set(None)
+        if attempt.status_code is not None:
+            status = str(attempt.status_code)
+        telemetry = self._operation(attempt.dependency, attempt.operation)
+        telemetry.statuses[status] += 1
+        if status == "429":
+            telemetry.throttled += 1
+        DEPENDENCY_CALLS.labels(attempt.dependency, attempt.operation, status).inc()
+
+    def record_call(self, dependency: str, operation: str, duration: float, attempts: int, failed: bool):
+        """
+        Add a call and its retries to its operation
+
+        :param duration: time in seconds from the first attempt to the result, with the backoff
+        :type duration: float
+        :param attempts: number of attempts made
+        :type attempts: int
+        :param failed: the call raised
+        :type failed: bool
+        """
+        telemetry = self._operation(dependency, operation)
+        telemetry.calls += 1
+        telemetry.failures += 1 if failed else 0
+        telemetry.retries += max(attempts - 1, 0)
+        telemetry.total_duration += duration
+        telemetry.max_duration = max(telemetry.max_duration, duration)
+        telemetry.durations.append(duration)
+        DEPENDENCY_CALL_DURATION.labels(dependency, operation).observe(duration)
+
+    def record_response(self, status_code: int, headers: Mapping[str, Any]):
+        """
+        Report an http response to the attempt of the running task
+
+        :param status_code: status of the response
+        :type status_code: int
+        :param headers: headers of the response
+        :type headers: Mapping[str, Any]
+        """
+        attempt = _current_attempt.get()
+        if attempt is None:
+            return
+        attempt.status_code = status_code
+
+        for name, value in headers.items():
+            name = name.lower()
+            if not name.startswith(RATE_LIMIT_HEADER_PREFIX):
+                continue
+            try:
+                remaining = int(value)
+            except ValueError:
+                continue
+            limit = name.replace(RATE_LIMIT_HEADER_PREFIX, "", 1)
+            self.rate_limits[(attempt.dependency, limit)] = RateLimit(
+                dependency=attempt.dependency, name=limit, remaining=remaining, updated=datetime.utcnow()
+            )
+            DEPENDENCY_RATE_LIMIT_REMAINING.labels(attempt.dependency, limit).set(remaining)
+
+    def report(self) -> List[OperationTelemetry]:
+        """
+        The operations, the one that took the most time in total first
+
+        :return: the telemetry of every operation
+        :rtype: List[OperationTelemetry]
+        """
+        return sorted(self.operations.values(), key=lambda telemetry: telemetry.total_duration, reverse=True)
+
+    def reset(self):
+        self.since = datetime.utcnow()
+        self.operations.clear()
+        self.rate_limits.clear()
+
+
+dependency_telemetry = DependencyTelemetry()
+track_structure("dependency_telemetry", lambda: dependency_telemetry.operations)
+
+
+def record_azure_response(pipeline_response: "PipelineResponse"):
+    """
+    Response hook of the azure clients, called for every http response including the polling of the long
+    running operations
+
+    :param pipeline_response: the response
+    :type pipeline_response: PipelineResponse
+    """
+    http_response = pipeline_response.http_response
+    dependency_telemetry.record_response(http_response.status_code, http_response.headers)
@@ -0,0 +1,159 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# dns_registration.py
+# -------------------------------------------------------------------------------
+"""Register the domains of the secure computation nodes in the dns server"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from app.utils.dependency_telemetry import dependency_telemetry
+from app.utils.memory import track_structure
+from app.utils.resilience import DNS
+from app.utils.secrets import get_secret
+
+if TYPE_CHECKING:
+    import httpx
+
+DNS_PORT = 8000
+DNS_TIMEOUT = 30.0
+DNS_MAX_CONNECTIONS = 4
+DNS_KEEPALIVE_EXPIRY = 60.0
+
+# The records asked while a batch is collected are sent together, so the nodes provisioned at the same time
+# share the warm connections and a domain asked twice is registered once with its latest address
+DNS_BATCH_WINDOW = 0.2
+
+
+@dataclass
+class _PendingRecord:
+    ip: str
+    waiters: List[asyncio.Future] = field(default_factory=list)
+
+
+async def _record_response(response: "httpx.Response"):
+    dependency_telemetry.record_response(response.status_code, response.headers)
+
+
+class DnsRegistrar:
+    """
+    Send the dns records through one async http client kept by the worker, in batches
+    """
+
+    def __init__(self):
+        self.client: Optional["httpx.AsyncClient"] = None
+        self.pending: Dict[str, _PendingRecord] = {}
+        self.flusher: Optional[asyncio.Task] = None
+
+    def _client(self) -> "httpx.AsyncClient":
+        import httpx
+
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                base_url=f"https://{get_secret('dns_ip')}:{DNS_PORT}",
+                # The dns server has a self signed certificate
+                verify=False,
+                timeout=DNS_TIMEOUT,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=DNS_MAX_CONNECTIONS,
+                    max_keepalive_connections=DNS_MAX_CONNECTIONS,
+                    keepalive_expiry=DNS_KEEPALIVE_EXPIRY,
+                ),
+                event_hooks={"response": [_record_response]},
+            )
+        return self.client
+
+    async def add_domain(self, domain: str, ip: str):
+        """
+        Point the domain to the address, once the batch it joined was sent
+
+        :param domain: the fully qualified domain, with its trailing dot
+        :type domain: str
+        :param ip: the address of the domain
+        :type ip: str
+        :raises Exception: if the dns server refused the record or stayed unavailable
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        record = self.pending.setdefault(domain, _PendingRecord(ip=ip))
+        record.ip = ip
+        record.waiters.append(waiter)
+
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self._flush(), name="dns-registration")
+        await waiter
+
+    async def _flush(self):
+        batch: Dict[str, _PendingRecord] = {}
+        try:
+            while self.pending:
+                await asyncio.sleep(DNS_BATCH_WINDOW)
+                batch, self.pending = self.pending, {}
+                results = await asyncio.gather(
+                    *[DNS.call("add_domain", self._post, domain, record.ip) for domain, record in batch.items()],
+                    return_exceptions=True,
+                )
+                for record, result in zip(batch.values(), results):
+                    for waiter in record.waiters:
+                        if waiter.done():
+                            continue
+                        if isinstance(result, BaseException):
+                            waiter.set_exception(result)
+                        else:
+                            waiter.set_result(None)
+                batch = {}
+        finally:
+            # The batch in flight when the flusher is cancelled is no longer pending, its callers are released here
+            for record in batch.values():
+                for waiter in record.waiters:
+                    waiter.cancel()
+            self.flusher = None
+
+    async def _post(self, domain: str, ip: str):
+        from sail_dns_management_client.errors import UnexpectedStatus
+        from sail_dns_management_client.models import DomainData
+
+        response = await self._client().post("/dns", json=DomainData(ip=ip, domain=domain).to_dict())
+        if response.status_code != 200:
+            raise UnexpectedStatus(response.status_code, response.content)
+
+    async def close(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            await asyncio.gather(self.flusher, return_exceptions=True)
+        for record in self.pending.values():
+            for waiter in record.waiters:
+                waiter.cancel()
+        self.pending = {}
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+dns_registrar = DnsRegistrar()
+track_structure("dns_pending_records", lambda: dns_registrar.pending)
+
+
+async def register_domain(domain: str, ip: str):
+    """
+    Point the domain to the address in the dns server
+
+    :param domain: the fully qualified domain, with its trailing dot
+    :type domain: str
+    :param ip: the address of the domain
+    :type ip: str
+    """
+    await dns_registrar.add_domain(domain, ip)
+
+
+async def close_dns_registrar():
+    await dns_registrar.close()
@@ -0,0 +1,174 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# etag.py
+# -------------------------------------------------------------------------------
+"""Conditional GET requests with ETag and If-None-Match"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Depends, HTTPException, Response, status
+from fastapi.requests import Request
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.api.authentication import get_current_user
+from app.data import operations as data_service
+from app.models.authentication import TokenData
+
+# Bump this whenever the json representation of the entities changes, so that clients
+# holding an old representation of an unchanged document get the new one.
+ETAG_VERSION = 1
+
+# Api responses are user specific, they must not be stored by shared caches and must
+# be revalidated by the client before every use
+CACHE_CONTROL_PRIVATE_REVALIDATE = "private, no-cache"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison of an ETag with the If-None-Match request header
+
+    :param if_none_match: value of the If-None-Match request header
+    :type if_none_match: Optional[str]
+    :param etag: the current ETag of the resource
+    :type etag: str
+    :return: True if the client already has the current representation
+    :rtype: bool
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    def opaque_tag(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    current = opaque_tag(etag)
+    return any(opaque_tag(candidate) == current for candidate in if_none_match.split(","))
+
+
+def weak_etag(*parts: Any) -> str:
+    """
+    Weak ETag from the parts that identify a representation
+
+    :param parts: values that change whenever the representation changes
+    :type parts: Any
+    :return: the quoted weak ETag value
+    :rtype: str
+    """
+    digest = hashlib.sha256("/".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+class DocumentETag:
+    """
+    Route dependency answering conditional GET requests from the revision of a document
+
+    Only the revision of the document is read from the database, so when the client already has
+    the current representation the route is never called and the enrichment and serialization of
+    the response are skipped. Otherwise the ETag is added to the response of the route.
+    The token of the caller is checked first, so that anonymous clients can't find out from a 304 which
+    documents exist or what their revision is.
+    """
+
+    def __init__(self, collection: str, path_parameter: str):
+        self.collection = collection
+        self.path_parameter = path_parameter
+
+    async def __call__(self, request: Request, response: Response, current_user: TokenData = Depends(get_current_user)):
+        document_id = request.path_params.get(self.path_parameter)
+        if request.method != "GET" or document_id is None:
+            return
+
+        document = await data_service.find_one(
+            self.collection, {"_id": str(document_id)}, projection={data_service.REVISION_FIELD: 1}
+        )
+        # Let the route respond to documents that don't exist
+        if not document:
+            return
+
+        etag = weak_etag(ETAG_VERSION, self.collection, document_id, document.get(data_service.REVISION_FIELD, 0))
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL_PRIVATE_REVALIDATE}
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        response.headers.update(headers)
+
+
+class ConditionalGetMiddleware:
+    """
+    Add an ETag hashed from the body to the GET responses that don't have one and answer 304 when it matches
+
+    This saves the transfer of unchanged list responses, the routes which can tell their revision
+    cheaply use DocumentETag to also skip building the response.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        responder = _ConditionalGetResponder(send, Headers(scope=scope).get("if-none-match"))
+        await self.app(scope, receive, responder.send)
+
+
+class _ConditionalGetResponder:
+    """
+    Holds back the start of the response until the complete body can be hashed
+    """
+
+    def __init__(self, send: Send, if_none_match: Optional[str]):
+        self.downstream_send = send
+        self.if_none_match = if_none_match
+        self.start_message: Optional[Message] = None
+        self.passthrough = False
+
+    async def send(self, message: Message):
+        if self.passthrough:
+            await self.downstream_send(message)
+            return
+
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self.start_message is None:
+            await self.downstream_send(message)
+            return
+
+        self.passthrough = True
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        if self.start_message["status"] != status.HTTP_200_OK or message.get("more_body", False) or "etag" in headers:
+            await self.downstream_send(self.start_message)
+            await self.downstream_send(message)
+            return
+
+        body: bytes = message.get("body", b"")
+        headers["ETag"] = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+        if "cache-control" not in headers:
+            headers["Cache-Control"] = CACHE_CONTROL_PRIVATE_REVALIDATE
+
+        if etag_matches(self.if_none_match, headers["ETag"]):
+            del headers["Content-Length"]
+            del headers["Content-Type"]
+            self.start_message["status"] = status.HTTP_304_NOT_MODIFIED
+            await self.downstream_send(self.start_message)
+            await self.downstream_send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        await self.downstream_send(self.start_message)
+        await self.downstream_send(message)
@@ -0,0 +1,391 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# fake_azure.py
+# -------------------------------------------------------------------------------
+"""An in-process fake of azure to run and benchmark the cloud flows without an azure subscription"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import hashlib
+import hmac
+import math
+import os
+import random
+import uuid
+from base64 import b64decode, b64encode
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, Optional, Set, Tuple
+
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+
+from app.models.common import KeyVaultObject
+from app.utils.azure import STORAGE_ACCOUNT_KEY_TTL, AzureCredentials, DeleteResponse, DeploymentResponse
+from app.utils.cache import TTLCache
+from app.utils.cloud import CloudProvider
+from app.utils.dependency_telemetry import dependency_telemetry
+from app.utils.resilience import AZURE_DEPLOYMENTS, AZURE_KEY_VAULT, AZURE_RESOURCE_MANAGER, AZURE_STORAGE, Dependency
+
+if TYPE_CHECKING:
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+
+# Latency and faults of every operation unless the `fake_azure` setting overrides them, close to what azure
+# resource manager and the key vault answer in
+DEFAULT_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {
+        "latency": {"distribution": "lognormal", "median_ms": 60, "sigma": 0.4},
+        "failure_rate": 0.0,
+        "throttle_rate": 0.0,
+        "retry_after_seconds": 1,
+    },
+    "deploy_template": {"latency": {"distribution": "uniform", "low_ms": 2000, "high_ms": 4000}},
+    "create_resource_group": {"latency": {"distribution": "lognormal", "median_ms": 400, "sigma": 0.3}},
+    "create_rsa_key": {"latency": {"distribution": "lognormal", "median_ms": 800, "sigma": 0.5}},
+    "key_vault": {"latency": {"distribution": "lognormal", "median_ms": 25, "sigma": 0.3}},
+}
+
+# The calls to the fake go through the retries, circuit breakers and bulkheads of the services they stand for
+OPERATION_DEPENDENCIES: Dict[str, Dependency] = {
+    "create_resource_group": AZURE_RESOURCE_MANAGER,
+    "deploy_template": AZURE_DEPLOYMENTS,
+    "delete_resouce_group": AZURE_RESOURCE_MANAGER,
+    "get_ip": AZURE_RESOURCE_MANAGER,
+    "get_private_ip": AZURE_RESOURCE_MANAGER,
+    "create_file_share": AZURE_RESOURCE_MANAGER,
+    "list_keys": AZURE_RESOURCE_MANAGER,
+    "file_share_create_directory": AZURE_STORAGE,
+    "create_rsa_key": AZURE_KEY_VAULT,
+    "key_vault": AZURE_KEY_VAULT,
+}
+
+# The fake keys are smaller than the real ones, only their latency matters
+FAKE_RSA_KEY_SIZE = 2048
+
+
+@dataclass
+class OperationProfile:
+    latency: Dict[str, Any]
+    failure_rate: float
+    throttle_rate: float
+    retry_after_seconds: float
+
+    def sample_latency(self) -> float:
+        """
+        Draw the latency of one call from the distribution, in seconds
+        """
+        distribution = self.latency.get("distribution", "constant")
+        if distribution == "constant":
+            latency_ms = self.latency.get("value_ms", 0)
+        elif distribution == "uniform":
+            latency_ms = random.uniform(self.latency["low_ms"], self.latency["high_ms"])
+        elif distribution == "lognormal":
+            latency_ms = random.lognormvariate(math.log(self.latency["median_ms"]), self.latency.get("sigma", 0.5))
+        else:
+            raise ValueError(f"Unknown latency distribution {distribution}")
+        return latency_ms / 1000
+
+
+class _FakeResponse:
+    """
+    The parts of an http response read by HttpResponseError
+    """
+
+    def __init__(self, status_code: int, reason: str, headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers or {}
+
+    def text(self, encoding: Optional[str] = None) -> str:
+        return ""
+
+
+@dataclass
+class _ResourceGroup:
+    location: str
+    tags: Dict[str, str]
+    private_ips: Dict[str, str] = field(default_factory=dict)
+
+
+class FakeAzureProvider(CloudProvider):
+    """
+    Keep the resources in memory and answer after a latency drawn from the profile of the operation, failing
+    a fraction of the calls with a server error or a 429 with a Retry-After header
+
+    The profiles are set by the `fake_azure` setting, by operation name with `default` for all of them, for example
+    {"default": {"throttle_rate": 0.05}, "deploy_template": {"latency": {"distribution": "constant", "value_ms": 500}}}.
+    The key vault operations share the `key_vault` profile.
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.settings = settings or {}
+        self.calls: Counter = Counter()
+        self.faults: Counter = Counter()
+        self.resource_groups: Dict[str, _ResourceGroup] = {}
+        self.file_shares: Set[Tuple[str, str]] = set()
+        self.directories: Set[Tuple[str, str, str]] = set()
+        self.account_keys: Dict[str, str] = {}
+        # The keys listed by the provider, cached like the real provider does so ARM is only called on a miss
+        self.listed_account_keys = TTLCache(maxsize=16, ttl=STORAGE_ACCOUNT_KEY_TTL)
+        self.rsa_keys: Dict[Tuple[str, str], "RSAPrivateKey"] = {}
+        self.rsa_key_tags: Dict[Tuple[str, str], Dict[str, str]] = {}
+        self.secrets: Dict[Tuple[str, str], str] = {}
+
+    def profile(self, operation: str) -> OperationProfile:
+        """
+        The profile of an operation, its own settings over the defaults
+
+        :param operation: name of the operation
+        :type operation: str
+        :return: the profile
+        :rtype: OperationProfile
+        """
+        merged: Dict[str, Any] = {}
+        for settings in [DEFAULT_PROFILES, self.settings]:
+            merged.update(settings.get("default", {}))
+        for settings in [DEFAULT_PROFILES, self.settings]:
+            merged.update(settings.get(operation, {}))
+        return OperationProfile(
+            latency=merged["latency"],
+            failure_rate=merged["failure_rate"],
+            throttle_rate=merged["throttle_rate"],
+            retry_after_seconds=merged["retry_after_seconds"],
+        )
+
+    async def _call(self, operation: str):
+        await OPERATION_DEPENDENCIES[operation].call(operation, self._respond, operation)
+
+    async def _respond(self, operation: str):
+        profile = self.profile(operation)
+        self.calls[operation] += 1
+        await asyncio.sleep(profile.sample_latency())
+
+        roll = random.random()
+        if roll < profile.throttle_rate:
+            self.faults[(operation, 429)] += 1
+            raise HttpResponseError(
+                message="Too many requests",
+                response=_FakeResponse(429, "Too Many Requests", {"Retry-After": str(profile.retry_after_seconds)}),
+            )
+        if roll < profile.throttle_rate + profile.failure_rate:
+            self.faults[(operation, 500)] += 1
+            raise HttpResponseError(
+                message="Internal server error", response=_FakeResponse(500, "Internal Server Error")
+            )
+        dependency_telemetry.record_response(200, {})
+
+    def _account_key(self, account_name: str) -> str:
+        return self.account_keys.setdefault(account_name, b64encode(os.urandom(64)).decode("ascii"))
+
+    async def _listed_account_key(self, account_name: str, refresh: bool = False) -> str:
+        if refresh:
+            self.listed_account_keys.pop(account_name)
+        account_key = self.listed_account_keys.get(account_name)
+        if account_key is None:
+            await self._call("list_keys")
+            account_key = self._account_key(account_name)
+            self.listed_account_keys[account_name] = account_key
+        return account_key
+
+    async def authenticate(self) -> AzureCredentials:
+        return AzureCredentials(credentials=None, subscription_id="fake-subscription", location="westus")  # type: ignore
+
+    async def create_resource_group(self, account_credentials: AzureCredentials, resource_group_name: str) -> str:
+        await self._call("create_resource_group")
+        self.resource_groups.setdefault(
+            resource_group_name,
+            _ResourceGroup(location=account_credentials.location, tags={"module": resource_group_name.split("-")[-1]}),
+        )
+        return "Succeeded"
+
+    async def deploy_template(
+        self, account_credentials: AzureCredentials, resource_group_name: str, template: str, parameters: dict
+    ):
+        await self._call("deploy_template")
+        resource_group = self.resource_groups.get(resource_group_name)
+        if resource_group is None:
+            raise ResourceNotFoundError(f"Resource group {resource_group_name} not found")
+        if "vmName" in parameters:
+            index = len(resource_group.private_ips) + 4
+            resource_group.private_ips[parameters["vmName"] + "-nic"] = f"10.0.{index // 250}.{index % 250}"
+
+    async def delete_resouce_group(
+        self, account_credentials: AzureCredentials, resource_group_name: str
+    ) -> DeleteResponse:
+        try:
+            await self._call("delete_resouce_group")
+            if self.resource_groups.pop(resource_group_name, None) is None:
+                return DeleteResponse(status="Success", note="Resource group not found")
+            return DeleteResponse(status="Success", note="")
+        except Exception as exception:
+            return DeleteResponse(status="Fail", note=str(exception))
+
+    async def get_ip(
+        self, account_credentials: AzureCredentials, resource_group_name: str, ip_resource_name: str
+    ) -> str:
+        await self._call("get_ip")
+        if resource_group_name not in self.resource_groups:
+            raise Exception("Unable to get IP address")
+        return f"20.0.{random.randint(0, 255)}.{random.randint(1, 254)}"
+
+    async def get_private_ip(
+        self, account_credentials: AzureCredentials, resource_group_name: str, network_interface_name: str
+    ) -> str:
+        await self._call("get_private_ip")
+        resource_group = self.resource_groups.get(resource_group_name)
+        if resource_group is None or network_interface_name not in resource_group.private_ips:
+            raise Exception("Unable to get IP address")
+        return resource_group.private_ips[network_interface_name]
+
+    async def deploy_module(
+        self,
+        account_credentials: AzureCredentials,
+        resource_group_name: str,
+        virtual_machine_name: str,
+        vm_size: str,
+        custom_data: str,
+    ) -> DeploymentResponse:
+        try:
+            await self.create_resource_group(account_credentials, resource_group_name)
+            await self.deploy_template(
+                account_credentials, resource_group_name, "", {"vmName": virtual_machine_name, "vmSize": vm_size}
+            )
+            private_ip = await self.get_private_ip(
+                account_credentials, resource_group_name, virtual_machine_name + "-nic"
+            )
+            return DeploymentResponse(status="Success", ip_address=private_ip, note="Deployment Successful")
+        except Exception as exception:
+            return DeploymentResponse(status="Fail", ip_address="", note=str(exception))
+
+    async def create_file_share(
+        self, account_credentials: AzureCredentials, resource_group_name: str, account_name: str, file_share_name: str
+    ) -> DeploymentResponse:
+        try:
+            await self._call("create_file_share")
+            if (account_name, file_share_name) in self.file_shares:
+                return DeploymentResponse(status="Success", note="File share already exists")
+            self.file_shares.add((account_name, file_share_name))
+            return DeploymentResponse(status="Success", note="Deployment Successful")
+        except Exception as exception:
+            return DeploymentResponse(status="Fail", note=str(exception))
+
+    async def file_share_create_directory(
+        self, connection_string: str, file_share_name: str, directory_name: str
+    ) -> DeploymentResponse:
+        settings = dict(part.split("=", 1) for part in connection_string.split(";") if "=" in part)
+        account_name = settings.get("AccountName", "")
+        try:
+            await self._call("file_share_create_directory")
+            if settings.get("AccountKey") != self._account_key(account_name):
+                return DeploymentResponse(status="AuthenticationFailed", note="The account key is not valid")
+            if (account_name, file_share_name) not in self.file_shares:
+                raise ResourceNotFoundError(f"The file share {file_share_name} doesn't exist")
+            if (account_name, file_share_name, directory_name) in self.directories:
+                raise ResourceExistsError(f"The directory {directory_name} already exists")
+            self.directories.add((account_name, file_share_name, directory_name))
+            return DeploymentResponse(status="Success", note="Deployment Successful")
+        except ResourceExistsError:
+            return DeploymentResponse(status="Success", note="Directory already exists")
+        except Exception as exception:
+            return DeploymentResponse(status="Fail", note=str(exception))
+
+    async def get_storage_account_connection_string(
+        self,
+        account_credentials: AzureCredentials,
+        resource_group_name: str,
+        account_name: str,
+        refresh_key: bool = False,
+    ) -> DeploymentResponse:
+        try:
+            account_key = await self._listed_account_key(account_name, refresh=refresh_key)
+            conn_string = f"DefaultEndpointsProtocol=https;EndpointSuffix=core.windows.net;AccountName={account_name};AccountKey={account_key}"
+            return DeploymentResponse(status="Success", response=conn_string, note="Deployment Successful")
+        except Exception as exception:
+            return DeploymentResponse(status="Fail", note=str(exception))
+
+    async def authentication_shared_access_signature(
+        self,
+        account_credentials: AzureCredentials,
+        account_name: str,
+        resource_group_name: str,
+        file_path: str,
+        share_name: str,
+        permission: str,
+        expiry: datetime,
+    ) -> DeploymentResponse:
+        try:
+            account_key = await self._listed_account_key(account_name)
+            expiry_text = expiry.strftime("%Y-%m-%dT%H:%M:%SZ")
+            signature = hmac.new(
+                b64decode(account_key),
+                f"{permission}\n{expiry_text}\n/file/{account_name}/{share_name}/{file_path}".encode(),
+                hashlib.sha256,
+            ).hexdigest()
+            sas_token = f"se={expiry_text}&sp={permission}&sv=2021-06-08&sr=f&sig={signature}"
+            return DeploymentResponse(status="Success", response=sas_token, note="Deployment Successful")
+        except Exception as exception:
+            return DeploymentResponse(status="Fail", note=str(exception))
+
+    async def create_rsa_key(
+        self, account_credentials: AzureCredentials, key_name: str, key_size: int
+    ) -> Optional[KeyVaultObject]:
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        if key_size < 3072:
+            raise ValueError("Key size must be at least 3072 bits.")
+
+        await self._call("create_rsa_key")
+        private_key = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: rsa.generate_private_key(public_exponent=65537, key_size=FAKE_RSA_KEY_SIZE)
+        )
+        key = KeyVaultObject(name=key_name, version=uuid.uuid4().hex)
+        self.rsa_keys[(key.name, key.version)] = private_key
+        return key
+
+    async def tag_rsa_key(self, account_credentials: AzureCredentials, rsa_key: KeyVaultObject, tags: Dict[str, str]):
+        await self._call("key_vault")
+        if (rsa_key.name, rsa_key.version) not in self.rsa_keys:
+            raise ResourceNotFoundError(f"Key {rsa_key.name} not found")
+        self.rsa_key_tags[(rsa_key.name, rsa_key.version)] = tags
+
+    async def wrap_aes_key(self, aes_key: bytes, wrapping_key: KeyVaultObject) -> Optional[KeyVaultObject]:
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        private_key = self.rsa_keys.get((wrapping_key.name, wrapping_key.version))
+        if private_key is None:
+            raise ResourceNotFoundError(f"Key {wrapping_key.name} not found")
+        wrapped_aes_key = private_key.public_key().encrypt(
+            aes_key, padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+        )
+
+        # Only the secret is stored remotely, the key is wrapped locally like the azure provider does
+        await self._call("key_vault")
+        secret = KeyVaultObject(name=wrapping_key.name, version=uuid.uuid4().hex)
+        self.secrets[(secret.name, secret.version)] = b64encode(wrapped_aes_key).decode("ascii")
+        return secret
+
+    async def unwrap_aes_with_rsa_key(self, wrapped_aes_key: KeyVaultObject, wrapping_key: KeyVaultObject) -> bytes:
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        await self._call("key_vault")
+        encoded_key = self.secrets.get((wrapped_aes_key.name, wrapped_aes_key.version))
+        if encoded_key is None:
+            raise ResourceNotFoundError(f"Secret {wrapped_aes_key.name} not found")
+
+        await self._call("key_vault")
+        private_key = self.rsa_keys.get((wrapping_key.name, wrapping_key.version))
+        if private_key is None:
+            raise ResourceNotFoundError(f"Key {wrapping_key.name} not found")
+        return private_key.decrypt(
+            b64decode(encoded_key),
+            padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None),
+        )
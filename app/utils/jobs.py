@@ -0,0 +1,478 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# jobs.py
+# -------------------------------------------------------------------------------
+"""Durable background jobs queued in the database"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Coroutine, Dict, List, Optional, get_type_hints
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+from pymongo.errors import DuplicateKeyError
+
+from app.data import operations as data_service
+from app.models.common import PyObjectId
+from app.models.jobs import Job_Db, JobState
+from app.utils.locks import Lease, singleton_loop
+from app.utils.memory import track_structure
+from app.utils.metrics import JOBS_FINISHED, JOBS_RUNNING
+from app.utils.tracing import current_span, start_span
+
+DB_COLLECTION_JOBS = "jobs"
+
+DEFAULT_CONCURRENCY = 2
+DEFAULT_MAX_ATTEMPTS = 5
+
+# A running job is taken over by another worker once its lease expired without a heartbeat
+LEASE_DURATION = 60.0
+HEARTBEAT_INTERVAL = LEASE_DURATION / 3
+POLL_INTERVAL = 2.0
+
+RETRY_BASE_DELAY = 10.0
+RETRY_MAX_DELAY = 600.0
+
+CANCEL_TIMEOUT = 5.0
+MAX_ERROR_LENGTH = 2000
+
+FINISHED_JOB_RETENTION = timedelta(days=14)
+PURGE_INTERVAL = 3600.0
+
+JobFunction = Callable[..., Coroutine[Any, Any, None]]
+
+
+@dataclass
+class JobHandler:
+    name: str
+    function: JobFunction
+    concurrency: int
+    max_attempts: int
+    on_failure: Optional[Callable[..., Coroutine[Any, Any, None]]]
+
+
+_handlers: Dict[str, JobHandler] = {}
+
+
+def _handler_name(function: JobFunction) -> str:
+    return f"{function.__module__}.{function.__qualname__}"
+
+
+def _active_key(name: str, idempotency_key: Optional[str]) -> Optional[str]:
+    return f"{name}:{idempotency_key}" if idempotency_key else None
+
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+
+def job_handler(
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    on_failure: Optional[Callable[..., Coroutine[Any, Any, None]]] = None,
+) -> Callable[[JobFunction], JobFunction]:
+    """
+    Decorator of the functions run as jobs. A job is run again from the start when it failed or when its worker
+    stopped, so the function must be idempotent, and its arguments are stored so they must be ids and not
+    sensitive data.
+
+    :param concurrency: number of jobs of this type run at once by every worker
+    :type concurrency: int
+    :param max_attempts: number of times the job is tried before it is failed
+    :type max_attempts: int
+    :param on_failure: called with the exception and the arguments of the job after its last attempt failed
+    :type on_failure: Optional[Callable[..., Coroutine[Any, Any, None]]]
+    """
+
+    def register(function: JobFunction) -> JobFunction:
+        name = _handler_name(function)
+        _handlers[name] = JobHandler(
+            name=name, function=function, concurrency=concurrency, max_attempts=max_attempts, on_failure=on_failure
+        )
+        return function
+
+    return register
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Exponential backoff with jitter before the next attempt of a job
+
+    :param attempts: number of attempts already made
+    :type attempts: int
+    :return: the delay in seconds
+    :rtype: float
+    """
+    delay = min(RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0), RETRY_MAX_DELAY)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _parse_arguments(function: JobFunction, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    type_hints = get_type_hints(function)
+    return {
+        name: parse_obj_as(type_hints[name], value) if name in type_hints else value
+        for name, value in arguments.items()
+    }
+
+
+async def enqueue_job(
+    function: JobFunction,
+    arguments: Dict[str, Any],
+    idempotency_key: Optional[str] = None,
+    user_id: Optional[PyObjectId] = None,
+) -> PyObjectId:
+    """
+    Add a job to the queue, it is run by the first worker with a free slot for its type
+
+    :param function: a function decorated with job_handler
+    :type function: JobFunction
+    :param arguments: arguments of the function, they must be ids and not sensitive data
+    :type arguments: Dict[str, Any]
+    :param idempotency_key: while a job with the same type and key is queued or running, its id is returned instead
+    :type idempotency_key: Optional[str]
+    :param user_id: the user who started the job
+    :type user_id: Optional[PyObjectId]
+    :raises ValueError: if the function is not a job handler
+    :return: id of the job
+    :rtype: PyObjectId
+    """
+    name = _handler_name(function)
+    handler = _handlers.get(name)
+    if handler is None:
+        raise ValueError(f"{name} is not a job handler")
+
+    # The job is traced as a link of the request that added it
+    span = current_span()
+    job_db = Job_Db(
+        type=name,
+        arguments=jsonable_encoder(arguments),
+        state=JobState.QUEUED,
+        max_attempts=handler.max_attempts,
+        user_id=user_id,
+        idempotency_key=idempotency_key,
+        active_key=_active_key(name, idempotency_key),
+        trace_id=span.trace_id if span else None,
+        parent_span_id=span.span_id if span else None,
+    )
+
+    while True:
+        try:
+            await data_service.insert_one(DB_COLLECTION_JOBS, jsonable_encoder(job_db))
+            break
+        except DuplicateKeyError:
+            existing_job = await data_service.find_one(DB_COLLECTION_JOBS, {"active_key": job_db.active_key})
+            # Unless the existing job finished in between
+            if existing_job:
+                return PyObjectId(existing_job["_id"])
+
+    job_worker.wake()
+    return job_db.id
+
+
+class JobWorker:
+    """
+    Claim the queued jobs of every type with a free slot and run them
+
+    A job is claimed atomically with a lease that its heartbeat extends while it runs. The lease token fences
+    the updates of the job, so a worker that lost the lease of a job can't overwrite the result of the worker
+    that took it over.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.running: Dict[asyncio.Task, Job_Db] = {}
+        self.running_by_type: Dict[str, int] = {}
+        self.wake_event: Optional[asyncio.Event] = None
+        self.poller: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """
+        Start claiming jobs on the running event loop
+        """
+        try:
+            await self._create_indexes()
+        except Exception as exception:
+            logging.error(f"Failed to create the indexes of the jobs: {exception}")
+
+        self.wake_event = asyncio.Event()
+        self.poller = asyncio.create_task(self._poll(), name="job-worker")
+
+    def wake(self):
+        if self.wake_event is not None:
+            self.wake_event.set()
+
+    async def _create_indexes(self):
+        await data_service.create_index(DB_COLLECTION_JOBS, [("state", 1), ("type", 1), ("run_after", 1)])
+        await data_service.create_index(
+            DB_COLLECTION_JOBS,
+            [("active_key", 1)],
+            unique=True,
+            partialFilterExpression={"active_key": {"$type": "string"}},
+        )
+
+    async def _poll(self):
+        while True:
+            self.wake_event.clear()  # type: ignore
+            try:
+                while await self._claim_next():
+                    pass
+            except Exception as exception:
+                logging.error(f"Failed to claim a job: {exception}")
+
+            try:
+                await asyncio.wait_for(self.wake_event.wait(), timeout=POLL_INTERVAL)  # type: ignore
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim_next(self) -> bool:
+        job_types = [
+            name for name, handler in _handlers.items() if self.running_by_type.get(name, 0) < handler.concurrency
+        ]
+        if not job_types:
+            return False
+
+        now = _now()
+        job = await data_service.find_one_and_update(
+            DB_COLLECTION_JOBS,
+            {
+                "type": {"$in": job_types},
+                "$or": [
+                    {"state": JobState.QUEUED.value, "run_after": {"$lte": now.isoformat()}},
+                    {"state": JobState.RUNNING.value, "lease_expiry_time": {"$lt": now.isoformat()}},
+                ],
+            },
+            {
+                "$set": {
+                    "state": JobState.RUNNING.value,
+                    "lease_owner": f"{self.worker_id}-{uuid.uuid4().hex[:8]}",
+                    "lease_expiry_time": (now + timedelta(seconds=LEASE_DURATION)).isoformat(),
+                    "heartbeat_time": now.isoformat(),
+                    "updated_time": now.isoformat(),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_after", 1)],
+        )
+        if job is None:
+            return False
+
+        job_db = Job_Db(**job)
+        handler = _handlers[job_db.type]
+        task = asyncio.create_task(self._run(handler, job_db), name=f"job {handler.name}")
+        self.running[task] = job_db
+        self.running_by_type[handler.name] = self.running_by_type.get(handler.name, 0) + 1
+        JOBS_RUNNING.labels(handler.name).inc()
+        task.add_done_callback(self._job_done)
+        return True
+
+    def _job_done(self, task: asyncio.Task):
+        job_db = self.running.pop(task)
+        self.running_by_type[job_db.type] -= 1
+        JOBS_RUNNING.labels(job_db.type).dec()
+        self.wake()
+
+    async def _run(self, handler: JobHandler, job_db: Job_Db):
+        heartbeat = asyncio.create_task(self._heartbeat(job_db, asyncio.current_task()))  # type: ignore
+        links = [(job_db.trace_id, job_db.parent_span_id)] if job_db.trace_id and job_db.parent_span_id else None
+        try:
+            with start_span(
+                f"job {handler.function.__qualname__}",
+                attributes={"job.id": str(job_db.id), "job.attempt": job_db.attempts},
+                links=links,
+            ):
+                # The last attempt was claimed again after its worker stopped without releasing it
+                if job_db.attempts > job_db.max_attempts:
+                    raise Exception("The job was interrupted on its last attempt")
+                await handler.function(**_parse_arguments(handler.function, job_db.arguments))
+        except Exception as exception:
+            await self._failed(handler, job_db, exception)
+        else:
+            if await self._update(job_db, {"state": JobState.SUCCEEDED.value, "active_key": None}):
+                JOBS_FINISHED.labels(handler.name, "succeeded").inc()
+        finally:
+            heartbeat.cancel()
+
+    async def _failed(self, handler: JobHandler, job_db: Job_Db, exception: Exception):
+        error = f"{type(exception).__name__}: {exception}"[:MAX_ERROR_LENGTH]
+        if job_db.attempts < job_db.max_attempts:
+            delay = retry_delay(job_db.attempts)
+            logging.warning(
+                f"Job {job_db.id} {handler.name} failed, attempt {job_db.attempts} in {delay:.0f}s: {error}"
+            )
+            run_after = _now() + timedelta(seconds=delay)
+            fields = {"state": JobState.QUEUED.value, "run_after": run_after.isoformat(), "last_error": error}
+            if await self._update(job_db, fields):
+                JOBS_FINISHED.labels(handler.name, "retried").inc()
+            return
+
+        logging.error(f"Job {job_db.id} {handler.name} failed after {job_db.attempts} attempts: {error}")
+        # The failure is handled before the job is marked failed, it is handled again if the worker stops in between
+        if handler.on_failure is not None:
+            try:
+                await handler.on_failure(exception, **_parse_arguments(handler.function, job_db.arguments))
+            except Exception as failure_exception:
+                logging.error(f"Failed to handle the failure of job {job_db.id}: {failure_exception}")
+        if await self._update(job_db, {"state": JobState.FAILED.value, "last_error": error, "active_key": None}):
+            JOBS_FINISHED.labels(handler.name, "failed").inc()
+
+    async def _update(
+        self, job_db: Job_Db, fields: Dict[str, Any], increments: Optional[Dict[str, int]] = None
+    ) -> bool:
+        # Release the lease of the job with its new state, unless another worker took the job over
+        data: Dict[str, Any] = {
+            "$set": {**fields, "lease_owner": None, "lease_expiry_time": None, "updated_time": _now().isoformat()}
+        }
+        if increments:
+            data["$inc"] = increments
+        update_response = await data_service.update_one(
+            DB_COLLECTION_JOBS, {"_id": str(job_db.id), "lease_owner": job_db.lease_owner}, data
+        )
+        if update_response.matched_count != 1:
+            logging.warning(f"Job {job_db.id} was taken over by another worker, its result is dropped")
+            return False
+        return True
+
+    async def _heartbeat(self, job_db: Job_Db, job_task: asyncio.Task):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = _now()
+            try:
+                update_response = await data_service.update_one(
+                    DB_COLLECTION_JOBS,
+                    {"_id": str(job_db.id), "lease_owner": job_db.lease_owner},
+                    {
+                        "$set": {
+                            "lease_expiry_time": (now + timedelta(seconds=LEASE_DURATION)).isoformat(),
+                            "heartbeat_time": now.isoformat(),
+                        }
+                    },
+                )
+            except Exception as exception:
+                # The lease is extended by the next heartbeat if the database is back before it expires
+                logging.warning(f"Failed to extend the lease of job {job_db.id}: {exception}")
+                continue
+
+            if update_response.matched_count != 1:
+                logging.error(f"Job {job_db.id} lost its lease and is cancelled")
+                job_task.cancel()
+                return
+
+    async def stop(self, timeout: float):
+        """
+        Stop claiming jobs and wait for the running ones, then put those still running back in the queue
+        without counting their attempt and cancel them
+
+        :param timeout: time in seconds the running jobs have to finish
+        :type timeout: float
+        """
+        if self.poller is not None:
+            self.poller.cancel()
+            await asyncio.gather(self.poller, return_exceptions=True)
+            self.poller = None
+
+        if self.running:
+            await asyncio.wait(list(self.running), timeout=timeout)
+
+        interrupted_jobs = list(self.running.items())
+        for task, job_db in interrupted_jobs:
+            try:
+                fields = {"state": JobState.QUEUED.value, "run_after": _now().isoformat()}
+                if await self._update(job_db, fields, increments={"attempts": -1}):
+                    JOBS_FINISHED.labels(job_db.type, "released").inc()
+                    logging.warning(f"Job {job_db.id} {job_db.type} was interrupted and is queued again")
+            except Exception as exception:
+                logging.error(f"Failed to release job {job_db.id}, it runs again once its lease expired: {exception}")
+            task.cancel()
+
+        if interrupted_jobs:
+            await asyncio.wait([task for task, _ in interrupted_jobs], timeout=CANCEL_TIMEOUT)
+
+
+job_worker = JobWorker()
+track_structure("running_jobs", lambda: job_worker.running)
+
+
+async def get_job(job_id: PyObjectId) -> Optional[Job_Db]:
+    job = await data_service.find_one(DB_COLLECTION_JOBS, {"_id": str(job_id)})
+    return Job_Db(**job) if job else None
+
+
+async def find_jobs(state: Optional[JobState] = None, job_type: Optional[str] = None) -> List[Job_Db]:
+    query: Dict[str, Any] = {}
+    if state:
+        query["state"] = state.value
+    if job_type:
+        query["type"] = job_type
+    return [Job_Db(**job) for job in await data_service.find_by_query(DB_COLLECTION_JOBS, query)]
+
+
+async def retry_job(job_id: PyObjectId) -> bool:
+    """
+    Queue a failed job again with all its attempts
+
+    :param job_id: id of the job
+    :type job_id: PyObjectId
+    :return: False if the job doesn't exist, isn't failed or another job with its idempotency key is active
+    :rtype: bool
+    """
+    job_db = await get_job(job_id)
+    if job_db is None or job_db.state != JobState.FAILED:
+        return False
+
+    now = _now().isoformat()
+    try:
+        update_response = await data_service.update_one(
+            DB_COLLECTION_JOBS,
+            {"_id": str(job_id), "state": JobState.FAILED.value},
+            {
+                "$set": {
+                    "state": JobState.QUEUED.value,
+                    "attempts": 0,
+                    "run_after": now,
+                    "updated_time": now,
+                    "active_key": _active_key(job_db.type, job_db.idempotency_key),
+                }
+            },
+        )
+    except DuplicateKeyError:
+        return False
+    job_worker.wake()
+    return update_response.matched_count == 1
+
+
+@singleton_loop("purge-finished-jobs")
+async def purge_finished_jobs(lease: Lease):
+    """
+    Delete the jobs that finished before the retention period, every hour in one worker of all the replicas
+
+    :param lease: the leadership of the loop
+    :type lease: Lease
+    """
+    while True:
+        try:
+            delete_response = await data_service.delete_many(
+                DB_COLLECTION_JOBS,
+                {
+                    "state": {"$in": [JobState.SUCCEEDED.value, JobState.FAILED.value]},
+                    "updated_time": {"$lt": (_now() - FINISHED_JOB_RETENTION).isoformat()},
+                },
+            )
+            if delete_response.deleted_count:
+                logging.info(f"Deleted {delete_response.deleted_count} finished jobs")
+        except Exception as exception:
+            logging.error(f"Failed to delete the finished jobs: {exception}")
+        await asyncio.sleep(PURGE_INTERVAL)
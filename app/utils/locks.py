@@ -0,0 +1,346 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# locks.py
+# -------------------------------------------------------------------------------
+"""Distributed locks and leader election shared by all the replicas of the API"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Coroutine, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app.data import operations as data_service
+from app.utils.memory import track_structure
+from app.utils.metrics import LEADERSHIP, LOCK_ACQUISITIONS
+
+DB_COLLECTION_LOCKS = "locks"
+
+DEFAULT_LOCK_TTL = 60.0
+LEADER_TTL = 30.0
+LOCK_RETRY_INTERVAL = 0.5
+CANCEL_TIMEOUT = 5.0
+
+
+class LockNotAcquiredError(Exception):
+    """
+    The lock is held by someone else
+    """
+
+
+@dataclass
+class Lease:
+    """
+    A lock held until its expiry time unless it is renewed. The fencing token is larger for every new holder
+    of the lock, so a resource that keeps the largest token it has seen can reject the writes of a holder whose
+    lease expired while it was paused.
+    """
+
+    name: str
+    owner: str
+    token: int
+    ttl: float
+    # Measured on the clock of this process from before the lease was requested, so it never ends later than
+    # the expiry stored in the database
+    deadline: float
+
+    @property
+    def valid(self) -> bool:
+        return time.monotonic() < self.deadline
+
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+
+def _new_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+async def acquire_lock(name: str, ttl: float = DEFAULT_LOCK_TTL) -> Optional[Lease]:
+    """
+    Take the lock if it is free or its lease expired
+
+    The lock documents are never deleted so that the fencing token of a lock keeps increasing.
+
+    :param name: name of the lock
+    :type name: str
+    :param ttl: time in seconds the lock is held unless it is renewed
+    :type ttl: float
+    :return: the lease, or None if the lock is held by someone else
+    :rtype: Optional[Lease]
+    """
+    owner = _new_owner()
+    started = time.monotonic()
+    now = _now()
+    try:
+        lock = await data_service.find_one_and_update(
+            DB_COLLECTION_LOCKS,
+            {"_id": name, "expiry_time": {"$lt": now.isoformat()}},
+            {
+                "$set": {
+                    "owner": owner,
+                    "acquired_time": now.isoformat(),
+                    "expiry_time": (now + timedelta(seconds=ttl)).isoformat(),
+                },
+                "$inc": {"token": 1},
+            },
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # The lock exists and its lease didn't expire, so the upsert tried to add it again
+        LOCK_ACQUISITIONS.labels(name, "busy").inc()
+        return None
+
+    LOCK_ACQUISITIONS.labels(name, "acquired").inc()
+    return Lease(name=name, owner=owner, token=lock["token"], ttl=ttl, deadline=started + ttl)  # type: ignore
+
+
+async def renew_lock(lease: Lease) -> bool:
+    """
+    Extend the lease of a lock by its time to live
+
+    :param lease: the lease of the lock
+    :type lease: Lease
+    :return: False if the lease expired and the lock was taken by someone else
+    :rtype: bool
+    """
+    started = time.monotonic()
+    now = _now()
+    update_response = await data_service.update_one(
+        DB_COLLECTION_LOCKS,
+        {"_id": lease.name, "owner": lease.owner, "token": lease.token},
+        {"$set": {"expiry_time": (now + timedelta(seconds=lease.ttl)).isoformat()}},
+    )
+    if update_response.matched_count != 1:
+        return False
+    lease.deadline = started + lease.ttl
+    return True
+
+
+async def release_lock(lease: Lease):
+    """
+    Free the lock unless it was already taken by someone else
+
+    :param lease: the lease of the lock
+    :type lease: Lease
+    """
+    lease.deadline = 0
+    await data_service.update_one(
+        DB_COLLECTION_LOCKS,
+        {"_id": lease.name, "owner": lease.owner, "token": lease.token},
+        {"$set": {"expiry_time": _now().isoformat()}},
+    )
+
+
+async def _keep_alive(lease: Lease):
+    while True:
+        await asyncio.sleep(lease.ttl / 3)
+        try:
+            if not await renew_lock(lease):
+                logging.error(f"Lost the lock {lease.name}, token {lease.token}")
+                lease.deadline = 0
+                return
+        except Exception as exception:
+            # The lease is renewed by the next attempt if the database is back before it expires
+            logging.warning(f"Failed to renew the lock {lease.name}: {exception}")
+
+
+@asynccontextmanager
+async def distributed_lock(name: str, ttl: float = DEFAULT_LOCK_TTL, wait: float = 0) -> AsyncIterator[Lease]:
+    """
+    Hold a lock shared by all the replicas while the block runs, the lease is renewed in the background
+
+    The block can't be interrupted safely when the lease is lost, so it should check that the lease is still
+    valid before every step that must not run twice, and pass its fencing token to the writes it makes.
+
+    :param name: name of the lock
+    :type name: str
+    :param ttl: time in seconds the lock is held if this worker stops without releasing it
+    :type ttl: float
+    :param wait: time in seconds to wait for the lock to be free
+    :type wait: float
+    :raises LockNotAcquiredError: if the lock is still held by someone else after the wait
+    :return: the lease of the lock
+    :rtype: AsyncIterator[Lease]
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        lease = await acquire_lock(name, ttl)
+        if lease is not None:
+            break
+        if time.monotonic() >= deadline:
+            raise LockNotAcquiredError(f"The lock {name} is held by someone else")
+        await asyncio.sleep(LOCK_RETRY_INTERVAL)
+
+    keep_alive = asyncio.create_task(_keep_alive(lease), name=f"lock {name}")
+    try:
+        yield lease
+    finally:
+        keep_alive.cancel()
+        try:
+            await release_lock(lease)
+        except Exception as exception:
+            logging.warning(f"Failed to release the lock {name}, it is free once it expired: {exception}")
+
+
+async def update_fenced(collection: str, query: dict, data: Dict[str, Any], lease: Lease) -> bool:
+    """
+    Update a document unless a holder of the lock with a larger fencing token already updated it
+
+    :param collection: collection of the document
+    :type collection: str
+    :param query: query of the document
+    :type query: dict
+    :param data: the update
+    :type data: Dict[str, Any]
+    :param lease: the lease of the lock that guards the document
+    :type lease: Lease
+    :return: False if no document matched or it was updated by a newer holder of the lock
+    :rtype: bool
+    """
+    if not lease.valid:
+        return False
+
+    field = f"fencing_tokens.{lease.name}"
+    fenced_query = {
+        "$and": [query, {"$or": [{field: {"$exists": False}}, {field: {"$lte": lease.token}}]}],
+    }
+    fenced_data = {**data, "$max": {**data.get("$max", {}), field: lease.token}}
+    update_response = await data_service.update_one(collection, fenced_query, fenced_data)
+    return update_response.matched_count == 1
+
+
+LeaderFunction = Callable[[Lease], Coroutine[Any, Any, None]]
+
+
+class LeaderElection:
+    """
+    Run a loop in one worker of all the replicas at a time
+
+    Every worker campaigns for the lock of the election and the one that takes it runs the loop while it renews
+    the lease. The loop is cancelled as soon as the lease can't be renewed before it expires, and another worker
+    takes over once it expired. The loop is started again if it stops.
+    """
+
+    def __init__(self, name: str, function: LeaderFunction, ttl: float = LEADER_TTL):
+        self.name = name
+        self.function = function
+        self.ttl = ttl
+        self.lease: Optional[Lease] = None
+        self.campaign: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.lease is not None and self.lease.valid
+
+    def start(self):
+        """
+        Start campaigning on the running event loop
+        """
+        self.campaign = asyncio.create_task(self._campaign(), name=f"election {self.name}")
+
+    async def _campaign(self):
+        try:
+            while True:
+                try:
+                    if self.lease is None:
+                        self.lease = await acquire_lock(self.name, self.ttl)
+                    elif not await renew_lock(self.lease):
+                        logging.warning(f"Lost the leadership of {self.name}")
+                        self.lease = None
+                except Exception as exception:
+                    logging.warning(f"Failed to campaign for the leadership of {self.name}: {exception}")
+
+                if self.lease is not None and not self.lease.valid:
+                    self.lease = None
+                LEADERSHIP.labels(self.name).set(1 if self.lease is not None else 0)
+
+                if self.lease is not None and self.loop is None:
+                    logging.info(f"Leader of {self.name} with token {self.lease.token}")
+                    self.loop = asyncio.create_task(self._run(self.lease), name=f"leader {self.name}")
+                elif self.lease is None and self.loop is not None:
+                    await self._stop_loop()
+
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            LEADERSHIP.labels(self.name).set(0)
+            await self._stop_loop()
+            if self.lease is not None:
+                try:
+                    await release_lock(self.lease)
+                except Exception as exception:
+                    logging.warning(f"Failed to release the leadership of {self.name}: {exception}")
+                self.lease = None
+
+    async def _run(self, lease: Lease):
+        try:
+            await self.function(lease)
+        except Exception as exception:
+            logging.error(f"The leader loop {self.name} failed: {exception}")
+        finally:
+            # A cancelled loop that outlived the cancel timeout must not clear the loop started after it
+            if self.loop is asyncio.current_task():
+                self.loop = None
+
+    async def _stop_loop(self):
+        loop, self.loop = self.loop, None
+        if loop is not None:
+            loop.cancel()
+            await asyncio.wait([loop], timeout=CANCEL_TIMEOUT)
+
+    async def stop(self):
+        """
+        Stop the loop and give up the leadership, so that another worker takes it without waiting for the expiry
+        """
+        if self.campaign is not None:
+            self.campaign.cancel()
+            await asyncio.gather(self.campaign, return_exceptions=True)
+            self.campaign = None
+
+
+_elections: List[LeaderElection] = []
+track_structure("leader_elections", lambda: _elections)
+
+
+def singleton_loop(name: str, ttl: float = LEADER_TTL) -> Callable[[LeaderFunction], LeaderFunction]:
+    """
+    Decorator of a background loop that must run in only one worker of all the replicas, it is started with
+    start_singleton_loops once the database is connected
+
+    :param name: name of the election
+    :type name: str
+    :param ttl: time in seconds before another worker takes over the loop when its worker stops
+    :type ttl: float
+    """
+
+    def register(function: LeaderFunction) -> LeaderFunction:
+        _elections.append(LeaderElection(name=name, function=function, ttl=ttl))
+        return function
+
+    return register
+
+
+def start_singleton_loops():
+    for election in _elections:
+        election.start()
+
+
+async def stop_singleton_loops():
+    await asyncio.gather(*[election.stop() for election in _elections])
@@ -1,11 +1,34 @@
 import json
 import logging
+import os
 from enum import Enum
 from time import time
 from typing import Dict
 
+
+class AppendFileHandler(logging.Handler):
+    """
+    Append every record to a file with a single write, so that the workers can share the file without
+    interleaving their records
+    """
+
+    def __init__(self, filename: str):
+        super().__init__()
+        self.fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            os.write(self.fd, (self.format(record) + "\n").encode("utf-8"))
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        os.close(self.fd)
+        super().close()
+
+
 logger = logging.getLogger("apiservice")
-handler = logging.FileHandler("audit.log")
+handler = AppendFileHandler("audit.log")
 logger.setLevel(logging.INFO)
 handler.setLevel(logging.INFO)
 logger.addHandler(handler)
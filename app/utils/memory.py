@@ -0,0 +1,277 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# memory.py
+# -------------------------------------------------------------------------------
+"""Memory introspection of the running process"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import itertools
+import resource
+import sys
+import threading
+import tracemalloc
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from types import BuiltinFunctionType, FunctionType, ModuleType
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# Snapshots hold every traced allocation, only a few of them are kept
+MAX_SNAPSHOTS = 10
+MAX_TRACEBACK_FRAMES = 25
+
+# The size of large structures is extrapolated from a sample of their entries
+SIZE_SAMPLE_ENTRIES = 200
+MAX_SIZE_DEPTH = 8
+
+GROUP_BY_LINE = "lineno"
+GROUP_BY_FILE = "filename"
+
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+# Objects that are shared by the whole process and not owned by the structure that refers to them
+_SHARED_TYPES = (type, ModuleType, FunctionType, BuiltinFunctionType)
+
+
+class SnapshotNotFoundError(Exception):
+    pass
+
+
+class TracingNotStartedError(Exception):
+    pass
+
+
+@dataclass
+class NamedSnapshot:
+    name: str
+    taken: datetime
+    snapshot: tracemalloc.Snapshot
+    traced_bytes: int
+
+
+@dataclass
+class StructureSize:
+    name: str
+    entries: int
+    approximate_bytes: int
+
+
+@dataclass
+class AllocationDiff:
+    file: str
+    line: int
+    size_diff: int
+    size: int
+    count_diff: int
+    count: int
+
+
+_structures: Dict[str, Callable[[], Any]] = {}
+_snapshots: "OrderedDict[str, NamedSnapshot]" = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+
+def track_structure(name: str, get_structure: Callable[[], Any]):
+    """
+    Report the size of an in-process structure with the memory of the process
+
+    :param name: name of the structure in the report
+    :type name: str
+    :param get_structure: returns the container, called for every report
+    :type get_structure: Callable[[], Any]
+    """
+    _structures[name] = get_structure
+
+
+def _deep_size(value: Any, seen: Set[int], depth: int = 0) -> int:
+    if id(value) in seen or isinstance(value, _SHARED_TYPES) or depth > MAX_SIZE_DEPTH:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value, 0)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += _deep_size(key, seen, depth + 1) + _deep_size(item, seen, depth + 1)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += _deep_size(item, seen, depth + 1)
+    elif hasattr(value, "__dict__"):
+        size += _deep_size(vars(value), seen, depth + 1)
+    return size
+
+
+def structure_size(name: str, structure: Any) -> StructureSize:
+    """
+    Number of entries and approximate memory of a structure, extrapolated from a sample of its entries
+
+    :param name: name of the structure
+    :type name: str
+    :param structure: the container
+    :type structure: Any
+    :return: the size of the structure
+    :rtype: StructureSize
+    """
+    try:
+        entries = len(structure)
+    except TypeError:
+        return StructureSize(name=name, entries=1, approximate_bytes=_deep_size(structure, set()))
+
+    entries_iterator = structure.items() if hasattr(structure, "items") else structure
+    sample = list(itertools.islice(entries_iterator, SIZE_SAMPLE_ENTRIES))
+
+    seen: Set[int] = set()
+    sampled_bytes = sum(_deep_size(entry, seen) for entry in sample)
+    approximate_bytes = sys.getsizeof(structure, 0)
+    if sample:
+        approximate_bytes += int(sampled_bytes / len(sample) * entries)
+    return StructureSize(name=name, entries=entries, approximate_bytes=approximate_bytes)
+
+
+def structure_sizes() -> List[StructureSize]:
+    """
+    Size of every tracked structure
+
+    :return: the sizes, the largest first
+    :rtype: List[StructureSize]
+    """
+    sizes = [structure_size(name, get_structure()) for name, get_structure in list(_structures.items())]
+    return sorted(sizes, key=lambda size: size.approximate_bytes, reverse=True)
+
+
+def resident_set_size() -> int:
+    """
+    Current resident set size of the process in bytes, the peak one where /proc is not available
+
+    :return: the size in bytes
+    :rtype: int
+    """
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def start_allocation_tracing(frames: int = 1):
+    """
+    Start tracing the allocations, the overhead grows with the number of frames kept per allocation
+
+    :param frames: number of frames of the traceback of every allocation
+    :type frames: int
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(min(frames, MAX_TRACEBACK_FRAMES))
+
+
+def stop_allocation_tracing():
+    """
+    Stop tracing the allocations and drop the snapshots
+    """
+    tracemalloc.stop()
+    with _snapshots_lock:
+        _snapshots.clear()
+
+
+def take_snapshot(name: str) -> NamedSnapshot:
+    """
+    Take a snapshot of the traced allocations, a snapshot with the same name is replaced
+
+    :param name: name of the snapshot
+    :type name: str
+    :raises TracingNotStartedError: if the allocations are not traced
+    :return: the snapshot
+    :rtype: NamedSnapshot
+    """
+    if not tracemalloc.is_tracing():
+        raise TracingNotStartedError()
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+    named_snapshot = NamedSnapshot(
+        name=name,
+        taken=datetime.utcnow(),
+        snapshot=snapshot,
+        traced_bytes=sum(statistic.size for statistic in snapshot.statistics(GROUP_BY_FILE)),
+    )
+    with _snapshots_lock:
+        _snapshots.pop(name, None)
+        _snapshots[name] = named_snapshot
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    return named_snapshot
+
+
+def list_snapshots() -> List[NamedSnapshot]:
+    with _snapshots_lock:
+        return list(_snapshots.values())
+
+
+def delete_snapshot(name: str):
+    with _snapshots_lock:
+        if _snapshots.pop(name, None) is None:
+            raise SnapshotNotFoundError(name)
+
+
+def _get_snapshot(name: str) -> NamedSnapshot:
+    with _snapshots_lock:
+        named_snapshot = _snapshots.get(name)
+    if named_snapshot is None:
+        raise SnapshotNotFoundError(name)
+    return named_snapshot
+
+
+def compare_snapshots(old: str, new: str, group_by: str = GROUP_BY_LINE, limit: int = 50) -> List[AllocationDiff]:
+    """
+    Difference of the allocations between two snapshots, grouped by file or by line
+
+    :param old: name of the first snapshot
+    :type old: str
+    :param new: name of the second snapshot
+    :type new: str
+    :param group_by: GROUP_BY_LINE or GROUP_BY_FILE
+    :type group_by: str
+    :param limit: number of groups returned
+    :type limit: int
+    :raises SnapshotNotFoundError: if one of the snapshots doesn't exist
+    :return: the groups with the largest growth first
+    :rtype: List[AllocationDiff]
+    """
+    statistics = _get_snapshot(new).snapshot.compare_to(_get_snapshot(old).snapshot, group_by)
+    return [
+        AllocationDiff(
+            file=statistic.traceback[0].filename,
+            line=statistic.traceback[0].lineno if group_by == GROUP_BY_LINE else 0,
+            size_diff=statistic.size_diff,
+            size=statistic.size,
+            count_diff=statistic.count_diff,
+            count=statistic.count,
+        )
+        for statistic in statistics[:limit]
+    ]
+
+
+def traced_memory() -> Optional[Tuple[int, int]]:
+    """
+    Current and peak size of the traced allocations
+
+    :return: the sizes in bytes or None if the allocations are not traced
+    :rtype: Optional[Tuple[int, int]]
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.get_traced_memory()
@@ -0,0 +1,309 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# metrics.py
+# -------------------------------------------------------------------------------
+"""Prometheus metrics of the API Services"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import os
+import time
+from typing import Any, Dict
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# When several workers are running, every worker writes its metrics to this directory
+# and the /metrics endpoint aggregates them.
+MULTIPROCESS_DIRECTORY_ENVIRONMENT = "PROMETHEUS_MULTIPROC_DIR"
+
+# Requests that didn't match any route are grouped together to bound the number of series
+UNMATCHED_ROUTE = "unmatched"
+
+EVENT_LOOP_LAG_INTERVAL = 0.5
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+EVENT_LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+EVENT_LOOP_BLOCK_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CALL_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+HTTP_REQUESTS = Counter(
+    "sail_http_requests_total",
+    "Number of http requests",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "sail_http_request_duration_seconds",
+    "Latency of the http requests until the response is sent",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "sail_http_response_size_bytes",
+    "Size of the http response bodies as sent",
+    ["method", "route", "status"],
+    buckets=SIZE_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "sail_http_requests_in_flight",
+    "Number of http requests being handled",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+EVENT_LOOP_LAG = Histogram(
+    "sail_event_loop_lag_seconds",
+    "Delay of the event loop in running a scheduled callback",
+    buckets=EVENT_LOOP_LAG_BUCKETS,
+)
+EVENT_LOOP_BLOCKS = Counter(
+    "sail_event_loop_blocks_total",
+    "Number of times the event loop was blocked longer than the watchdog threshold",
+    ["callsite"],
+)
+EVENT_LOOP_BLOCK_DURATION = Histogram(
+    "sail_event_loop_block_duration_seconds",
+    "Time the event loop was blocked when the watchdog threshold was exceeded",
+    buckets=EVENT_LOOP_BLOCK_BUCKETS,
+)
+BACKGROUND_TASKS = Gauge(
+    "sail_background_tasks",
+    "Number of background tasks that are running",
+    multiprocess_mode="livesum",
+)
+JOBS_RUNNING = Gauge(
+    "sail_jobs_running",
+    "Number of jobs that are running",
+    ["type"],
+    multiprocess_mode="livesum",
+)
+JOBS_FINISHED = Counter(
+    "sail_jobs_finished_total",
+    "Number of attempts of the jobs that finished, by outcome",
+    ["type", "outcome"],
+)
+LOCK_ACQUISITIONS = Counter(
+    "sail_lock_acquisitions_total",
+    "Number of attempts to take a distributed lock, by outcome",
+    ["lock", "outcome"],
+)
+LEADERSHIP = Gauge(
+    "sail_leadership",
+    "Number of workers leading an election, 1 when the loop runs in one worker",
+    ["election"],
+    multiprocess_mode="livesum",
+)
+AZURE_TOKEN_FETCHES = Counter(
+    "sail_azure_token_fetches_total",
+    "Number of azure tokens fetched, by the background refresh or by a request that found no valid token",
+    ["path"],
+)
+DEPENDENCY_CALLS = Counter(
+    "sail_dependency_calls_total",
+    "Number of attempts of the calls to azure and the dns server, by http status or error",
+    ["dependency", "operation", "status"],
+)
+DEPENDENCY_CALL_DURATION = Histogram(
+    "sail_dependency_call_duration_seconds",
+    "Latency of the calls to azure and the dns server, with their retries",
+    ["dependency", "operation"],
+    buckets=CALL_BUCKETS,
+)
+DEPENDENCY_RATE_LIMIT_REMAINING = Gauge(
+    "sail_dependency_rate_limit_remaining",
+    "Requests left before azure resource manager throttles, from the x-ms-ratelimit-remaining headers",
+    ["dependency", "limit"],
+    multiprocess_mode="livemin",
+)
+DEPENDENCY_RETRIES = Counter(
+    "sail_dependency_retries_total",
+    "Number of calls to azure and the dns server tried again, by status code or error",
+    ["dependency", "operation", "reason"],
+)
+CIRCUIT_BREAKER_OPEN = Gauge(
+    "sail_circuit_breaker_open",
+    "Number of workers whose circuit of the dependency is open",
+    ["dependency"],
+    multiprocess_mode="livesum",
+)
+CIRCUIT_BREAKER_REJECTIONS = Counter(
+    "sail_circuit_breaker_rejections_total",
+    "Number of calls not sent because the circuit of the dependency was open",
+    ["dependency"],
+)
+BULKHEAD_IN_FLIGHT = Gauge(
+    "sail_bulkhead_in_flight",
+    "Number of calls to the dependency in flight",
+    ["dependency"],
+    multiprocess_mode="livesum",
+)
+CALL_DURATION = Histogram(
+    "sail_call_duration_seconds",
+    "Latency of the calls to the database, the cache and azure",
+    ["stage", "operation"],
+    buckets=CALL_BUCKETS,
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "sail_mongo_pool_connections",
+    "Number of connections in the mongodb connection pools",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "sail_mongo_pool_checkout_failures_total",
+    "Number of times a connection could not be checked out of the pool",
+    ["reason"],
+)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """
+    Track the open and checked out connections of the mongodb connection pools
+    """
+
+    def __init__(self):
+        self.open_connections = 0
+        self.checked_out_connections = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.open_connections += 1
+        MONGO_POOL_CONNECTIONS.labels(state="open").inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.open_connections -= 1
+        MONGO_POOL_CONNECTIONS.labels(state="open").dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILURES.labels(reason=str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        self.checked_out_connections += 1
+        MONGO_POOL_CONNECTIONS.labels(state="checked_out").inc()
+
+    def connection_checked_in(self, event):
+        self.checked_out_connections -= 1
+        MONGO_POOL_CONNECTIONS.labels(state="checked_out").dec()
+
+
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_INTERVAL):
+    """
+    Measure how late the event loop wakes up from a sleep, for as long as the loop runs
+
+    :param interval: time between two measurements in seconds
+    :type interval: float
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+
+def metrics_response_content() -> bytes:
+    """
+    Metrics in the prometheus text format, aggregated over all the workers if there are several
+
+    :return: the metrics
+    :rtype: bytes
+    """
+    if os.environ.get(MULTIPROCESS_DIRECTORY_ENVIRONMENT):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+
+_route_templates: Dict[Any, Dict[Any, str]] = {}
+
+
+def route_template(scope: Scope) -> str:
+    """
+    Path template of the route that handled the request, so that ids don't end up in the labels
+
+    :param scope: the scope of the request after routing
+    :type scope: Scope
+    :return: the route template
+    :rtype: str
+    """
+    app = scope.get("app")
+    if app not in _route_templates:
+        templates = {}
+        for route in getattr(app, "routes", []):
+            endpoint = getattr(route, "endpoint", None) or getattr(route, "app", None)
+            if endpoint is not None:
+                templates[endpoint] = route.path
+        _route_templates[app] = templates
+    return _route_templates[app].get(scope.get("endpoint"), UNMATCHED_ROUTE)
+
+
+class MetricsMiddleware:
+    """
+    Record the count, latency and response size of every http request by route template and status
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        start = time.perf_counter()
+        status_code = 500
+        response_size = 0
+
+        async def send_with_metrics(message: Message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.labels(method=method).inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.labels(method=method).dec()
+            labels = {"method": method, "route": route_template(scope), "status": str(status_code)}
+            HTTP_REQUESTS.labels(**labels).inc()
+            HTTP_REQUEST_DURATION.labels(**labels).observe(time.perf_counter() - start)
+            HTTP_RESPONSE_SIZE.labels(**labels).observe(response_size)
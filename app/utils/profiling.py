@@ -0,0 +1,303 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# profiling.py
+# -------------------------------------------------------------------------------
+"""Sampling profiler of single requests asked for by the admins"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import re
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import FrameType
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils.memory import track_structure
+from app.utils.tracing import current_span
+
+PROFILE_HEADER = "X-Profile"
+REQUEST_ID_HEADER = "X-Request-Id"
+PROFILE_URL_HEADER = "X-Profile-Url"
+PROFILES_URL = "/diagnostics/profiles"
+
+# Hard limits so that the profiler can stay enabled in production
+SAMPLE_INTERVAL = 0.005
+MAX_PROFILE_DURATION = 30.0
+MAX_CONCURRENT_PROFILES = 2
+MAX_PROFILES_PER_MINUTE = 10
+MAX_STORED_PROFILES = 20
+MAX_STACK_DEPTH = 128
+
+WAITING_FRAME = "(waiting)"
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+
+FrameKey = Tuple[str, str, int]
+
+
+@dataclass
+class RequestProfile:
+    """Samples of the stacks of one request"""
+
+    request_id: str
+    method: str
+    path: str
+    trace_id: Optional[str] = None
+    started: datetime = field(default_factory=datetime.utcnow)
+    start: float = field(default_factory=time.perf_counter)
+    duration: float = 0.0
+    frames: Dict[FrameKey, int] = field(default_factory=dict)
+    samples: List[List[int]] = field(default_factory=list)
+    weights: List[float] = field(default_factory=list)
+    # The tasks started while handling the request, in the order they were created
+    tasks: "weakref.WeakSet[asyncio.Task]" = field(default_factory=weakref.WeakSet)
+    task_order: List["weakref.ref[asyncio.Task]"] = field(default_factory=list)
+    done: threading.Event = field(default_factory=threading.Event)
+
+    def add_task(self, task: asyncio.Task):
+        self.tasks.add(task)
+        self.task_order.append(weakref.ref(task))
+
+    def add_sample(self, stack: List[FrameKey], weight: float):
+        self.samples.append([self.frames.setdefault(frame, len(self.frames)) for frame in stack])
+        self.weights.append(weight)
+
+    def speedscope(self) -> Dict[str, Any]:
+        """
+        The profile in the speedscope file format, which can be opened on https://www.speedscope.app
+
+        :return: the sampled profile
+        :rtype: Dict[str, Any]
+        """
+        frames = [{"name": name, "file": file, "line": line} for name, file, line in list(self.frames)]
+        # The sampling thread may still be adding the last sample
+        count = min(len(self.samples), len(self.weights))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.method} {self.path} {self.request_id}",
+            "exporter": "sail-api-services",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": f"{self.method} {self.path}",
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": self.duration,
+                    "samples": self.samples[:count],
+                    "weights": self.weights[:count],
+                }
+            ],
+        }
+
+
+def _frame_stack(frame: Optional[FrameType]) -> List[FrameKey]:
+    stack: List[FrameKey] = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append((getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _awaiting_stack(task: asyncio.Task) -> List[FrameKey]:
+    # Follow the chain of awaits of a suspended task down to where it is waiting
+    stack: List[FrameKey] = [(WAITING_FRAME, "", 0)]
+    awaitable: Any = task.get_coro()
+    while awaitable is not None and len(stack) < MAX_STACK_DEPTH:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        code = frame.f_code
+        stack.append((getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return stack
+
+
+class RequestProfiler:
+    """
+    Sample the stacks of the profiled requests from a thread
+
+    The tasks started by a profiled request are registered by a task factory, so that the samples of
+    the event loop are only kept when it runs one of them. When the loop runs something else the request
+    is waiting, and the sample is the chain of awaits of the newest task of the request that is not done.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.lock = threading.Lock()
+        self.active = 0
+        self.recent_starts: Deque[float] = deque()
+        self.profiles: "OrderedDict[str, RequestProfile]" = OrderedDict()
+
+    def install(self):
+        """
+        Register the tasks of the profiled requests, must be called from the event loop
+        """
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        previous_factory = self.loop.get_task_factory()
+
+        def task_factory(loop: asyncio.AbstractEventLoop, coro: Any, **kwargs):
+            if previous_factory is not None:
+                task = previous_factory(loop, coro, **kwargs)
+            else:
+                task = asyncio.Task(coro, loop=loop, **kwargs)
+            profile = _active_profile.get()
+            if profile is not None and not profile.done.is_set():
+                profile.add_task(task)
+            return task
+
+        self.loop.set_task_factory(task_factory)
+
+    def acquire(self) -> bool:
+        """
+        Take one of the profiling slots if the limits allow it
+
+        :return: True if the request can be profiled
+        :rtype: bool
+        """
+        if self.loop is None:
+            return False
+
+        now = time.monotonic()
+        with self.lock:
+            while self.recent_starts and now - self.recent_starts[0] > 60:
+                self.recent_starts.popleft()
+            if self.active >= MAX_CONCURRENT_PROFILES or len(self.recent_starts) >= MAX_PROFILES_PER_MINUTE:
+                return False
+            self.active += 1
+            self.recent_starts.append(now)
+            return True
+
+    def start(self, profile: RequestProfile):
+        profile.add_task(asyncio.current_task())  # type: ignore
+        threading.Thread(target=self._sample, args=(profile,), name="request-profiler", daemon=True).start()
+
+    def finish(self, profile: RequestProfile):
+        profile.duration = time.perf_counter() - profile.start
+        profile.done.set()
+        with self.lock:
+            self.active -= 1
+            self.profiles[profile.request_id] = profile
+            while len(self.profiles) > MAX_STORED_PROFILES:
+                self.profiles.popitem(last=False)
+
+    def _sample(self, profile: RequestProfile):
+        last_sample = time.perf_counter()
+        deadline = profile.start + MAX_PROFILE_DURATION
+        while not profile.done.wait(SAMPLE_INTERVAL):
+            now = time.perf_counter()
+            if now > deadline:
+                break
+            weight, last_sample = now - last_sample, now
+
+            running_task = asyncio.tasks._current_tasks.get(self.loop)  # type: ignore
+            if running_task is not None and running_task in profile.tasks:
+                frame = sys._current_frames().get(self.loop_thread_id)  # type: ignore
+                profile.add_sample(_frame_stack(frame), weight)
+                continue
+
+            for task_reference in reversed(profile.task_order):
+                task = task_reference()
+                if task is not None and not task.done():
+                    profile.add_sample(_awaiting_stack(task), weight)
+                    break
+
+    def get_profile(self, request_id: str) -> Optional[RequestProfile]:
+        with self.lock:
+            return self.profiles.get(request_id)
+
+    def list_profiles(self) -> List[RequestProfile]:
+        with self.lock:
+            return list(reversed(self.profiles.values()))
+
+
+profiler = RequestProfiler()
+track_structure("request_profiles", lambda: profiler.profiles)
+_active_profile: ContextVar[Optional[RequestProfile]] = ContextVar("active_profile", default=None)
+
+
+def enable_request_profiling():
+    """
+    Allow the profiling of requests on the running event loop
+    """
+    profiler.install()
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests with the X-Profile: 1 header when the user is allowed to
+
+    The profile is stored under the request id, which is returned in the X-Request-Id header along with
+    the url of the profile. Requests over the limits of the profiler are served without being profiled.
+    """
+
+    def __init__(self, app: ASGIApp, is_allowed: Callable[[Optional[str]], bool]):
+        self.app = app
+        self.is_allowed = is_allowed
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if headers.get(PROFILE_HEADER) != "1" or not self.is_allowed(headers.get("Authorization")):
+            await self.app(scope, receive, send)
+            return
+
+        if not profiler.acquire():
+
+            async def send_rate_limited(message: Message):
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message)[PROFILE_HEADER] = "rate-limited"
+                await send(message)
+
+            await self.app(scope, receive, send_rate_limited)
+            return
+
+        request_id = headers.get(REQUEST_ID_HEADER, "")
+        if not _REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        span = current_span()
+        profile = RequestProfile(
+            request_id=request_id,
+            method=scope["method"],
+            path=scope["path"],
+            trace_id=span.trace_id if span else None,
+        )
+
+        async def send_with_profile(message: Message):
+            if message["type"] == "http.response.start":
+                response_headers = MutableHeaders(scope=message)
+                response_headers[REQUEST_ID_HEADER] = request_id
+                response_headers[PROFILE_URL_HEADER] = f"{PROFILES_URL}/{request_id}"
+            await send(message)
+
+        token = _active_profile.set(profile)
+        profiler.start(profile)
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _active_profile.reset(token)
+            profiler.finish(profile)
@@ -0,0 +1,338 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# resilience.py
+# -------------------------------------------------------------------------------
+"""Retries, circuit breakers and bulkheads around the calls to azure and the dns server"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import functools
+import logging
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from app.utils.dependency_telemetry import dependency_telemetry
+from app.utils.metrics import BULKHEAD_IN_FLIGHT, CIRCUIT_BREAKER_OPEN, CIRCUIT_BREAKER_REJECTIONS, DEPENDENCY_RETRIES
+
+# Throttled, timed out or failed on the server side, the same request can succeed later
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+ResultType = TypeVar("ResultType")
+FunctionType = TypeVar("FunctionType", bound=Callable[..., Awaitable[Any]])
+
+
+class DependencyUnavailableError(Exception):
+    """
+    The dependency failed too often recently or asked to wait too long, the call was not sent
+    """
+
+    def __init__(self, dependency: str, reason: str, retry_after: float):
+        self.dependency = dependency
+        self.retry_after = retry_after
+        super().__init__(f"{dependency} is unavailable, {reason}, try again in {retry_after:.0f} seconds")
+
+
+def status_code_of(exception: BaseException) -> Optional[int]:
+    """
+    The http status of the response that failed, for the azure and the dns client errors
+
+    :param exception: the error raised by the call
+    :type exception: BaseException
+    :return: the status code, None if no response was received
+    :rtype: Optional[int]
+    """
+    status_code = getattr(exception, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(exception, "response", None), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable(exception: BaseException) -> bool:
+    """
+    The error is transient: the connection failed or timed out, or the server was throttling or failing
+
+    :param exception: the error raised by the call
+    :type exception: BaseException
+    :return: True if the call can be tried again
+    :rtype: bool
+    """
+    import httpx
+    from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+
+    if isinstance(
+        exception,
+        (asyncio.TimeoutError, ConnectionError, ServiceRequestError, ServiceResponseError, httpx.TransportError),
+    ):
+        return True
+    return status_code_of(exception) in RETRYABLE_STATUS_CODES
+
+
+def retry_after_of(exception: BaseException) -> Optional[float]:
+    """
+    The delay asked by the server before the next request, from the Retry-After headers of the response
+
+    :param exception: the error raised by the call
+    :type exception: BaseException
+    :return: the delay in seconds, None if the server didn't ask for one
+    :rtype: Optional[float]
+    """
+    headers = getattr(getattr(exception, "response", None), "headers", None)
+    if not headers:
+        return None
+    headers = {name.lower(): value for name, value in headers.items()}
+
+    for name in ["retry-after-ms", "x-ms-retry-after-ms"]:
+        if name in headers:
+            try:
+                return max(float(headers[name]) / 1000, 0.0)
+            except ValueError:
+                pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        # Or the date of the next allowed request
+        return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    # Waiting longer than this for a throttled dependency fails the call, the job is tried again later
+    max_retry_after: float = 60.0
+
+    def backoff(self, attempts: int) -> float:
+        """
+        Exponential backoff with full jitter before the next attempt
+
+        :param attempts: number of attempts already made
+        :type attempts: int
+        :return: the delay in seconds
+        :rtype: float
+        """
+        return random.uniform(0, min(self.base_delay * 2 ** (attempts - 1), self.max_delay))
+
+
+class CircuitBreaker:
+    """
+    Stop sending calls to a dependency after consecutive transient failures, then let one call through
+    after the reset timeout to find out whether it recovered
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_time = 0.0
+        self.probe_time = 0.0
+
+    def allow(self) -> bool:
+        """
+        The call can be sent, in the half open state only one call at a time probes the dependency
+
+        :return: False if the circuit is open
+        :rtype: bool
+        """
+        now = time.monotonic()
+        if self.state == CIRCUIT_CLOSED:
+            return True
+        if self.state == CIRCUIT_OPEN:
+            if now - self.opened_time < self.reset_timeout:
+                return False
+            self.state = CIRCUIT_HALF_OPEN
+            self.probe_time = now - self.reset_timeout
+        # A probe that never reported, because it was cancelled, is replaced after the reset timeout
+        if now - self.probe_time < self.reset_timeout:
+            return False
+        self.probe_time = now
+        return True
+
+    def retry_after(self) -> float:
+        return max(self.opened_time + self.reset_timeout - time.monotonic(), 0.0)
+
+    def record_success(self):
+        # Only the probe closes an open circuit, not the calls that were sent before it opened
+        if self.state == CIRCUIT_OPEN:
+            return
+        self.failures = 0
+        if self.state == CIRCUIT_HALF_OPEN:
+            logging.info(f"The circuit of {self.name} is closed again")
+            self.state = CIRCUIT_CLOSED
+            CIRCUIT_BREAKER_OPEN.labels(self.name).set(0)
+
+    def record_failure(self):
+        if self.state == CIRCUIT_OPEN:
+            return
+        self.failures += 1
+        if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+            logging.warning(f"The circuit of {self.name} is open after {self.failures} failures")
+            self.state = CIRCUIT_OPEN
+            self.opened_time = time.monotonic()
+            CIRCUIT_BREAKER_OPEN.labels(self.name).set(1)
+
+
+class Dependency:
+    """
+    A remote service called by the worker. The calls are bounded by a bulkhead so that a slow dependency can't
+    take all the connections and tasks of the worker, the transient failures are retried with backoff and stop
+    the calls for a while once they keep happening, and a Retry-After of the service delays all the calls.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        policy: Optional[RetryPolicy] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.name = name
+        self.policy = policy or RetryPolicy()
+        self.concurrency = concurrency
+        self.in_flight = 0
+        # Created on the loop that makes the calls, before python 3.10 it binds to the loop current at creation
+        # and the dependencies are created on import, before uvicorn starts its loop
+        self.bulkhead: Optional[asyncio.Semaphore] = None
+        self.bulkhead_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.throttled_until = 0.0
+
+    def _bulkhead(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self.bulkhead is None or self.bulkhead_loop is not loop:
+            self.bulkhead = asyncio.Semaphore(self.concurrency)
+            self.bulkhead_loop = loop
+        return self.bulkhead
+
+    async def call(
+        self, operation: str, function: Callable[..., Awaitable[ResultType]], *args: Any, **kwargs: Any
+    ) -> ResultType:
+        """
+        Call the function until it succeeds, fails with a permanent error or runs out of attempts
+
+        :param operation: name of the operation for the metrics
+        :type operation: str
+        :param function: the async function that calls the dependency
+        :type function: Callable[..., Awaitable[ResultType]]
+        :raises DependencyUnavailableError: if the circuit of the dependency is open or it is throttled for too long
+        :return: the result of the function
+        :rtype: ResultType
+        """
+        start = time.perf_counter()
+        attempts = 0
+        failed = True
+        try:
+            while True:
+                # Every caller waits for the end of the throttling asked by the dependency
+                throttled = self.throttled_until - time.monotonic()
+                if throttled > self.policy.max_retry_after:
+                    raise DependencyUnavailableError(self.name, "it is throttling the calls", throttled)
+                if throttled > 0:
+                    await asyncio.sleep(throttled)
+
+                if not self.breaker.allow():
+                    CIRCUIT_BREAKER_REJECTIONS.labels(self.name).inc()
+                    raise DependencyUnavailableError(self.name, "its circuit is open", self.breaker.retry_after())
+
+                attempts += 1
+                try:
+                    async with self._bulkhead():
+                        self.in_flight += 1
+                        BULKHEAD_IN_FLIGHT.labels(self.name).inc()
+                        attempt = dependency_telemetry.start_attempt(self.name, operation)
+                        try:
+                            result = await function(*args, **kwargs)
+                        except BaseException as exception:
+                            status_code = status_code_of(exception)
+                            dependency_telemetry.end_attempt(
+                                attempt, str(status_code) if status_code else type(exception).__name__
+                            )
+                            raise
+                        finally:
+                            self.in_flight -= 1
+                            BULKHEAD_IN_FLIGHT.labels(self.name).dec()
+                        dependency_telemetry.end_attempt(attempt, "success")
+                except Exception as exception:
+                    if not is_retryable(exception):
+                        # The dependency answered, the request itself is wrong
+                        self.breaker.record_success()
+                        raise
+
+                    self.breaker.record_failure()
+                    retry_after = retry_after_of(exception)
+                    if retry_after is not None:
+                        self.throttled_until = max(self.throttled_until, time.monotonic() + retry_after)
+                    if attempts >= self.policy.max_attempts or (retry_after or 0) > self.policy.max_retry_after:
+                        raise
+
+                    status_code = status_code_of(exception)
+                    DEPENDENCY_RETRIES.labels(
+                        self.name, operation, str(status_code) if status_code else type(exception).__name__
+                    ).inc()
+                    await asyncio.sleep(max(retry_after or 0, self.policy.backoff(attempts)))
+                    continue
+
+                self.breaker.record_success()
+                failed = False
+                return result
+        finally:
+            dependency_telemetry.record_call(self.name, operation, time.perf_counter() - start, attempts, failed)
+
+
+def resilient(dependency: Dependency) -> Callable[[FunctionType], FunctionType]:
+    """
+    Decorator sending every call of an async function through the retries, the circuit breaker and the bulkhead
+    of the dependency
+
+    :param dependency: the dependency the function calls
+    :type dependency: Dependency
+    """
+
+    def decorator(function: FunctionType) -> FunctionType:
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            return await dependency.call(function.__name__, function, *args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+# The deployments wait for minutes on their long running operation, they have a bulkhead of their own so
+# they can't hold all the calls to azure resource manager
+AZURE_RESOURCE_MANAGER = Dependency("azure_resource_manager", concurrency=16)
+AZURE_DEPLOYMENTS = Dependency("azure_deployments", concurrency=8, policy=RetryPolicy(max_attempts=3))
+AZURE_KEY_VAULT = Dependency("azure_key_vault", concurrency=32)
+AZURE_STORAGE = Dependency("azure_storage", concurrency=16)
+DNS = Dependency("dns", concurrency=4)
+
+dependencies: Dict[str, Dependency] = {
+    dependency.name: dependency
+    for dependency in [AZURE_RESOURCE_MANAGER, AZURE_DEPLOYMENTS, AZURE_KEY_VAULT, AZURE_STORAGE, DNS]
+}
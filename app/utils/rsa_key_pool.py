@@ -0,0 +1,160 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# rsa_key_pool.py
+# -------------------------------------------------------------------------------
+"""RSA keys created in the key vault ahead of the data submitters who need them"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from app.data import operations as data_service
+from app.models.common import KeyVaultObject, PyObjectId
+from app.models.rsa_key_pool import PooledRsaKey_Db, PooledRsaKeyState
+from app.utils.cloud import cloud_provider
+from app.utils.jobs import enqueue_job, job_handler
+from app.utils.locks import Lease, singleton_loop
+from app.utils.secrets import get_optional_secret
+
+DB_COLLECTION_RSA_KEY_POOL = "rsa-key-pool"
+
+RSA_KEY_SIZE = 4096
+
+# The pool is filled up to its size once fewer keys than the low water mark are available
+DEFAULT_LOW_WATER_MARK = 4
+DEFAULT_POOL_SIZE = 8
+REFILL_INTERVAL = 30.0
+
+
+def _pool_settings() -> Tuple[int, int]:
+    low_water_mark = int(get_optional_secret("rsa_key_pool_low_water_mark", DEFAULT_LOW_WATER_MARK))  # type: ignore
+    pool_size = int(get_optional_secret("rsa_key_pool_size", DEFAULT_POOL_SIZE))  # type: ignore
+    return low_water_mark, max(pool_size, low_water_mark)
+
+
+async def request_refill():
+    """
+    Queue the refill of the pool if it runs low. The refill is a job with a fixed idempotency key, so the
+    workers of all the replicas that find the pool low share one refill.
+    """
+    low_water_mark, _ = _pool_settings()
+    available = await data_service.count(DB_COLLECTION_RSA_KEY_POOL, {"state": PooledRsaKeyState.AVAILABLE.value})
+    if available < low_water_mark:
+        await enqueue_job(refill_rsa_key_pool, {}, idempotency_key="refill")
+
+
+async def claim_rsa_key(data_federation_id: PyObjectId, organization_id: PyObjectId) -> Optional[KeyVaultObject]:
+    """
+    Take an available key of the pool for a data submitter of a data federation, the key is tagged with them
+    by a background job
+
+    :param data_federation_id: the data federation
+    :type data_federation_id: PyObjectId
+    :param organization_id: the data submitter organization
+    :type organization_id: PyObjectId
+    :return: the key, or None if the pool is empty
+    :rtype: Optional[KeyVaultObject]
+    """
+    pooled_key = await data_service.find_one_and_update(
+        DB_COLLECTION_RSA_KEY_POOL,
+        {"state": PooledRsaKeyState.AVAILABLE.value},
+        {
+            "$set": {
+                "state": PooledRsaKeyState.CLAIMED.value,
+                "claimed_time": datetime.utcnow().isoformat(),
+                "data_federation_id": str(data_federation_id),
+                "organization_id": str(organization_id),
+            }
+        },
+        sort=[("created_time", 1)],
+    )
+    # The claim is answered even if the refill can't be queued, the periodic check queues it later
+    try:
+        await request_refill()
+    except Exception as exception:
+        logging.error(f"Failed to queue the refill of the RSA key pool: {exception}")
+    if pooled_key is None:
+        logging.warning("The pool of RSA keys is empty")
+        return None
+
+    pooled_key_db = PooledRsaKey_Db(**pooled_key)
+    await enqueue_job(tag_pooled_rsa_key, {"pooled_key_id": pooled_key_db.id}, idempotency_key=str(pooled_key_db.id))
+    return pooled_key_db.key
+
+
+@job_handler(concurrency=2)
+async def tag_pooled_rsa_key(pooled_key_id: PyObjectId):
+    """
+    Tag a claimed key of the pool with the data federation and the organization it belongs to
+
+    :param pooled_key_id: id of the key in the pool
+    :type pooled_key_id: PyObjectId
+    """
+    pooled_key = await data_service.find_one(DB_COLLECTION_RSA_KEY_POOL, {"_id": str(pooled_key_id)})
+    if not pooled_key:
+        return
+    pooled_key_db = PooledRsaKey_Db(**pooled_key)
+
+    account_credentials = await cloud_provider().authenticate()
+    await cloud_provider().tag_rsa_key(
+        account_credentials,
+        pooled_key_db.key,
+        {
+            "data_federation_id": str(pooled_key_db.data_federation_id),
+            "organization_id": str(pooled_key_db.organization_id),
+        },
+    )
+
+
+@job_handler(concurrency=1)
+async def refill_rsa_key_pool():
+    """
+    Create keys in the key vault until the pool is full again, once fewer keys than the low water mark are
+    available
+    """
+    low_water_mark, pool_size = _pool_settings()
+    available = await data_service.count(DB_COLLECTION_RSA_KEY_POOL, {"state": PooledRsaKeyState.AVAILABLE.value})
+    if available >= low_water_mark:
+        return
+
+    logging.info(f"Adding {pool_size - available} keys to the RSA key pool")
+    account_credentials = await cloud_provider().authenticate()
+    for _ in range(pool_size - available):
+        key = await cloud_provider().create_rsa_key(account_credentials, f"pool-{uuid.uuid4()}", RSA_KEY_SIZE)
+        if key is None:
+            raise Exception("Failed to create rsa key")
+        await data_service.insert_one(DB_COLLECTION_RSA_KEY_POOL, jsonable_encoder(PooledRsaKey_Db(key=key)))
+
+
+@singleton_loop("rsa-key-pool")
+async def check_rsa_key_pool(lease: Lease):
+    """
+    Check the pool periodically in one worker of all the replicas, so that it is filled at startup and after
+    a claim that failed to queue the refill
+
+    :param lease: the leadership of the loop
+    :type lease: Lease
+    """
+    try:
+        await data_service.create_index(DB_COLLECTION_RSA_KEY_POOL, [("state", 1), ("created_time", 1)])
+    except Exception as exception:
+        logging.error(f"Failed to create the index of the RSA key pool: {exception}")
+
+    while True:
+        try:
+            await request_refill()
+        except Exception as exception:
+            logging.error(f"Failed to check the RSA key pool: {exception}")
+        await asyncio.sleep(REFILL_INTERVAL)
@@ -13,6 +13,7 @@
 # -------------------------------------------------------------------------------
 
 import json
+from typing import Optional
 
 initialization_vector = None
 
@@ -34,3 +35,21 @@ def get_secret(secret_name: str) -> str:
         raise Exception(f"Secret {secret_name} not found")
 
     return initialization_vector.get(secret_name)
+
+
+def get_optional_secret(secret_name: str, default: Optional[str] = None) -> Optional[str]:
+    """Get the value of an optional setting
+
+    :param secret_name: key for the value to be fetched
+    :type secret_name: str
+    :param default: value returned when the key doesn't exist
+    :type default: Optional[str]
+    :return: the value for the key if it exists or the default
+    :rtype: Optional[str]
+    """
+    global initialization_vector
+    if not initialization_vector:
+        with open("InitializationVector.json") as file:
+            initialization_vector = json.load(file)
+
+    return initialization_vector.get(secret_name, default)
@@ -0,0 +1,139 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# serialization.py
+# -------------------------------------------------------------------------------
+"""Fast loading and serialization of models that don't need to be validated again"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, Type, TypeVar
+from uuid import UUID
+
+import orjson
+from fastapi import Response, status
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON, ModelField
+from pydantic.json import pydantic_encoder
+
+ModelType = TypeVar("ModelType", bound=BaseModel)
+
+# Plain values which are stored in the database as they are used by the models
+_PLAIN_TYPES = (str, int, float, bool)
+
+
+def _json_default(value: Any) -> Any:
+    # orjson only knows about uuid.UUID itself, not the PyObjectId subclass
+    if isinstance(value, UUID):
+        return str(value)
+    return pydantic_encoder(value)
+
+
+class _NotTrusted(Exception):
+    """The value can't be loaded without validation"""
+
+
+def _load_value(type_: Any, value: Any) -> Any:
+    if isinstance(type_, type):
+        if issubclass(type_, BaseModel):
+            if not isinstance(value, dict):
+                raise _NotTrusted()
+            return _construct(type_, value)
+        elif issubclass(type_, UUID):
+            return value if isinstance(value, UUID) else UUID(value)
+        elif issubclass(type_, Enum):
+            return type_(value)
+        elif issubclass(type_, datetime):
+            return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+        elif issubclass(type_, _PLAIN_TYPES):
+            # Constrained types like StrictStr are stored as their plain type
+            for plain_type in _PLAIN_TYPES:
+                if issubclass(type_, plain_type) and isinstance(value, plain_type):
+                    return value
+    raise _NotTrusted()
+
+
+def _load_field(field: ModelField, value: Any) -> Any:
+    if value is None and field.allow_none:
+        return None
+    elif field.sub_fields and field.shape == SHAPE_SINGLETON:
+        # Unions need the validation to pick the matching type
+        raise _NotTrusted()
+    elif field.shape == SHAPE_SINGLETON:
+        return _load_value(field.type_, value)
+    elif field.shape == SHAPE_LIST and isinstance(value, list):
+        return [_load_value(field.type_, item) for item in value]
+    raise _NotTrusted()
+
+
+def _construct(model: Type[ModelType], document: Dict[str, Any]) -> ModelType:
+    values: Dict[str, Any] = {}
+    fields_set = set()
+    for name, field in model.__fields__.items():
+        if field.alias in document:
+            values[name] = _load_field(field, document[field.alias])
+            fields_set.add(name)
+        elif name in document:
+            values[name] = _load_field(field, document[name])
+            fields_set.add(name)
+        elif field.required:
+            raise _NotTrusted()
+        else:
+            values[name] = field.get_default()
+
+    return model.construct(_fields_set=fields_set, **values)
+
+
+def trusted_construct(model: Type[ModelType], document: Dict[str, Any]) -> ModelType:
+    """
+    Load a document read from our own database without running the validation of the model
+
+    The documents were validated by the model before they were stored, so only the types which are
+    stored in their json form (ids, enums, timestamps and nested models) are converted back. If the
+    document doesn't look like it was written by the model it is validated as usual.
+
+    :param model: the model of the document
+    :type model: Type[ModelType]
+    :param document: the document as read from the database
+    :type document: Dict[str, Any]
+    :return: the model loaded from the document
+    :rtype: ModelType
+    """
+    try:
+        return _construct(model, document)
+    except (_NotTrusted, ValueError, TypeError):
+        return model(**document)
+
+
+def trusted_response(
+    content: BaseModel, exclude_unset: bool = False, status_code: int = status.HTTP_200_OK
+) -> Response:
+    """
+    Serialize a response model built by the route itself straight to json
+
+    Returning a response skips the validation of the content against the response_model of
+    the route and the jsonable_encoder pass, so only use it with content of the response model type.
+
+    :param content: the response model
+    :type content: BaseModel
+    :param exclude_unset: same as the response_model_exclude_unset of the route
+    :type exclude_unset: bool
+    :param status_code: status code of the response
+    :type status_code: int
+    :return: the json response
+    :rtype: Response
+    """
+    return Response(
+        content=orjson.dumps(
+            content.dict(exclude_unset=exclude_unset), default=_json_default, option=orjson.OPT_NON_STR_KEYS
+        ),
+        status_code=status_code,
+        media_type="application/json",
+    )
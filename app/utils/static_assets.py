@@ -0,0 +1,188 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# static_assets.py
+# -------------------------------------------------------------------------------
+"""Precompressed static assets served with content negotiation"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from typing import Dict
+
+from fastapi import Response, status
+from fastapi.requests import Request
+from starlette.types import Receive, Scope, Send
+
+from app.utils.compression import negotiate_encoding
+from app.utils.etag import etag_matches
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional, gzip is always available
+    brotli = None
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# Versioned urls never change their content, so they can be cached forever
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+# Unversioned urls must be revalidated with the ETag on every use
+CACHE_CONTROL_REVALIDATE = "no-cache"
+
+# Preferred order of the encodings when the client accepts them equally
+ENCODING_PREFERENCE = ["br", "gzip", "identity"]
+
+
+@dataclass
+class StaticAsset:
+    """A static file held in memory along with its precompressed variants"""
+
+    content_type: str
+    digest: str
+    encodings: Dict[str, bytes] = field(default_factory=dict)
+
+    def etag(self, encoding: str) -> str:
+        """
+        Strong ETag of one representation of the asset
+
+        :param encoding: the content encoding of the representation
+        :type encoding: str
+        :return: the quoted ETag value
+        :rtype: str
+        """
+        if encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+
+def build_static_asset(content: bytes, content_type: str) -> StaticAsset:
+    """
+    Compress the content with every available encoding
+
+    :param content: the uncompressed content
+    :type content: bytes
+    :param content_type: the media type of the content
+    :type content_type: str
+    :return: the asset with all its variants
+    :rtype: StaticAsset
+    """
+    asset = StaticAsset(content_type=content_type, digest=hashlib.sha256(content).hexdigest()[:32])
+    asset.encodings["identity"] = content
+
+    # mtime is fixed so that the compressed bytes are the same on every worker
+    gzip_content = gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+    if len(gzip_content) < len(content):
+        asset.encodings["gzip"] = gzip_content
+
+    if brotli is not None:
+        brotli_content = brotli.compress(content, quality=BROTLI_QUALITY)
+        if len(brotli_content) < len(content):
+            asset.encodings["br"] = brotli_content
+
+    return asset
+
+
+def asset_response(request: Request, asset: StaticAsset, cache_control: str) -> Response:
+    """
+    Build the response for a static asset honouring Accept-Encoding and If-None-Match
+
+    :param request: the http request object
+    :type request: Request
+    :param asset: the asset to send
+    :type asset: StaticAsset
+    :param cache_control: value of the Cache-Control header
+    :type cache_control: str
+    :return: 200 with the negotiated representation or 304 if the client copy is current
+    :rtype: Response
+    """
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), asset.encodings.keys(), ENCODING_PREFERENCE)
+    etag = asset.etag(encoding)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+
+    body = asset.encodings[encoding]
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(len(body))
+        return Response(status_code=status.HTTP_200_OK, headers=headers, media_type=asset.content_type)
+
+    return Response(content=body, status_code=status.HTTP_200_OK, headers=headers, media_type=asset.content_type)
+
+
+class PrecompressedStaticFiles:
+    """
+    ASGI app serving every file of a directory from memory with precompressed variants
+
+    The files are read and compressed once by load() and the versioned url of a file
+    is returned by url_for() so that pages can reference it with immutable caching.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def load(self):
+        """
+        Read and compress all the files in the directory. This is cpu heavy and should be run off the event loop.
+        """
+        assets: Dict[str, StaticAsset] = {}
+        for file_name in sorted(os.listdir(self.directory)):
+            file_path = os.path.join(self.directory, file_name)
+            if not os.path.isfile(file_path):
+                continue
+
+            content_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type == "application/javascript":
+                content_type = f"{content_type}; charset=utf-8"
+
+            with open(file_path, "rb") as file:
+                assets[file_name] = build_static_asset(file.read(), content_type)
+
+        self.assets = assets
+
+    def url_for(self, mount_path: str, file_name: str) -> str:
+        """
+        Get the content addressed url of a file
+
+        :param mount_path: the path where this app is mounted
+        :type mount_path: str
+        :param file_name: name of the file in the directory
+        :type file_name: str
+        :return: url with the version of the content in the query string
+        :rtype: str
+        """
+        if not self.assets:
+            self.load()
+        return f"{mount_path}/{file_name}?v={self.assets[file_name].digest}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not self.assets:
+            self.load()
+
+        request = Request(scope, receive)
+        asset = self.assets.get(scope["path"].lstrip("/"))
+
+        if request.method not in ("GET", "HEAD"):
+            response = Response(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, headers={"Allow": "GET, HEAD"})
+        elif asset is None:
+            response = Response(content="Not Found", status_code=status.HTTP_404_NOT_FOUND)
+        elif request.query_params.get("v") == asset.digest:
+            response = asset_response(request, asset, CACHE_CONTROL_IMMUTABLE)
+        else:
+            response = asset_response(request, asset, CACHE_CONTROL_REVALIDATE)
+
+        await response(scope, receive, send)
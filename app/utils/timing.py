@@ -0,0 +1,197 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# timing.py
+# -------------------------------------------------------------------------------
+"""Per request latency breakdown reported with the Server-Timing header"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import functools
+import json
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils.metrics import CALL_DURATION
+from app.utils.tracing import SPAN_KIND_CLIENT, start_span
+
+STAGE_AUTH = "auth"
+STAGE_DB = "db"
+STAGE_CACHE = "cache"
+STAGE_AZURE = "azure"
+
+# Request header asking for the debug breakdown and the response header carrying it.
+# Http trailers are not supported by uvicorn, so the debug json is sent as a header.
+TIMING_DEBUG_HEADER = "X-Timing-Debug"
+
+# Upper bound of the individual calls kept for the debug breakdown of one request
+MAX_DEBUG_EVENTS = 50
+
+FunctionType = TypeVar("FunctionType", bound=Callable[..., Any])
+
+
+@dataclass
+class RequestTimings:
+    """Time spent in each stage while handling one request"""
+
+    start: float = field(default_factory=time.perf_counter)
+    durations: Dict[str, float] = field(default_factory=dict)
+    counts: Dict[str, int] = field(default_factory=dict)
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    debug_allowed: bool = False
+    closed: bool = False
+
+    def record(self, stage: str, name: str, start: float, duration: float):
+        """
+        Add the duration of one call to its stage
+
+        :param stage: the stage of the call, like db or azure
+        :type stage: str
+        :param name: name of the function that was called
+        :type name: str
+        :param start: perf_counter value when the call started
+        :type start: float
+        :param duration: duration of the call in seconds
+        :type duration: float
+        """
+        # Background tasks started by the request inherit the context, they are not part of the response
+        if self.closed:
+            return
+
+        self.durations[stage] = self.durations.get(stage, 0.0) + duration
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+        if len(self.events) < MAX_DEBUG_EVENTS:
+            self.events.append(
+                {
+                    "stage": stage,
+                    "name": name,
+                    "start_ms": round((start - self.start) * 1000, 3),
+                    "dur_ms": round(duration * 1000, 3),
+                }
+            )
+
+    def server_timing(self, total: float) -> str:
+        """
+        Value of the Server-Timing header
+
+        :param total: time from the start of the request to the response in seconds
+        :type total: float
+        :return: the metrics of every stage and the total
+        :rtype: str
+        """
+        metrics = [
+            f'{stage};dur={duration * 1000:.3f};desc="{self.counts[stage]} calls"'
+            for stage, duration in self.durations.items()
+        ]
+        metrics.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(metrics)
+
+    def debug_json(self, total: float) -> str:
+        """
+        Breakdown of the individual calls for the debug header
+
+        :param total: time from the start of the request to the response in seconds
+        :type total: float
+        :return: compact json of the stages and the calls
+        :rtype: str
+        """
+        return json.dumps(
+            {
+                "total_ms": round(total * 1000, 3),
+                "stages": {stage: round(duration * 1000, 3) for stage, duration in self.durations.items()},
+                "calls": self.events,
+            },
+            separators=(",", ":"),
+        )
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """
+    Timings of the request being handled
+
+    :return: the timings or None outside of a request
+    :rtype: Optional[RequestTimings]
+    """
+    return _request_timings.get()
+
+
+def timed(stage: str) -> Callable[[FunctionType], FunctionType]:
+    """
+    Decorator reporting the duration of every call of an async function to the timings of the request
+    and to the latency metrics of the stage, the call is also traced in a span of its own
+
+    :param stage: the stage the function belongs to
+    :type stage: str
+    """
+
+    def decorator(function: FunctionType) -> FunctionType:
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            timings = _request_timings.get()
+            start = time.perf_counter()
+            try:
+                with start_span(
+                    f"{stage} {function.__name__}", kind=SPAN_KIND_CLIENT, attributes={"sail.stage": stage}
+                ):
+                    return await function(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                CALL_DURATION.labels(stage=stage, operation=function.__name__).observe(duration)
+                if timings is not None:
+                    timings.record(stage, function.__name__, start, duration)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+class ServerTimingMiddleware:
+    """
+    Collect the timings of every request and add the Server-Timing header to the response
+
+    The debug json of the individual calls is only added when the request asks for it with the
+    X-Timing-Debug header and the authenticated user is allowed to see it.
+    """
+
+    def __init__(self, app: ASGIApp, timing_allow_origin: Optional[str] = None):
+        self.app = app
+        self.timing_allow_origin = timing_allow_origin
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        debug_requested = Headers(scope=scope).get(TIMING_DEBUG_HEADER) == "1"
+
+        async def send_with_timings(message: Message):
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - timings.start
+                timings.closed = True
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.server_timing(total))
+                if self.timing_allow_origin:
+                    headers["Timing-Allow-Origin"] = self.timing_allow_origin
+                if debug_requested and timings.debug_allowed:
+                    headers[TIMING_DEBUG_HEADER] = timings.debug_json(total)
+            await send(message)
+
+        token = _request_timings.set(timings)
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _request_timings.reset(token)
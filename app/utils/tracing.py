@@ -0,0 +1,369 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# tracing.py
+# -------------------------------------------------------------------------------
+"""Distributed tracing of requests and background tasks"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import json
+import logging
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils.memory import track_structure
+from app.utils.metrics import route_template
+
+SERVICE_NAME = "sail-api-services"
+
+# Span kinds as defined by OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+TRACE_ID_HEADER = "X-Trace-Id"
+
+# Spans are exported in batches by a thread so that the event loop never waits on the exporter
+EXPORT_BATCH_SIZE = 256
+EXPORT_INTERVAL = 2.0
+EXPORT_QUEUE_SIZE = 8192
+
+
+@dataclass
+class Span:
+    """One timed operation of a trace"""
+
+    name: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: secrets.token_hex(8))
+    parent_span_id: Optional[str] = None
+    kind: int = SPAN_KIND_INTERNAL
+    start_time_ns: int = field(default_factory=time.time_ns)
+    end_time_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    links: List[Tuple[str, str]] = field(default_factory=list)
+    status_code: int = STATUS_CODE_OK
+    status_message: str = ""
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, exception: BaseException):
+        self.status_code = STATUS_CODE_ERROR
+        self.status_message = f"{type(exception).__name__}: {exception}"
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """
+        The span in the OTLP json encoding
+
+        :return: the encoded span
+        :rtype: Dict[str, Any]
+        """
+        otlp_span: Dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns or time.time_ns()),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "links": [{"traceId": trace_id, "spanId": span_id} for trace_id, span_id in self.links],
+            "status": {"code": self.status_code, "message": self.status_message},
+        }
+        if self.parent_span_id:
+            otlp_span["parentSpanId"] = self.parent_span_id
+        return otlp_span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    elif isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    elif isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def otlp_payload(spans: List[Span]) -> Dict[str, Any]:
+    """
+    Export request of a batch of spans in the OTLP json encoding
+
+    :param spans: the finished spans
+    :type spans: List[Span]
+    :return: the request body for /v1/traces
+    :rtype: Dict[str, Any]
+    """
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp() for span in spans]}],
+            }
+        ]
+    }
+
+
+class FileSpanExporter:
+    """
+    Append every batch as one line of OTLP json to a file, which can be replayed to a collector later
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        with open(self.path, "a") as file:
+            file.write(json.dumps(otlp_payload(spans), separators=(",", ":")) + "\n")
+
+
+class OtlpHttpSpanExporter:
+    """
+    Send every batch to an OTLP/HTTP collector with the json encoding
+    """
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+
+    def export(self, spans: List[Span]):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(otlp_payload(spans)).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class BatchSpanProcessor:
+    """
+    Queue the finished spans and export them in batches from a daemon thread
+
+    Spans are dropped when the queue is full so that a slow exporter can't hold memory or the event loop.
+    """
+
+    def __init__(self, exporter: Any):
+        self.exporter = exporter
+        self.queue: "queue.Queue[Span]" = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self.dropped_spans = 0
+        self.thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self.thread.start()
+
+    def on_end(self, span: Span):
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped_spans += 1
+
+    def _run(self):
+        while True:
+            batch: List[Span] = []
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while len(batch) < EXPORT_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self._export(batch)
+
+    def _export(self, batch: List[Span]):
+        try:
+            self.exporter.export(batch)
+        except Exception as exception:
+            logging.warning(f"Failed to export {len(batch)} spans: {exception}")
+
+    def flush(self):
+        """
+        Export the spans that are still queued, used on shutdown
+        """
+        batch: List[Span] = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._export(batch)
+
+
+_span_processor: Optional[BatchSpanProcessor] = None
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+track_structure("span_export_queue", lambda: _span_processor.queue.queue if _span_processor else [])
+
+
+def configure_tracing(exporter_name: Optional[str], file_path: Optional[str], otlp_endpoint: Optional[str]):
+    """
+    Select the exporter of the spans, tracing stays disabled without one
+
+    :param exporter_name: "file", "otlp" or None
+    :type exporter_name: Optional[str]
+    :param file_path: the file for the file exporter
+    :type file_path: Optional[str]
+    :param otlp_endpoint: base url of the collector for the otlp exporter, like http://localhost:4318
+    :type otlp_endpoint: Optional[str]
+    """
+    global _span_processor
+    if exporter_name == "file" and file_path:
+        _span_processor = BatchSpanProcessor(FileSpanExporter(file_path))
+    elif exporter_name == "otlp" and otlp_endpoint:
+        _span_processor = BatchSpanProcessor(OtlpHttpSpanExporter(otlp_endpoint))
+    else:
+        _span_processor = None
+
+
+def shutdown_tracing():
+    if _span_processor:
+        _span_processor.flush()
+
+
+def current_span() -> Optional[Span]:
+    """
+    The span of the operation being run
+
+    :return: the span or None if tracing is disabled or there is no span
+    :rtype: Optional[Span]
+    """
+    return _current_span.get()
+
+
+@contextmanager
+def start_span(
+    name: str,
+    kind: int = SPAN_KIND_INTERNAL,
+    attributes: Optional[Dict[str, Any]] = None,
+    parent: Optional[Span] = None,
+    trace_id: Optional[str] = None,
+    parent_span_id: Optional[str] = None,
+    links: Optional[List[Tuple[str, str]]] = None,
+) -> Iterator[Optional[Span]]:
+    """
+    Run the block inside of a new span, a child of the current span unless a parent is given
+
+    :param name: name of the operation
+    :type name: str
+    :param kind: one of the SPAN_KIND values
+    :type kind: int
+    :param attributes: attributes of the span
+    :type attributes: Optional[Dict[str, Any]]
+    :param parent: explicit parent span
+    :type parent: Optional[Span]
+    :param trace_id: trace to continue when the parent is remote
+    :type trace_id: Optional[str]
+    :param parent_span_id: id of the remote parent span
+    :type parent_span_id: Optional[str]
+    :param links: (trace id, span id) of related spans
+    :type links: Optional[List[Tuple[str, str]]]
+    :yield: the span or None if tracing is disabled
+    :rtype: Iterator[Optional[Span]]
+    """
+    if _span_processor is None:
+        yield None
+        return
+
+    parent = parent or _current_span.get()
+    span = Span(
+        name=name,
+        trace_id=trace_id or (parent.trace_id if parent else secrets.token_hex(16)),
+        parent_span_id=parent_span_id or (parent.span_id if parent else None),
+        kind=kind,
+        attributes=dict(attributes or {}),
+        links=list(links or []),
+    )
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as exception:
+        span.set_error(exception)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_time_ns = time.time_ns()
+        _span_processor.on_end(span)
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Trace id and parent span id from a W3C traceparent header
+
+    :param traceparent: value of the traceparent header
+    :type traceparent: Optional[str]
+    :return: the trace id and the span id or None if the header is missing or invalid
+    :rtype: Tuple[Optional[str], Optional[str]]
+    """
+    if not traceparent:
+        return None, None
+    parts = traceparent.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None, None
+    return parts[1], parts[2]
+
+
+class TracingMiddleware:
+    """
+    Run every http request in a server span named after the route template
+
+    The trace of the caller is continued when the request has a traceparent header and the trace
+    id is returned in the X-Trace-Id header so that it can be looked up from a client report.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or _span_processor is None:
+            await self.app(scope, receive, send)
+            return
+
+        trace_id, parent_span_id = parse_traceparent(Headers(scope=scope).get("traceparent"))
+        with start_span(
+            f"{scope['method']} {scope['path']}",
+            kind=SPAN_KIND_SERVER,
+            attributes={"http.method": scope["method"], "http.target": scope["path"]},
+            trace_id=trace_id,
+            parent_span_id=parent_span_id,
+        ) as span:
+
+            async def send_with_trace_id(message: Message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    MutableHeaders(scope=message)[TRACE_ID_HEADER] = span.trace_id
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                route = route_template(scope)
+                span.name = f"{scope['method']} {route}"
+                span.set_attribute("http.route", route)
+                if span.attributes.get("http.status_code", 500) >= 500:
+                    span.status_code = STATUS_CODE_ERROR
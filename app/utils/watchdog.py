@@ -0,0 +1,218 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# watchdog.py
+# -------------------------------------------------------------------------------
+"""Detection of the code that blocks the event loop"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app.utils.memory import track_structure
+from app.utils.metrics import EVENT_LOOP_BLOCK_DURATION, EVENT_LOOP_BLOCKS
+
+DEFAULT_THRESHOLD = 0.1
+HEARTBEAT_INTERVAL = 0.02
+
+# Upper bound of the distinct callsites kept, the rest are counted together
+MAX_CALLSITES = 100
+OTHER_CALLSITE = "other"
+
+# Frames of our own code are preferred when naming the callsite of a block
+_APP_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+
+@dataclass
+class BlockedCallsite:
+    """All the times the event loop was blocked by the same line of code"""
+
+    callsite: str
+    stack: List[str]
+    count: int = 0
+    total_blocked: float = 0.0
+    max_blocked: float = 0.0
+    last_seen: datetime = field(default_factory=datetime.utcnow)
+
+
+class EventLoopBlockedError(Exception):
+    """The event loop was blocked while it was required not to be"""
+
+    def __init__(self, callsites: List[BlockedCallsite]):
+        self.callsites = callsites
+        details = "\n".join(
+            f"  {callsite.callsite}: {callsite.count} times, max {callsite.max_blocked * 1000:.1f}ms"
+            for callsite in callsites
+        )
+        super().__init__(f"The event loop was blocked:\n{details}")
+
+
+class EventLoopWatchdog:
+    """
+    Watch the event loop from a thread and capture the stack of the loop whenever it stops running callbacks
+
+    A coroutine on the loop updates a heartbeat. When the heartbeat is older than the threshold, the
+    thread takes the stack of the loop thread, which is the code that is blocking it, and once the loop
+    is running again the time it was blocked is added to the callsite of that stack.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, interval: float = HEARTBEAT_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.callsites: Dict[str, BlockedCallsite] = {}
+        self.lock = threading.Lock()
+        self.last_beat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        """
+        Start watching the running event loop, must be called from the loop
+        """
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.stopped.clear()
+        self.heartbeat_task = asyncio.create_task(self._heartbeat())
+        self.thread = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+        self.thread.start()
+
+    async def stop(self):
+        self.stopped.set()
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+        if self.thread:
+            await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+
+    async def _heartbeat(self):
+        while True:
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        blocked_since: Optional[float] = None
+        blocked_stack: Tuple[str, List[str]] = ("", [])
+        while not self.stopped.wait(self.interval / 2):
+            last_beat = self.last_beat
+            if time.monotonic() - last_beat > self.threshold + self.interval:
+                if blocked_since is None:
+                    blocked_since = last_beat
+                    blocked_stack = self._capture_stack()
+            elif blocked_since is not None:
+                self._record(blocked_stack, max(0.0, last_beat - blocked_since - self.interval))
+                blocked_since = None
+
+    def _capture_stack(self) -> Tuple[str, List[str]]:
+        frame = sys._current_frames().get(self.loop_thread_id)  # type: ignore
+        if frame is None:
+            return OTHER_CALLSITE, []
+
+        stack = traceback.extract_stack(frame)
+        # Name the block after the innermost line of our own code, the library code below it is in the stack
+        callsite_frame = stack[-1]
+        for stack_frame in reversed(stack):
+            if stack_frame.filename.startswith(_APP_DIRECTORY):
+                callsite_frame = stack_frame
+                break
+
+        filename = callsite_frame.filename
+        if filename.startswith(_APP_DIRECTORY):
+            filename = os.path.relpath(filename, os.path.dirname(os.path.dirname(_APP_DIRECTORY)))
+        callsite = f"{filename}:{callsite_frame.lineno} in {callsite_frame.name}"
+        return callsite, [line.rstrip() for line in traceback.format_list(stack)]
+
+    def _record(self, blocked_stack: Tuple[str, List[str]], duration: float):
+        callsite, stack = blocked_stack
+        with self.lock:
+            if callsite not in self.callsites and len(self.callsites) >= MAX_CALLSITES:
+                callsite, stack = OTHER_CALLSITE, []
+            if callsite not in self.callsites:
+                self.callsites[callsite] = BlockedCallsite(callsite=callsite, stack=stack)
+
+            blocked_callsite = self.callsites[callsite]
+            blocked_callsite.count += 1
+            blocked_callsite.total_blocked += duration
+            blocked_callsite.max_blocked = max(blocked_callsite.max_blocked, duration)
+            blocked_callsite.last_seen = datetime.utcnow()
+
+        EVENT_LOOP_BLOCKS.labels(callsite=callsite).inc()
+        EVENT_LOOP_BLOCK_DURATION.observe(duration)
+
+    def report(self) -> List[BlockedCallsite]:
+        """
+        The callsites that blocked the event loop, the longest blocking first
+
+        :return: copy of the aggregated callsites
+        :rtype: List[BlockedCallsite]
+        """
+        with self.lock:
+            callsites = [
+                BlockedCallsite(**{name: getattr(callsite, name) for name in callsite.__dataclass_fields__})
+                for callsite in self.callsites.values()
+            ]
+        return sorted(callsites, key=lambda callsite: callsite.total_blocked, reverse=True)
+
+    def reset(self):
+        with self.lock:
+            self.callsites = {}
+
+
+watchdog: Optional[EventLoopWatchdog] = None
+track_structure("event_loop_blocks", lambda: watchdog.callsites if watchdog else {})
+
+
+def start_watchdog(threshold: float = DEFAULT_THRESHOLD):
+    """
+    Start the watchdog of the process on the running event loop
+
+    :param threshold: time in seconds the loop can be busy before it is reported as blocked
+    :type threshold: float
+    """
+    global watchdog
+    watchdog = EventLoopWatchdog(threshold=threshold)
+    watchdog.start()
+
+
+async def stop_watchdog():
+    if watchdog:
+        await watchdog.stop()
+
+
+@asynccontextmanager
+async def assert_no_blocking(threshold: float = DEFAULT_THRESHOLD) -> AsyncIterator[EventLoopWatchdog]:
+    """
+    Test mode of the watchdog, raise EventLoopBlockedError if the event loop was blocked inside the block
+
+    :param threshold: time in seconds the loop can be busy before it is reported as blocked
+    :type threshold: float
+    :raises EventLoopBlockedError: with the callsites that blocked the loop
+    :yield: the watchdog
+    :rtype: AsyncIterator[EventLoopWatchdog]
+    """
+    strict_watchdog = EventLoopWatchdog(threshold=threshold)
+    strict_watchdog.start()
+    try:
+        yield strict_watchdog
+        # Give the thread the chance to record a block that just ended
+        await asyncio.sleep(strict_watchdog.interval * 2)
+    finally:
+        await strict_watchdog.stop()
+
+    callsites = strict_watchdog.report()
+    if callsites:
+        raise EventLoopBlockedError(callsites)
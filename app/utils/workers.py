@@ -0,0 +1,26 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# workers.py
+# -------------------------------------------------------------------------------
+"""Gunicorn worker of the API Services"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+from uvicorn.workers import UvicornWorker
+
+
+class SailUvicornWorker(UvicornWorker):
+    """
+    Run the server with the uvloop event loop and the httptools parser in every worker process
+
+    The lifespan must succeed for the worker to boot, and on shutdown the open requests get 10 seconds
+    before the lifespan drains the background tasks.
+    """
+
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on", "timeout_graceful_shutdown": 10}
@@ -0,0 +1,134 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# cloud_flows.py
+# -------------------------------------------------------------------------------
+"""Measure the cloud calls of the provisioning, onboarding and key flows against the fake azure provider"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List
+
+from app.utils.azure import AzureCredentials
+from app.utils.fake_azure import FakeAzureProvider
+
+ACCOUNT_NAME = "benchmark"
+RESOURCE_GROUP_NAME = "benchmark-storage"
+
+
+async def register_secure_computation_node(provider: FakeAzureProvider, credentials: AzureCredentials) -> bool:
+    name = f"scn-{uuid.uuid4().hex[:8]}"
+    deploy_response = await provider.deploy_module(credentials, name, name, "Standard_D4s_v4", "")
+    return deploy_response.status == "Success"
+
+
+async def onboard_dataset(provider: FakeAzureProvider, credentials: AzureCredentials) -> bool:
+    share_name = uuid.uuid4().hex
+    create_response = await provider.create_file_share(credentials, RESOURCE_GROUP_NAME, ACCOUNT_NAME, share_name)
+    if create_response.status != "Success":
+        return False
+    connection_string = await provider.get_storage_account_connection_string(
+        credentials, RESOURCE_GROUP_NAME, ACCOUNT_NAME
+    )
+    if connection_string.status != "Success":
+        return False
+    directory_response = await provider.file_share_create_directory(connection_string.response, share_name, "v1")
+    if directory_response.status != "Success":
+        return False
+    sas_response = await provider.authentication_shared_access_signature(
+        credentials,
+        ACCOUNT_NAME,
+        RESOURCE_GROUP_NAME,
+        "v1/file",
+        share_name,
+        "w",
+        datetime.utcnow() + timedelta(hours=1),
+    )
+    return sas_response.status == "Success"
+
+
+async def dataset_key(provider: FakeAzureProvider, credentials: AzureCredentials) -> bool:
+    rsa_key = await provider.create_rsa_key(credentials, f"key-{uuid.uuid4()}", 4096)
+    if rsa_key is None:
+        return False
+    aes_key = os.urandom(32)
+    wrapped_key = await provider.wrap_aes_key(aes_key, rsa_key)
+    if wrapped_key is None:
+        return False
+    return await provider.unwrap_aes_with_rsa_key(wrapped_key, rsa_key) == aes_key
+
+
+FLOWS: Dict[str, Callable[[FakeAzureProvider, AzureCredentials], Awaitable[bool]]] = {
+    "register_secure_computation_node": register_secure_computation_node,
+    "onboard_dataset": onboard_dataset,
+    "dataset_key": dataset_key,
+}
+
+
+async def run_flow(
+    provider: FakeAzureProvider, credentials: AzureCredentials, flow: str, runs: int, concurrency: int
+) -> Dict[str, float]:
+    """
+    Run a flow with a bounded concurrency
+
+    :return: the latency percentiles in milliseconds and the number of failed runs
+    :rtype: Dict[str, float]
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async def run():
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                succeeded = await FLOWS[flow](provider, credentials)
+            except Exception:
+                succeeded = False
+            latencies.append((time.perf_counter() - start) * 1000)
+            failures += 0 if succeeded else 1
+
+    await asyncio.gather(*(run() for _ in range(runs)))
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {"p50": percentiles[49], "p95": percentiles[94], "failures": failures}
+
+
+async def main(args: argparse.Namespace):
+    settings = {}
+    if args.profiles:
+        with open(args.profiles) as profiles_file:
+            settings = json.load(profiles_file)
+    provider = FakeAzureProvider(settings)
+    credentials = await provider.authenticate()
+
+    print(f"{'flow':<36}{'p50 ms':>10}{'p95 ms':>10}{'failures':>10}")
+    for flow in args.flow or FLOWS:
+        result = await run_flow(provider, credentials, flow, args.runs, args.concurrency)
+        print(f"{flow:<36}{result['p50']:>10.1f}{result['p95']:>10.1f}{result['failures']:>10.0f}")
+    print(f"calls: {dict(provider.calls)}")
+    print(f"faults: {dict(provider.faults)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--flow", action="append", choices=list(FLOWS), help="flow to run, can be repeated")
+    parser.add_argument("--profiles", help="json file of the latency and fault profiles, as the fake_azure setting")
+    parser.add_argument("--runs", type=int, default=100, help="number of runs of every flow")
+    parser.add_argument("--concurrency", type=int, default=20, help="number of runs in flight")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
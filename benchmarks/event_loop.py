@@ -0,0 +1,77 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# event_loop.py
+# -------------------------------------------------------------------------------
+"""Fail when serving concurrent requests blocks the event loop"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+from app.main import server
+from app.utils.watchdog import DEFAULT_THRESHOLD, EventLoopBlockedError, assert_no_blocking
+
+
+async def run_requests(paths: List[str], headers: Dict[str, str], requests: int, concurrency: int) -> float:
+    """
+    Send the requests to the application in process with a bounded concurrency
+
+    :return: the number of requests per second
+    :rtype: float
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(app=server, base_url="http://benchmark") as client:
+
+        async def request(index: int):
+            async with semaphore:
+                response = await client.get(paths[index % len(paths)], headers=headers)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(request(index) for index in range(requests)))
+        return requests / (time.perf_counter() - start)
+
+
+async def main(args: argparse.Namespace) -> int:
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+
+    async with server.router.lifespan_context(server):
+        try:
+            async with assert_no_blocking(threshold=args.threshold_ms / 1000):
+                throughput = await run_requests(args.path, headers, args.requests, args.concurrency)
+        except EventLoopBlockedError as error:
+            print(error, file=sys.stderr)
+            return 1
+
+    print(f"requests:   {args.requests}")
+    print(f"throughput: {throughput:.1f} req/s")
+    print("the event loop was never blocked")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--path", action="append", help="path to request, can be repeated")
+    parser.add_argument("--token", help="access token sent with the requests")
+    parser.add_argument("--requests", type=int, default=500, help="number of requests")
+    parser.add_argument("--concurrency", type=int, default=20, help="number of requests in flight")
+    parser.add_argument(
+        "--threshold-ms", type=float, default=DEFAULT_THRESHOLD * 1000, help="longest allowed block of the loop"
+    )
+    args = parser.parse_args()
+    args.path = args.path or ["/docs", "/openapi.json", "/metrics"]
+
+    sys.exit(asyncio.run(main(args)))
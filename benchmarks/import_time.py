@@ -0,0 +1,123 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# import_time.py
+# -------------------------------------------------------------------------------
+"""Profile the import of the application and fail when it gets slow or loads the deferred modules"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List
+
+# Imported by the functions that use them, never by the import of the application
+DEFERRED_MODULES = [
+    "aiohttp",
+    "azure.identity",
+    "azure.keyvault",
+    "azure.mgmt",
+    "azure.storage",
+    "sail_dns_management_client",
+    "yaml",
+]
+
+DEFAULT_MAX_IMPORT_MS = 1500
+
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+@dataclass
+class ImportTime:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def profile_import(module: str) -> List[ImportTime]:
+    """
+    Import the module in a new interpreter with -X importtime, from an empty directory so that the import
+    fails if it reads the initialization vector
+
+    :param module: the module to import
+    :type module: str
+    :return: the time of every module imported, in the order they were done
+    :rtype: List[ImportTime]
+    """
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [repository, os.getenv("PYTHONPATH")]))}
+    with tempfile.TemporaryDirectory() as empty_directory:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=empty_directory,
+            env=environment,
+            capture_output=True,
+            text=True,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+
+    times = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            times.append(ImportTime(name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return times
+
+
+def by_package(times: List[ImportTime]) -> Dict[str, int]:
+    """
+    Self time of the imports summed by top level package, in microseconds
+    """
+    packages: Dict[str, int] = {}
+    for time in times:
+        package = time.module.split(".")[0]
+        packages[package] = packages.get(package, 0) + time.self_us
+    return dict(sorted(packages.items(), key=lambda item: item[1], reverse=True))
+
+
+def main(args: argparse.Namespace) -> int:
+    times = profile_import(args.module)
+    total_ms = next(time.cumulative_us for time in times if time.module == args.module) / 1000
+
+    print(f"import {args.module}: {total_ms:.0f} ms, {len(times)} modules")
+    print("slowest packages:")
+    for package, self_us in list(by_package(times).items())[: args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {package}")
+
+    failed = False
+    deferred = sorted(
+        {
+            time.module
+            for time in times
+            for prefix in DEFERRED_MODULES
+            if time.module == prefix or time.module.startswith(prefix + ".")
+        }
+    )
+    if deferred:
+        print(f"deferred modules imported at startup: {', '.join(deferred[:10])}", file=sys.stderr)
+        failed = True
+    if total_ms > args.max_ms:
+        print(f"import took {total_ms:.0f} ms, over the budget of {args.max_ms} ms", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="app.main", help="module imported by the workers")
+    parser.add_argument("--max-ms", type=int, default=DEFAULT_MAX_IMPORT_MS, help="budget of the import")
+    parser.add_argument("--top", type=int, default=15, help="number of packages reported")
+    sys.exit(main(parser.parse_args()))
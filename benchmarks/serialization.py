@@ -0,0 +1,140 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# serialization.py
+# -------------------------------------------------------------------------------
+"""Microbenchmark of loading a large listing from the database and serializing the response"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.models.common import BasicObjectInfo, KeyVaultObject, PyObjectId
+from app.models.data_federations import (
+    DataFederation_Db,
+    DataFederationDataFormat,
+    DataFederationState,
+    DataSubmitterIdKeyPair,
+    GetDataFederation_Out,
+    GetMultipleDataFederation_Out,
+)
+from app.utils.serialization import trusted_construct, trusted_response
+
+
+def make_documents(count: int) -> List[Dict[str, Any]]:
+    """
+    Data federations as they are stored in the database
+
+    :param count: number of documents
+    :type count: int
+    :return: the documents
+    :rtype: List[Dict[str, Any]]
+    """
+    documents = []
+    for index in range(count):
+        data_federation = DataFederation_Db(
+            name=f"Data federation {index}",
+            description="Benchmark data federation",
+            data_format=DataFederationDataFormat.FHIR,
+            data_model_id=PyObjectId(),
+            creation_time=datetime.utcnow(),
+            organization_id=PyObjectId(),
+            state=DataFederationState.ACTIVE,
+            data_submitters=[
+                DataSubmitterIdKeyPair(
+                    organization_id=PyObjectId(), key=KeyVaultObject(name=f"key-{index}", version="1")
+                )
+                for _ in range(3)
+            ],
+            research_organizations_id=[PyObjectId() for _ in range(3)],
+            datasets_id=[PyObjectId() for _ in range(5)],
+        )
+        documents.append(jsonable_encoder(data_federation, by_alias=True))
+    return documents
+
+
+# Stands in for the basic information that the routes read from the cache
+basic_info = BasicObjectInfo(id=PyObjectId(), name="Organization")
+
+
+def build_response(data_federations: List[DataFederation_Db]) -> GetMultipleDataFederation_Out:
+    return GetMultipleDataFederation_Out(
+        data_federations=[
+            GetDataFederation_Out(
+                **data_federation.dict(),
+                organization=basic_info,
+                data_submitter_organizations=[basic_info] * len(data_federation.data_submitters),
+                research_organizations=[basic_info] * len(data_federation.research_organizations_id),
+                datasets=[basic_info] * len(data_federation.datasets_id),
+            )
+            for data_federation in data_federations
+        ]
+    )
+
+
+response_field = create_response_field(name="benchmark_response", type_=GetMultipleDataFederation_Out)
+
+
+def validated(documents: List[Dict[str, Any]]) -> bytes:
+    """
+    Validated loading and the default response path of fastapi
+    """
+    response = build_response([DataFederation_Db(**document) for document in documents])
+    content = asyncio.run(
+        serialize_response(field=response_field, response_content=response, by_alias=False, exclude_unset=True)
+    )
+    return JSONResponse(content).body
+
+
+def trusted(documents: List[Dict[str, Any]]) -> bytes:
+    """
+    Trusted loading and the trusted response path
+    """
+    response = build_response([trusted_construct(DataFederation_Db, document) for document in documents])
+    return trusted_response(response, exclude_unset=True).body
+
+
+def measure(function: Callable[[List[Dict[str, Any]]], bytes], documents: List[Dict[str, Any]], rounds: int) -> float:
+    """
+    Best time per item of the function over a number of rounds in microseconds
+    """
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function(documents)
+        best = min(best, time.perf_counter() - start)
+    return best / len(documents) * 1_000_000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1000, help="number of items in the listing")
+    parser.add_argument("--rounds", type=int, default=5, help="number of rounds, the best one is reported")
+    args = parser.parse_args()
+
+    documents = make_documents(args.items)
+
+    # Both paths must produce the same json
+    assert json.loads(validated(documents)) == json.loads(trusted(documents))
+
+    before = measure(validated, documents, args.rounds)
+    after = measure(trusted, documents, args.rounds)
+    print(f"items: {args.items}")
+    print(f"validated: {before:.1f} us/item")
+    print(f"trusted:   {after:.1f} us/item")
+    print(f"speedup:   {before / after:.2f}x")
@@ -17,8 +17,15 @@ sed -i "s,auditserver,$auditIP,g" /promtail_local_config.yaml
 # Start the promtail client
 /promtail_linux_amd64 -config.file=/promtail_local_config.yaml  > /promtail.log 2>&1&
 
-# Start the Public API Server
-uvicorn app.main:server --host 0.0.0.0 --port 8000
+# Every worker writes its prometheus metrics to this directory and /metrics aggregates them
+export PROMETHEUS_MULTIPROC_DIR=/tmp/prometheus_multiproc
+rm -rf $PROMETHEUS_MULTIPROC_DIR && mkdir -p $PROMETHEUS_MULTIPROC_DIR
+
+# Number of worker processes of the API server, one per core unless it is set in the InitializationVector
+apiWorkers=$(cat /InitializationVector.json | jq -r '.api_workers // empty')
+export WEB_CONCURRENCY=${apiWorkers:-$(nproc)}
 
-# To keep the container running
-tail -f /dev/null
+# Start the Public API Server
+# exec replaces this shell so that the SIGTERM of a redeploy reaches gunicorn, whose workers stop accepting
+# connections, wait for the open requests and then drain the background tasks before exiting
+exec gunicorn app.main:server -c /gunicorn_conf.py
@@ -0,0 +1,42 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# gunicorn_conf.py
+# -------------------------------------------------------------------------------
+"""Gunicorn configuration of the multi-process server"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import multiprocessing
+import os
+
+from prometheus_client import multiprocess
+
+bind = "0.0.0.0:8000"
+
+# One worker per core unless WEB_CONCURRENCY is set
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "app.utils.workers.SailUvicornWorker"
+
+# Recycle the workers after a number of requests to bound the growth of their memory, the jitter
+# keeps them from restarting all at once
+max_requests = int(os.environ.get("MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 1000))
+
+# A worker whose event loop doesn't answer the arbiter for this long is restarted
+timeout = 60
+keepalive = 5
+
+# The open requests get 10 seconds and the background tasks shutdown_drain_timeout_seconds on shutdown
+graceful_timeout = 35
+
+
+def child_exit(server, worker):
+    # The live gauges of the worker are dropped from the aggregated metrics
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,31 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# conftest.py
+# -------------------------------------------------------------------------------
+"""Fixtures shared by the tests"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from app.data import operations as data_service
+
+
+@pytest.fixture
+def database():
+    """
+    An empty in-memory database in place of the connection opened by the lifespan
+    """
+    client = AsyncMongoMockClient()
+    data_service.client = client
+    data_service.sail_db = client.sailDatabase
+    yield data_service.sail_db
+    data_service.client = None
+    data_service.sail_db = None
@@ -0,0 +1,70 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# test_azure_credential.py
+# -------------------------------------------------------------------------------
+"""Tests of the azure credential shared by the clients"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import time
+from typing import List, Optional, Tuple
+
+from azure.core.credentials import AccessToken
+
+from app.utils.azure_credential import KEY_VAULT_SCOPE, MANAGEMENT_SCOPE, SharedCredential
+
+TENANT_ID = "tenant"
+
+
+class TokenSource:
+    """
+    The credential of the service principal, it records the tokens it issues
+    """
+
+    def __init__(self):
+        self.fetches: List[Tuple[Tuple[str, ...], Optional[str]]] = []
+
+    async def get_token(self, *scopes: str, tenant_id: Optional[str] = None, **kwargs) -> AccessToken:
+        self.fetches.append((scopes, tenant_id))
+        return AccessToken(f"token {len(self.fetches)}", int(time.time()) + 3600)
+
+    async def close(self):
+        pass
+
+
+async def started_credential() -> Tuple[SharedCredential, TokenSource]:
+    source = TokenSource()
+    credential = SharedCredential(source, tenant_id=TENANT_ID)  # type: ignore
+    credential.start()
+    while len(credential.tokens) < 2:
+        await asyncio.sleep(0)
+    return credential, source
+
+
+async def test_key_vault_challenge_uses_the_startup_token():
+    credential, source = await started_credential()
+
+    # The key vault challenge policy always asks for the tenant of the challenge
+    token = await credential.get_token(KEY_VAULT_SCOPE, tenant_id=TENANT_ID)
+
+    assert token == credential.tokens[(None, (KEY_VAULT_SCOPE,))]
+    assert source.fetches == [((MANAGEMENT_SCOPE,), None), ((KEY_VAULT_SCOPE,), None)]
+    await credential.close()
+
+
+async def test_token_of_another_tenant_is_fetched_once():
+    credential, source = await started_credential()
+
+    token = await credential.get_token(KEY_VAULT_SCOPE, tenant_id="other tenant")
+    same_token = await credential.get_token(KEY_VAULT_SCOPE, tenant_id="other tenant")
+
+    assert same_token == token
+    assert source.fetches[2:] == [((KEY_VAULT_SCOPE,), "other tenant")]
+    await credential.close()
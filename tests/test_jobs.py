@@ -0,0 +1,278 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# test_jobs.py
+# -------------------------------------------------------------------------------
+"""Tests of the durable background jobs"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List
+from uuid import UUID
+
+import pytest
+
+from app.data import operations as data_service
+from app.models.common import PyObjectId
+from app.models.jobs import JobState
+from app.utils import jobs
+from app.utils.jobs import DB_COLLECTION_JOBS, JobWorker, enqueue_job, get_job, job_handler, retry_job
+
+calls: List[PyObjectId] = []
+failures: List[str] = []
+release_jobs: Dict[str, asyncio.Event] = {}
+
+
+@job_handler(concurrency=2)
+async def succeeding_job(item_id: PyObjectId):
+    calls.append(item_id)
+
+
+@job_handler(max_attempts=2)
+async def failing_job(item_id: PyObjectId):
+    raise Exception("Nothing works")
+
+
+async def handle_failure(exception: Exception, item_id: PyObjectId):
+    failures.append(f"{item_id}: {exception}")
+
+
+@job_handler(max_attempts=1, on_failure=handle_failure)
+async def last_attempt_job(item_id: PyObjectId):
+    raise Exception("Still nothing works")
+
+
+@job_handler()
+async def blocking_job(name: str):
+    await release_jobs[name].wait()
+
+
+@pytest.fixture(autouse=True)
+def job_state(database):
+    calls.clear()
+    failures.clear()
+    release_jobs.clear()
+
+
+async def run_claimed_jobs(worker: JobWorker):
+    while await worker._claim_next() or worker.running:
+        await asyncio.gather(*worker.running)
+
+
+async def expire_lease(job_id: PyObjectId):
+    await data_service.update_one(
+        DB_COLLECTION_JOBS,
+        {"_id": str(job_id)},
+        {"$set": {"lease_expiry_time": (datetime.utcnow() - timedelta(seconds=1)).isoformat()}},
+    )
+
+
+async def test_enqueue_job_returns_the_active_job_with_the_same_key():
+    worker = JobWorker()
+    await worker._create_indexes()
+
+    job_id = await enqueue_job(succeeding_job, {"item_id": PyObjectId()}, idempotency_key="item")
+    same_job_id = await enqueue_job(succeeding_job, {"item_id": PyObjectId()}, idempotency_key="item")
+
+    assert same_job_id == job_id
+    assert len(await jobs.find_jobs()) == 1
+
+
+async def test_enqueue_job_refuses_a_function_that_is_not_a_job_handler():
+    async def not_a_job():
+        pass
+
+    with pytest.raises(ValueError):
+        await enqueue_job(not_a_job, {})
+
+
+async def test_job_runs_with_its_arguments_and_succeeds():
+    worker = JobWorker()
+    await worker._create_indexes()
+    item_id = PyObjectId()
+    job_id = await enqueue_job(succeeding_job, {"item_id": item_id}, idempotency_key="item")
+
+    await run_claimed_jobs(worker)
+
+    assert calls == [item_id]
+    assert isinstance(calls[0], UUID)
+    job_db = await get_job(job_id)
+    assert job_db.state == JobState.SUCCEEDED
+    assert job_db.attempts == 1
+    assert job_db.active_key is None
+    assert job_db.lease_owner is None
+
+    # The key is free again once the job finished
+    assert await enqueue_job(succeeding_job, {"item_id": item_id}, idempotency_key="item") != job_id
+
+
+async def test_failed_job_is_queued_again_after_a_backoff():
+    worker = JobWorker()
+    job_id = await enqueue_job(failing_job, {"item_id": PyObjectId()})
+
+    await run_claimed_jobs(worker)
+
+    job_db = await get_job(job_id)
+    assert job_db.state == JobState.QUEUED
+    assert job_db.attempts == 1
+    assert job_db.run_after > datetime.utcnow() + timedelta(seconds=jobs.RETRY_BASE_DELAY / 2 - 1)
+    assert job_db.last_error == "Exception: Nothing works"
+    # Not claimed again before the backoff ends
+    assert not await worker._claim_next()
+
+
+async def test_last_failed_attempt_handles_the_failure_and_fails_the_job():
+    worker = JobWorker()
+    item_id = PyObjectId()
+    job_id = await enqueue_job(last_attempt_job, {"item_id": item_id}, idempotency_key="item")
+
+    await run_claimed_jobs(worker)
+
+    job_db = await get_job(job_id)
+    assert job_db.state == JobState.FAILED
+    assert job_db.active_key is None
+    assert failures == [f"{item_id}: Still nothing works"]
+
+
+async def test_interrupted_last_attempt_fails_the_job():
+    worker = JobWorker()
+    release_jobs["job"] = asyncio.Event()
+    job_id = await enqueue_job(blocking_job, {"name": "job"})
+    await data_service.update_one(DB_COLLECTION_JOBS, {"_id": str(job_id)}, {"$set": {"max_attempts": 1}})
+    assert await worker._claim_next()
+
+    # The worker stops without releasing the job, which is claimed again once its lease expired
+    await expire_lease(job_id)
+    other_worker = JobWorker()
+    await run_claimed_jobs(other_worker)
+
+    job_db = await get_job(job_id)
+    assert job_db.state == JobState.FAILED
+    assert job_db.attempts == 2
+    assert job_db.last_error == "Exception: The job was interrupted on its last attempt"
+
+    release_jobs["job"].set()
+    await asyncio.gather(*worker.running)
+
+
+async def test_expired_lease_is_taken_over_and_the_old_result_is_dropped():
+    worker = JobWorker()
+    first_release = release_jobs["job"] = asyncio.Event()
+    job_id = await enqueue_job(blocking_job, {"name": "job"})
+    assert await worker._claim_next()
+    first_owner = (await get_job(job_id)).lease_owner
+    await asyncio.sleep(0)
+
+    await expire_lease(job_id)
+    release_jobs["job"] = asyncio.Event()
+    other_worker = JobWorker()
+    assert await other_worker._claim_next()
+    job_db = await get_job(job_id)
+    assert job_db.attempts == 2
+    assert job_db.lease_owner != first_owner
+
+    # The first worker finishes late, its result doesn't overwrite the job of the worker that took it over
+    first_release.set()
+    await asyncio.gather(*worker.running)
+    job_db = await get_job(job_id)
+    assert job_db.state == JobState.RUNNING
+    assert job_db.lease_owner != first_owner
+
+    release_jobs["job"].set()
+    await asyncio.gather(*other_worker.running)
+    assert (await get_job(job_id)).state == JobState.SUCCEEDED
+
+
+async def test_heartbeat_cancels_a_job_that_lost_its_lease(monkeypatch):
+    monkeypatch.setattr(jobs, "HEARTBEAT_INTERVAL", 0.01)
+    worker = JobWorker()
+    release_jobs["job"] = asyncio.Event()
+    job_id = await enqueue_job(blocking_job, {"name": "job"})
+    assert await worker._claim_next()
+    (task,) = worker.running
+
+    await data_service.update_one(DB_COLLECTION_JOBS, {"_id": str(job_id)}, {"$set": {"lease_owner": "other"}})
+    await asyncio.wait([task], timeout=1)
+
+    assert task.cancelled()
+    assert not worker.running
+
+
+async def test_heartbeat_extends_the_lease(monkeypatch):
+    monkeypatch.setattr(jobs, "HEARTBEAT_INTERVAL", 0.01)
+    worker = JobWorker()
+    release_jobs["job"] = asyncio.Event()
+    job_id = await enqueue_job(blocking_job, {"name": "job"})
+    assert await worker._claim_next()
+    first_expiry = (await get_job(job_id)).lease_expiry_time
+
+    await asyncio.sleep(0.05)
+
+    assert (await get_job(job_id)).lease_expiry_time > first_expiry
+    release_jobs["job"].set()
+    await asyncio.gather(*worker.running)
+
+
+async def test_concurrency_of_a_job_type_is_bounded():
+    worker = JobWorker()
+    for name in ["first", "second", "third"]:
+        release_jobs[name] = asyncio.Event()
+        await enqueue_job(blocking_job, {"name": name})
+
+    while await worker._claim_next():
+        pass
+
+    assert worker.running_by_type[jobs._handler_name(blocking_job)] == jobs.DEFAULT_CONCURRENCY
+    for event in release_jobs.values():
+        event.set()
+    await run_claimed_jobs(worker)
+    assert all(job_db.state == JobState.SUCCEEDED for job_db in await jobs.find_jobs())
+
+
+async def test_stop_queues_the_running_jobs_again_without_counting_the_attempt():
+    worker = JobWorker()
+    release_jobs["job"] = asyncio.Event()
+    job_id = await enqueue_job(blocking_job, {"name": "job"})
+    assert await worker._claim_next()
+
+    await worker.stop(timeout=0.01)
+
+    job_db = await get_job(job_id)
+    assert job_db.state == JobState.QUEUED
+    assert job_db.attempts == 0
+    assert job_db.lease_owner is None
+    assert not worker.running
+
+
+async def test_retry_job_queues_a_failed_job_with_all_its_attempts():
+    worker = JobWorker()
+    await worker._create_indexes()
+    job_id = await enqueue_job(last_attempt_job, {"item_id": PyObjectId()}, idempotency_key="item")
+    await run_claimed_jobs(worker)
+
+    assert await retry_job(job_id)
+
+    job_db = await get_job(job_id)
+    assert job_db.state == JobState.QUEUED
+    assert job_db.attempts == 0
+    assert job_db.active_key is not None
+    # Only a failed job is retried
+    assert not await retry_job(job_id)
+
+
+async def test_retry_job_refuses_a_job_whose_key_is_active_again():
+    worker = JobWorker()
+    await worker._create_indexes()
+    job_id = await enqueue_job(last_attempt_job, {"item_id": PyObjectId()}, idempotency_key="item")
+    await run_claimed_jobs(worker)
+    await enqueue_job(last_attempt_job, {"item_id": PyObjectId()}, idempotency_key="item")
+
+    assert not await retry_job(job_id)
+    assert (await get_job(job_id)).state == JobState.FAILED
@@ -0,0 +1,193 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# test_locks.py
+# -------------------------------------------------------------------------------
+"""Tests of the distributed locks and the leader election"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.data import operations as data_service
+from app.utils.locks import (
+    DB_COLLECTION_LOCKS,
+    LeaderElection,
+    Lease,
+    LockNotAcquiredError,
+    acquire_lock,
+    distributed_lock,
+    release_lock,
+    renew_lock,
+    update_fenced,
+)
+
+DB_COLLECTION_ITEMS = "items"
+
+
+@pytest.fixture(autouse=True)
+def lock_database(database):
+    pass
+
+
+async def expire_lock(name: str):
+    await data_service.update_one(
+        DB_COLLECTION_LOCKS,
+        {"_id": name},
+        {"$set": {"expiry_time": (datetime.utcnow() - timedelta(seconds=1)).isoformat()}},
+    )
+
+
+async def test_acquire_lock_refuses_a_held_lock():
+    lease = await acquire_lock("lock")
+
+    assert lease is not None
+    assert lease.token == 1
+    assert lease.valid
+    assert await acquire_lock("lock") is None
+
+
+async def test_expired_lock_is_taken_with_a_larger_token():
+    lease = await acquire_lock("lock")
+    await expire_lock("lock")
+
+    new_lease = await acquire_lock("lock")
+
+    assert new_lease is not None
+    assert new_lease.token == lease.token + 1
+    assert new_lease.owner != lease.owner
+    # The old holder can't extend or free the lock anymore
+    assert not await renew_lock(lease)
+    await release_lock(lease)
+    assert await acquire_lock("lock") is None
+    assert await renew_lock(new_lease)
+
+
+async def test_released_lock_is_free_again():
+    lease = await acquire_lock("lock")
+
+    await release_lock(lease)
+
+    assert not lease.valid
+    new_lease = await acquire_lock("lock")
+    assert new_lease is not None
+    assert new_lease.token == lease.token + 1
+
+
+async def test_update_fenced_rejects_the_writes_of_an_older_holder():
+    await data_service.insert_one(DB_COLLECTION_ITEMS, {"_id": "item", "value": 0})
+    lease = await acquire_lock("lock")
+    await expire_lock("lock")
+    new_lease = await acquire_lock("lock")
+
+    assert await update_fenced(DB_COLLECTION_ITEMS, {"_id": "item"}, {"$set": {"value": 2}}, new_lease)
+    # The old holder was paused while its lease expired and doesn't know it yet
+    assert lease.valid
+    assert not await update_fenced(DB_COLLECTION_ITEMS, {"_id": "item"}, {"$set": {"value": 1}}, lease)
+
+    item = await data_service.find_one(DB_COLLECTION_ITEMS, {"_id": "item"})
+    assert item["value"] == 2
+    assert item["fencing_tokens"] == {"lock": new_lease.token}
+
+
+async def test_update_fenced_rejects_an_expired_lease():
+    await data_service.insert_one(DB_COLLECTION_ITEMS, {"_id": "item", "value": 0})
+    lease = await acquire_lock("lock")
+    lease.deadline = 0
+
+    assert not await update_fenced(DB_COLLECTION_ITEMS, {"_id": "item"}, {"$set": {"value": 1}}, lease)
+    assert (await data_service.find_one(DB_COLLECTION_ITEMS, {"_id": "item"}))["value"] == 0
+
+
+async def test_distributed_lock_is_released_after_the_block():
+    async with distributed_lock("lock") as lease:
+        assert isinstance(lease, Lease)
+        with pytest.raises(LockNotAcquiredError):
+            async with distributed_lock("lock"):
+                pass
+
+    async with distributed_lock("lock") as new_lease:
+        assert new_lease.token == lease.token + 1
+
+
+async def test_distributed_lock_waits_for_the_lock(monkeypatch):
+    monkeypatch.setattr("app.utils.locks.LOCK_RETRY_INTERVAL", 0.01)
+    lease = await acquire_lock("lock")
+
+    async def release_later():
+        await asyncio.sleep(0.05)
+        await release_lock(lease)
+
+    release = asyncio.create_task(release_later())
+    async with distributed_lock("lock", wait=1) as new_lease:
+        assert new_lease.token == lease.token + 1
+    await release
+
+
+async def test_leader_election_hands_over_when_the_leader_stops():
+    started = []
+
+    async def leader_loop(lease: Lease):
+        started.append(lease.token)
+        await asyncio.Event().wait()
+
+    first_election = LeaderElection("election", leader_loop, ttl=0.6)
+    second_election = LeaderElection("election", leader_loop, ttl=0.6)
+    first_election.start()
+    await asyncio.sleep(0.05)
+    second_election.start()
+    await asyncio.sleep(0.05)
+
+    assert first_election.is_leader
+    assert not second_election.is_leader
+    assert started == [1]
+
+    # The leadership is released, so it is taken over before the lease would have expired
+    await first_election.stop()
+    assert first_election.loop is None
+    await asyncio.sleep(0.3)
+
+    assert second_election.is_leader
+    assert started == [1, 2]
+    await second_election.stop()
+
+
+async def test_leader_loop_that_outlived_its_cancel_timeout_does_not_start_a_second_loop(monkeypatch):
+    monkeypatch.setattr("app.utils.locks.CANCEL_TIMEOUT", 0.01)
+    started = []
+    release_first_loop = asyncio.Event()
+
+    async def leader_loop(lease: Lease):
+        started.append(lease.token)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if len(started) == 1:
+                await release_first_loop.wait()
+
+    election = LeaderElection("election", leader_loop, ttl=0.3)
+    election.start()
+    await asyncio.sleep(0.05)
+    first_loop = election.loop
+
+    # The first loop is still cleaning up when the campaign starts the loop again
+    await election._stop_loop()
+    await asyncio.sleep(0.15)
+    assert len(started) == 2
+    second_loop = election.loop
+
+    release_first_loop.set()
+    await asyncio.wait([first_loop], timeout=1)
+    assert election.loop is second_loop
+    await asyncio.sleep(0.15)
+
+    assert len(started) == 2
+    await election.stop()
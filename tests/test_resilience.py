@@ -0,0 +1,209 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# test_resilience.py
+# -------------------------------------------------------------------------------
+"""Tests of the retries, the circuit breaker and the bulkhead of the dependencies"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import pytest
+
+from app.utils.resilience import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    Dependency,
+    DependencyUnavailableError,
+    RetryPolicy,
+    retry_after_of,
+)
+
+
+class ResponseError(Exception):
+    """
+    An error of the dependency with the status and the headers of its response, like the azure client errors
+    """
+
+    def __init__(self, status_code: int, headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+        super().__init__(f"Status {status_code}")
+
+
+def new_dependency(**kwargs) -> Dependency:
+    return Dependency("test", concurrency=kwargs.pop("concurrency", 4), policy=RetryPolicy(base_delay=0.001), **kwargs)
+
+
+def failing_then_succeeding(errors: List[Exception]):
+    calls = []
+
+    async def function():
+        calls.append(time.monotonic())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "result"
+
+    return function, calls
+
+
+async def test_transient_failures_are_retried():
+    dependency = new_dependency()
+    function, calls = failing_then_succeeding([ResponseError(503), ConnectionError()])
+
+    assert await dependency.call("operation", function) == "result"
+    assert len(calls) == 3
+    assert dependency.breaker.state == CIRCUIT_CLOSED
+    assert dependency.breaker.failures == 0
+
+
+async def test_permanent_failure_is_not_retried():
+    dependency = new_dependency()
+    function, calls = failing_then_succeeding([ResponseError(404)])
+
+    with pytest.raises(ResponseError):
+        await dependency.call("operation", function)
+    assert len(calls) == 1
+    assert dependency.breaker.failures == 0
+
+
+async def test_call_fails_after_the_last_attempt():
+    dependency = new_dependency()
+    function, calls = failing_then_succeeding([ResponseError(500)] * 10)
+
+    with pytest.raises(ResponseError):
+        await dependency.call("operation", function)
+    assert len(calls) == dependency.policy.max_attempts
+
+
+async def test_retry_after_delays_the_next_attempt_of_every_caller():
+    dependency = new_dependency()
+    function, calls = failing_then_succeeding([ResponseError(429, {"Retry-After-Ms": "100"})])
+
+    assert await dependency.call("operation", function) == "result"
+    assert calls[1] - calls[0] >= 0.09
+
+    # The other callers wait for the end of the throttling too
+    dependency.throttled_until = time.monotonic() + 0.1
+    other_function, other_calls = failing_then_succeeding([])
+    started = time.monotonic()
+    await dependency.call("operation", other_function)
+    assert other_calls[0] - started >= 0.09
+
+
+async def test_long_throttling_fails_the_calls_at_once():
+    dependency = new_dependency()
+    function, calls = failing_then_succeeding([ResponseError(429, {"Retry-After": "3600"})])
+
+    with pytest.raises(ResponseError):
+        await dependency.call("operation", function)
+    assert len(calls) == 1
+
+    with pytest.raises(DependencyUnavailableError) as exception_info:
+        await dependency.call("operation", function)
+    assert len(calls) == 1
+    assert exception_info.value.retry_after > 3500
+
+
+async def test_circuit_opens_and_lets_one_probe_through():
+    dependency = new_dependency(failure_threshold=2, reset_timeout=0.05)
+    dependency.policy.max_attempts = 1
+    function, calls = failing_then_succeeding([ResponseError(503)] * 2)
+
+    for _ in range(2):
+        with pytest.raises(ResponseError):
+            await dependency.call("operation", function)
+    assert dependency.breaker.state == CIRCUIT_OPEN
+
+    with pytest.raises(DependencyUnavailableError):
+        await dependency.call("operation", function)
+    assert len(calls) == 2
+
+    # Once the reset timeout passed, only one call at a time probes the dependency
+    await asyncio.sleep(0.06)
+    probe_started = asyncio.Event()
+    release_probe = asyncio.Event()
+
+    async def probe():
+        probe_started.set()
+        await release_probe.wait()
+        return "result"
+
+    probe_task = asyncio.create_task(dependency.call("operation", probe))
+    await probe_started.wait()
+    assert dependency.breaker.state == CIRCUIT_HALF_OPEN
+    with pytest.raises(DependencyUnavailableError):
+        await dependency.call("operation", function)
+
+    release_probe.set()
+    assert await probe_task == "result"
+    assert dependency.breaker.state == CIRCUIT_CLOSED
+    assert await dependency.call("operation", function) == "result"
+
+
+async def test_failed_probe_opens_the_circuit_again():
+    dependency = new_dependency(failure_threshold=1, reset_timeout=0.05)
+    dependency.policy.max_attempts = 1
+    function, calls = failing_then_succeeding([ResponseError(503)] * 2)
+
+    with pytest.raises(ResponseError):
+        await dependency.call("operation", function)
+    await asyncio.sleep(0.06)
+    with pytest.raises(ResponseError):
+        await dependency.call("operation", function)
+
+    assert dependency.breaker.state == CIRCUIT_OPEN
+    with pytest.raises(DependencyUnavailableError):
+        await dependency.call("operation", function)
+    assert len(calls) == 2
+
+
+async def test_bulkhead_bounds_the_calls_in_flight():
+    dependency = new_dependency(concurrency=2)
+    in_flight = []
+
+    async def function():
+        in_flight.append(dependency.in_flight)
+        await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[dependency.call("operation", function) for _ in range(6)])
+
+    assert max(in_flight) == 2
+    assert dependency.in_flight == 0
+
+
+def test_bulkhead_works_on_every_event_loop():
+    dependency = new_dependency(concurrency=1)
+
+    async def calls():
+        async def function():
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*[dependency.call("operation", function) for _ in range(3)])
+
+    # The dependencies are created on import, before the loop of the server is started
+    asyncio.run(calls())
+    asyncio.run(calls())
+
+
+def test_retry_after_of_reads_the_headers():
+    next_request = datetime.now(timezone.utc) + timedelta(seconds=120)
+
+    assert retry_after_of(ResponseError(429, {"Retry-After": "5"})) == 5
+    assert retry_after_of(ResponseError(429, {"x-ms-retry-after-ms": "250"})) == 0.25
+    assert 100 < retry_after_of(ResponseError(503, {"Retry-After": format_datetime(next_request)})) <= 120
+    assert retry_after_of(ResponseError(503, {"Retry-After": "soon"})) is None
+    assert retry_after_of(ResponseError(503)) is None
+    assert retry_after_of(ConnectionError()) is None
@@ -0,0 +1,82 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# test_rsa_key_pool.py
+# -------------------------------------------------------------------------------
+"""Tests of the pool of RSA keys"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from app.data import operations as data_service
+from app.models.common import KeyVaultObject, PyObjectId
+from app.models.jobs import JobState
+from app.models.rsa_key_pool import PooledRsaKey_Db, PooledRsaKeyState
+from app.utils import rsa_key_pool
+from app.utils.fake_azure import FakeAzureProvider
+from app.utils.jobs import JobWorker, _handler_name, find_jobs
+from app.utils.rsa_key_pool import DB_COLLECTION_RSA_KEY_POOL, claim_rsa_key, refill_rsa_key_pool
+
+NO_LATENCY = {
+    "default": {"latency": {"distribution": "constant", "value_ms": 0}, "failure_rate": 0, "throttle_rate": 0}
+}
+
+
+@pytest.fixture(autouse=True)
+def pool(database, monkeypatch):
+    monkeypatch.setattr(rsa_key_pool, "_pool_settings", lambda: (2, 3))
+    provider = FakeAzureProvider(NO_LATENCY)
+    monkeypatch.setattr(rsa_key_pool, "cloud_provider", lambda: provider)
+    return provider
+
+
+async def add_keys(count: int):
+    for index in range(count):
+        pooled_key_db = PooledRsaKey_Db(key=KeyVaultObject(name=f"pool-{index}", version="1"))
+        await data_service.insert_one(DB_COLLECTION_RSA_KEY_POOL, jsonable_encoder(pooled_key_db))
+
+
+async def refill_jobs():
+    return await find_jobs(job_type=_handler_name(refill_rsa_key_pool))
+
+
+async def test_claim_above_the_low_water_mark_does_not_refill():
+    await add_keys(3)
+
+    assert await claim_rsa_key(PyObjectId(), PyObjectId()) is not None
+
+    assert await refill_jobs() == []
+
+
+async def test_claims_under_the_low_water_mark_share_one_refill():
+    await JobWorker()._create_indexes()
+    await add_keys(2)
+
+    await claim_rsa_key(PyObjectId(), PyObjectId())
+    await claim_rsa_key(PyObjectId(), PyObjectId())
+
+    assert len(await refill_jobs()) == 1
+
+
+async def test_refill_fills_the_pool(pool):
+    await add_keys(1)
+
+    await refill_rsa_key_pool()
+
+    available = await data_service.count(DB_COLLECTION_RSA_KEY_POOL, {"state": PooledRsaKeyState.AVAILABLE.value})
+    assert available == 3
+    assert len(pool.rsa_keys) == 2
+
+
+async def test_claim_from_an_empty_pool_queues_the_refill():
+    assert await claim_rsa_key(PyObjectId(), PyObjectId()) is None
+
+    (job_db,) = await refill_jobs()
+    assert job_db.state == JobState.QUEUED
@@ -0,0 +1,118 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# test_serialization.py
+# -------------------------------------------------------------------------------
+"""Tests of the loading of trusted documents and the json responses"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2022 Secure Ai Labs, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Secure Ai Labs, Inc.
+# -------------------------------------------------------------------------------
+
+import json
+from datetime import datetime
+from typing import List, Optional, Union
+from uuid import UUID
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from pydantic import Field, StrictInt, StrictStr, ValidationError
+
+from app.models.common import KeyVaultObject, PyObjectId, SailBaseModel
+from app.models.data_federations import (
+    DataFederation_Db,
+    DataFederationDataFormat,
+    DataFederationState,
+    DataSubmitterIdKeyPair,
+)
+from app.utils.serialization import trusted_construct, trusted_response
+
+
+class Item(SailBaseModel):
+    name: StrictStr = Field()
+    count: StrictInt = Field()
+
+
+class Container(SailBaseModel):
+    id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
+    items: List[Item] = Field(default_factory=list)
+    note: Optional[StrictStr] = Field(default=None)
+    value: Union[StrictInt, StrictStr] = Field(default=0)
+
+
+def stored_data_federation() -> dict:
+    data_federation = DataFederation_Db(
+        name="federation",
+        description="description",
+        data_format=DataFederationDataFormat.CSV,
+        organization_id=PyObjectId(),
+        state=DataFederationState.ACTIVE,
+        data_submitters=[
+            DataSubmitterIdKeyPair(organization_id=PyObjectId(), key=KeyVaultObject(name="key", version="1"))
+        ],
+        research_organizations_id=[PyObjectId(), PyObjectId()],
+    )
+    return jsonable_encoder(data_federation, by_alias=True)
+
+
+def test_trusted_construct_matches_the_validation():
+    document = stored_data_federation()
+
+    trusted = trusted_construct(DataFederation_Db, document)
+
+    assert trusted == DataFederation_Db(**document)
+    assert isinstance(trusted.id, UUID)
+    assert isinstance(trusted.creation_time, datetime)
+    assert trusted.state is DataFederationState.ACTIVE
+    assert isinstance(trusted.data_submitters[0], DataSubmitterIdKeyPair)
+    assert isinstance(trusted.data_submitters[0].key, KeyVaultObject)
+    assert all(isinstance(organization_id, UUID) for organization_id in trusted.research_organizations_id)
+
+
+def test_trusted_construct_keeps_the_fields_set():
+    document = stored_data_federation()
+    del document["datasets_id"]
+
+    trusted = trusted_construct(DataFederation_Db, document)
+
+    assert "datasets_id" not in trusted.__fields_set__
+    assert trusted.datasets_id == []
+    assert trusted.dict(exclude_unset=True) == DataFederation_Db(**document).dict(exclude_unset=True)
+
+
+def test_trusted_construct_validates_a_document_it_does_not_recognize():
+    document = {"_id": str(PyObjectId()), "items": [{"name": "item", "count": "3"}]}
+
+    # The count is a string, so the strict validation refuses the document instead of loading it as it is
+    with pytest.raises(ValidationError):
+        trusted_construct(Container, document)
+
+
+def test_trusted_construct_validates_a_document_without_a_required_field():
+    document = stored_data_federation()
+    del document["name"]
+
+    with pytest.raises(ValidationError):
+        trusted_construct(DataFederation_Db, document)
+
+
+def test_trusted_construct_validates_the_unions():
+    document = {"_id": str(PyObjectId()), "value": "text", "note": None}
+
+    container = trusted_construct(Container, document)
+
+    assert container.value == "text"
+    assert container.note is None
+
+
+def test_trusted_response_matches_the_json_encoder():
+    data_federation = DataFederation_Db(**stored_data_federation())
+
+    response = trusted_response(data_federation, exclude_unset=True, status_code=201)
+
+    assert response.status_code == 201
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == jsonable_encoder(data_federation, by_alias=False, exclude_unset=True)